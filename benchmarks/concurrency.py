@@ -0,0 +1,96 @@
+"""Measure read throughput with writers active as reader threads are added
+
+Reader threads fetch random thermostats while two writer threads update
+random thermostats as fast as they can. The service is measured as is,
+with lock-free copy-on-write reads, and with a single lock taken by
+readers and writers alike, as a coarse-grained alternative would.
+
+Usage: python benchmarks/concurrency.py [seconds]
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.service import Service
+
+
+class LockedService(Service):
+
+    def __init__(self, thermostats):
+        Service.__init__(self, thermostats)
+        self._lock = threading.Lock()
+
+    def thermostat(self, id):
+        with self._lock:
+            return Service.thermostat(self, id)
+
+    def _commit(self, id, values):
+        with self._lock:
+            Service._commit(self, id, values)
+
+
+def thermostats(count):
+    return [{
+        'id': id,
+        'name': 'Thermostat {}'.format(id),
+        'current-temp': 70,
+        'operating-mode': 'heat',
+        'cool-setpoint': 75,
+        'heat-setpoint': 65,
+        'fan-mode': 'auto'
+    } for id in xrange(count)]
+
+
+def run(service, readers, writers, seconds):
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0] * writers
+
+    def read(index):
+        rand = random.Random(index)
+        count = 0
+        while not stop.is_set():
+            for _ in xrange(100):
+                service.thermostat(rand.randrange(1000))
+            count += 100
+        reads[index] = count
+
+    def write(index):
+        rand = random.Random(-index)
+        count = 0
+        while not stop.is_set():
+            setpoint = rand.randint(40, 100)
+            service.update(rand.randrange(1000), {
+                'cool-setpoint': setpoint, 'heat-setpoint': setpoint - 10})
+            count += 1
+        writes[index] = count
+
+    threads = [threading.Thread(target=read, args=(index,))
+               for index in range(readers)]
+    threads += [threading.Thread(target=write, args=(index,))
+                for index in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(reads) / seconds, sum(writes) / seconds
+
+
+def main(seconds):
+    print('{:>8} {:>8} {:>14} {:>14}'.format(
+        'locking', 'readers', 'reads/s', 'writes/s'))
+    for name, cls in [('striped', Service), ('global', LockedService)]:
+        for readers in (1, 2, 4, 8):
+            reads, writes = run(cls(thermostats(1000)), readers, 2, seconds)
+            print('{:>8} {:>8} {:>14.0f} {:>14.0f}'.format(
+                name, readers, reads, writes))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2)
@@ -0,0 +1,87 @@
+"""Measure the write latency and restart time of the durable service
+
+A fleet is stored in a temporary directory and changed a number of
+times, reporting the latency of each change with the log synced in the
+background and with every change waiting for its sync. The service is
+then reopened, replaying the changes since the snapshot, and the time
+taken is reported alongside the time to build the same fleet from JSON.
+
+Usage: python benchmarks/durable.py [count] [changes]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.durable import DurableService
+from vivint.service import Service
+
+
+def thermostats(count):
+    for id in xrange(count):
+        yield {
+            'id': id,
+            'name': 'Thermostat {}'.format(id),
+            'current-temp': 60 + id % 20,
+            'operating-mode': ('cool', 'heat', 'off')[id % 3],
+            'cool-setpoint': 75,
+            'heat-setpoint': 65,
+            'fan-mode': ('auto', 'on')[id % 2],
+        }
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return [latencies[int(len(latencies) * p) - 1] * 1e6
+            for p in (0.5, 0.99, 1.0)]
+
+
+def writes(service, count, changes):
+    latencies = []
+    for change in xrange(changes):
+        start = time.time()
+        service.set_attribute(change * 7919 % count, 'cool-setpoint',
+                              70 + change % 10)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def main(count, changes):
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        DurableService(directory, thermostats(count)).close()
+        print('created {} thermostats in {:.2f}s'.format(
+            count, time.time() - start))
+
+        print('{:>10} {:>10} {:>10} {:>10}'.format(
+            'sync', 'p50 (us)', 'p99 (us)', 'max (us)'))
+        for sync in (False, True):
+            service = DurableService(directory, sync=sync,
+                                     snapshot_every=changes * 4)
+            latencies = writes(service, count, changes)
+            service.close()
+            print('{:>10} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                str(sync), *percentiles(latencies)))
+
+        start = time.time()
+        DurableService(directory).close()
+        print('restarted replaying {} changes in {:.2f}s'.format(
+            changes * 2, time.time() - start))
+
+        encoded = json.dumps(list(thermostats(count)))
+        start = time.time()
+        Service(json.loads(encoded))
+        print('built the same fleet from JSON in {:.2f}s'.format(
+            time.time() - start))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
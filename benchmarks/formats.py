@@ -0,0 +1,41 @@
+"""Compare the size and encoding time of JSON and MessagePack responses
+
+A generated fleet is encoded in each format the server supports, both as
+the response for the whole fleet and one thermostat at a time, and the
+whole fleet response is decoded again, reporting the size of the
+response and the time taken.
+
+Usage: python benchmarks/formats.py [thermostats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.fleet import thermostats
+from vivint.serializers import SERIALIZERS
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main(count):
+    fleet = list(thermostats(count))
+    print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'format', 'size (B)', 'encode (s)', 'per item (s)', 'decode (s)'))
+    for name in sorted(SERIALIZERS):
+        serializer = SERIALIZERS[name]()
+        body, encode = timed(serializer.dumps, {'result': fleet})
+        _, per_item = timed(lambda: [serializer.dumps(t) for t in fleet])
+        value, decode = timed(serializer.loads, body)
+        assert len(value['result']) == count
+        print('{:>10} {:>12} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+            name, len(body), encode, per_item, decode))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
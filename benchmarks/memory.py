@@ -0,0 +1,67 @@
+"""Compare the memory used by thermostat stores
+
+Each store is built in a fresh interpreter and the growth in resident
+memory is reported per thermostat. The dict store reproduces the
+original representation of one dict per thermostat while the record
+store is the Service as it is used today.
+
+Usage: python benchmarks/memory.py [count ...]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def thermostats(count):
+    for id in xrange(count):
+        yield {
+            'id': id,
+            'name': 'Thermostat {}'.format(id),
+            'current-temp': 60 + id % 20,
+            'operating-mode': ('cool', 'heat', 'off')[id % 3],
+            'cool-setpoint': 75,
+            'heat-setpoint': 65,
+            'fan-mode': ('auto', 'on')[id % 2],
+        }
+
+
+def build(store, count):
+    if store == 'dict':
+        return dict((t['id'], t) for t in thermostats(count))
+    elif store == 'record':
+        from vivint.service import Service
+        return Service(thermostats(count))
+    raise ValueError(store)
+
+
+def measure(store, count):
+    # Import everything up front so only the store itself is measured
+    from vivint.service import Service
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    data = build(store, count)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (after - before) * 1024
+
+
+def main(counts):
+    print('{:>8} {:>10} {:>14} {:>12}'.format(
+        'store', 'count', 'total (MiB)', 'bytes each'))
+    for count in counts:
+        for store in ('dict', 'record'):
+            output = subprocess.check_output([
+                sys.executable, __file__, '--measure', store, str(count)
+            ])
+            size = json.loads(output)
+            print('{:>8} {:>10} {:>14.1f} {:>12.0f}'.format(
+                store, count, size / 1048576.0, float(size) / count))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        print(json.dumps(measure(sys.argv[2], int(sys.argv[3]))))
+    else:
+        main([int(count) for count in sys.argv[1:]] or [10 ** 5, 10 ** 6])
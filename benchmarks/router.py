@@ -0,0 +1,104 @@
+"""Measure the cost of dispatching a request, apart from handling it
+
+Paths are first matched against web.py's list of regular expressions,
+as the server used to route requests, and against the Router's trie.
+Then requests are run through a web.py application routing with regular
+expressions and processors for the trailing slash redirect and format
+checks, as the server used to, first with web.py checking for modules
+to reload on every request, as it does by default, and then without.
+They are finally run through the server's Application. Every request
+is dispatched to a handler which does nothing, so only the framework's
+cost is measured.
+
+Usage: python benchmarks/router.py [requests]
+"""
+import os
+import sys
+import time
+import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint import server
+from vivint.router import Router
+from vivint.serializers import JSONSerializer
+
+
+PATHS = ['/thermostats/', '/thermostats/100/', '/thermostats/100/fan-mode/',
+         '/thermostats/100/events/', '/metrics/']
+
+
+class Handler:
+
+    def GET(self, *args):
+        return ''
+
+
+def redirect_to_slash(handler):
+    path = web.ctx.env['PATH_INFO']
+    if path[-1] != '/':
+        return web.redirect(path + '/')
+    return handler()
+
+
+def check_content_type(handler):
+    env = web.ctx.env
+    if env['REQUEST_METHOD'] in ('PUT', 'PATCH') and \
+            not env.get('CONTENT_TYPE', '').startswith('application/json'):
+        return web.unsupportedmediatype()
+    return handler()
+
+
+def per_call(function, count):
+    start = time.time()
+    for index in xrange(count):
+        function(PATHS[index % len(PATHS)])
+    return (time.time() - start) / count * 1e6
+
+
+def main(count):
+    patterns = (
+        '/thermostats/', Handler,
+        '/thermostats/events/', Handler,
+        '/thermostats/(\\w+)/', Handler,
+        '/thermostats/(\\w+)/events/', Handler,
+        '/thermostats/(\\w+)/([^/]+)/', Handler,
+        '/metrics/', Handler,
+    )
+    routes = [('/thermostats/', Handler),
+              ('/thermostats/events/', Handler),
+              ('/thermostats/<id>/', Handler),
+              ('/thermostats/<id>/events/', Handler),
+              ('/thermostats/<id>/<name>/', Handler),
+              ('/metrics/', Handler)]
+    reloading = web.application(patterns, {}, autoreload=True)
+    regex = web.application(patterns, {}, autoreload=False)
+    for app in (reloading, regex):
+        app.add_processor(redirect_to_slash)
+        app.add_processor(check_content_type)
+    trie = server.Application(routes, {})
+    serializer = JSONSerializer()
+    server.serializers = [serializer]
+    server.media_types = {serializer.media_type: serializer}
+
+    print('{:>10} {:>12} {:>14}'.format('', 'match (us)', 'request (us)'))
+    for name, app, match in [
+            ('reloading', reloading, None),
+            ('regex', regex, lambda path: regex._match(regex.mapping, path)),
+            ('trie', trie, Router(routes).match)]:
+        wsgi = app.wsgifunc()
+
+        def request(path):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                       'HTTP_HOST': 'localhost'}
+            for _ in wsgi(environ, lambda status, headers: None):
+                pass
+
+        print('{:>10} {:>12} {:>14.2f}'.format(
+            name, '' if match is None else
+            '{:.2f}'.format(per_call(match, count)),
+            per_call(request, count // 10)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
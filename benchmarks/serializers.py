@@ -0,0 +1,45 @@
+"""Compare json.dumps and json.loads with the server's JSONSerializer
+
+A generated fleet is encoded one thermostat at a time, as a filtered or
+streamed listing is, and as a single response, and then decoded again.
+The serializer's output is checked to be identical to json.dumps.
+
+Usage: python benchmarks/serializers.py [thermostats]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.fleet import thermostats
+from vivint.serializers import JSONSerializer
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main(count):
+    fleet = list(thermostats(count))
+    serializer = JSONSerializer()
+    print('{:>12} {:>14} {:>14} {:>14}'.format(
+        '', 'per item (s)', 'response (s)', 'decode (s)'))
+    results = []
+    for name, dumps, loads in [('json', json.dumps, json.loads),
+                               ('serializer', serializer.dumps,
+                                serializer.loads)]:
+        items, per_item = timed(lambda: [dumps(t) for t in fleet])
+        body, response = timed(dumps, {'result': fleet})
+        _, decode = timed(loads, body)
+        results.append((items, body))
+        print('{:>12} {:>14.3f} {:>14.3f} {:>14.3f}'.format(
+            name, per_item, response, decode))
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,92 @@
+"""Measure how long the command line takes to start
+
+Each command is run repeatedly in a new interpreter and the median time
+to exit is reported, along with the number of modules it imported,
+against an interpreter that does nothing. Python 2 has no -X importtime,
+so the slowest imports of each command are found by timing calls to
+__import__ in the child, cumulative time including nested imports.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+COMMANDS = [
+    ('python', None),
+    ('--version', ['--version']),
+    ('--help', ['--help']),
+    ('simulate --help', ['simulate', '--help']),
+    ('import server', 'server'),
+]
+
+# Runs the command line with the arguments given in a new interpreter,
+# or imports the module given, timing every import
+PROGRAM = '''
+import __builtin__
+import json
+import sys
+import time
+
+times = {}
+original = __builtin__.__import__
+
+def timed(name, *args, **kwargs):
+    start = time.time()
+    try:
+        return original(name, *args, **kwargs)
+    finally:
+        times[name] = times.get(name, 0) + time.time() - start
+
+__builtin__.__import__ = timed
+if sys.argv[1] == 'module':
+    __import__('vivint.' + sys.argv[2])
+elif sys.argv[1] == 'cli':
+    sys.argv = ['vivint'] + sys.argv[2:]
+    import vivint.cli
+    try:
+        vivint.cli.main()
+    except SystemExit:
+        pass
+__builtin__.__import__ = original
+slowest = sorted(times.items(), key=lambda item: -item[1])[:3]
+print(json.dumps([len([m for m in sys.modules.values() if m]), slowest]))
+'''
+
+
+def run(command):
+    if command is None:
+        args = ['pass']
+    elif isinstance(command, list):
+        args = [PROGRAM, 'cli'] + command
+    else:
+        args = [PROGRAM, 'module', command]
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c'] + args, cwd=ROOT,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = process.communicate()
+    elapsed = time.time() - start
+    if command is None:
+        return elapsed, '', []
+    modules, slowest = json.loads(stdout.splitlines()[-1])
+    return elapsed, modules, slowest
+
+
+def main(runs):
+    print('{:>16} {:>10} {:>8}  {}'.format(
+        'command', 'time (ms)', 'modules', 'slowest imports (ms)'))
+    for name, command in COMMANDS:
+        results = sorted(run(command) for _ in range(runs))
+        elapsed, modules, slowest = results[len(results) // 2]
+        print('{:>16} {:>10.1f} {:>8}  {}'.format(
+            name, elapsed * 1000, modules, ', '.join(
+                '{} {:.1f}'.format(module, seconds * 1000)
+                for module, seconds in slowest)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 11)
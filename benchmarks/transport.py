@@ -0,0 +1,64 @@
+"""Compare pooled device requests with a connection per request
+
+A simulated gateway is started in this process and thermostats are
+fetched from it by a number of client threads, first opening a new
+connection for every request and then through a Transport, which
+reuses pooled connections and shares concurrent fetches of the same
+thermostat.
+
+Usage: python benchmarks/transport.py [requests] [threads]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.simulator import DeviceSimulator
+from vivint.transport import Connection, Transport
+
+
+def unpooled(address, id):
+    connection = Connection(address, 1.0)
+    try:
+        return connection.request({'op': 'get', 'id': id}).wait(1.0)
+    finally:
+        connection.close()
+
+
+def run(fetch, requests, threads):
+    def work(offset):
+        for index in xrange(requests // threads):
+            fetch(100 + (offset + index) % 2)
+
+    workers = [threading.Thread(target=work, args=(offset,))
+               for offset in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+
+def main(requests, threads):
+    simulator = DeviceSimulator()
+    simulator.start()
+    address = simulator.server_address
+    transport = Transport.discover([address], size=4)
+    print('{:>10} {:>10} {:>12}'.format('mode', 'req/s', 'mean (us)'))
+    for name, fetch in [('unpooled', lambda id: unpooled(address, id)),
+                        ('pooled', transport.fetch)]:
+        simulator.requests = 0
+        elapsed = run(fetch, requests, threads)
+        print('{:>10} {:>10.0f} {:>12.1f}'.format(
+            name, requests / elapsed, elapsed / requests * threads * 1e6))
+        print('{:>10} {} device requests'.format('', simulator.requests))
+    transport.close()
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8)
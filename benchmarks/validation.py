@@ -0,0 +1,58 @@
+"""Compare validating changes one at a time with validating them in bulk
+
+A batch of changes, like a schedule pushed to a fleet, is validated
+first by calling the validator for each value, as update does, and then
+a column at a time with validate_many.
+
+Usage: python benchmarks/validation.py [thermostats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.errors import ServiceError
+from vivint.service import Service
+
+
+def changes(count):
+    return dict((id, {
+        'cool-setpoint': 70 + id % 40,
+        'heat-setpoint': str(60 + id % 10),
+        'operating-mode': ('cool', 'heat', 'off', 'auto')[id % 4],
+        'fan-mode': 'auto',
+    }) for id in xrange(count))
+
+
+def individually(service, changes):
+    result = {}
+    for id, values in changes.items():
+        result[id] = {}
+        for name, value in values.items():
+            try:
+                service._validate(name, value)
+                result[id][name] = 'ok'
+            except ServiceError as e:
+                result[id][name] = e.message
+    return result
+
+
+def main(count):
+    service = Service()
+    batch = changes(count)
+    values = count * 4
+    print('{:>14} {:>10} {:>14}'.format('mode', 'time (s)', 'per value (ns)'))
+    results = []
+    for name, validate in [('individually', individually),
+                           ('validate_many', Service.validate_many)]:
+        start = time.time()
+        results.append(validate(service, batch))
+        elapsed = time.time() - start
+        print('{:>14} {:>10.3f} {:>14.0f}'.format(
+            name, elapsed, elapsed / values * 1e9))
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 250000)
@@ -0,0 +1,67 @@
+"""Compare sending every change to a device with coalescing them
+
+A simulated gateway with a round trip latency is started in this process
+and a number of thermostats each have their cool setpoint dragged across
+a range, as a slider would, first with every change sent to the device
+straight away and then with the changes coalesced over a write window.
+The time taken by each change and the number of device writes are
+reported.
+
+Usage: python benchmarks/writes.py [thermostats] [changes] [window]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vivint.devices import CachedDeviceService
+from vivint.fleet import thermostats
+from vivint.simulator import DeviceSimulator
+from vivint.transport import Transport
+
+
+def drag(service, id, changes, latencies):
+    for change in xrange(changes):
+        start = time.time()
+        service.set_attribute(id, 'cool-setpoint', 50 + change % 50)
+        latencies.append(time.time() - start)
+        time.sleep(0.01)
+
+
+def run(service, count, changes):
+    latencies = []
+    workers = [threading.Thread(target=drag,
+                                args=(service, id, changes, latencies))
+               for id in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    service.close()
+    return sorted(latencies)
+
+
+def main(count, changes, window):
+    simulator = DeviceSimulator(thermostats(count), latency=0.005)
+    simulator.start()
+    print('{:>10} {:>10} {:>10} {:>10}'.format(
+        'window', 'p50 (us)', 'p99 (us)', 'writes'))
+    for name, options in [('none', {}), (str(window), {'window': window})]:
+        transport = Transport.discover([simulator.server_address], limit=64)
+        service = CachedDeviceService(transport, **options)
+        simulator.requests = 0
+        latencies = run(service, count, changes)
+        print('{:>10} {:>10.1f} {:>10.1f} {:>10}'.format(
+            name, latencies[len(latencies) // 2] * 1e6,
+            latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+            simulator.requests - count))
+        transport.close()
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0.25)
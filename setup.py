@@ -20,6 +20,9 @@ setup(
     license='MIT',
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
     install_requires=['web.py'],
+    extras_require={
+        'msgpack': ['msgpack'],
+    },
     entry_points={
         'console_scripts': ['vivint=vivint.cli:main'],
     },
@@ -0,0 +1,308 @@
+import argparse
+import httplib
+import json
+import logging
+import math
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import vivint
+
+from eventloop import HTTPServer
+from fleet import thermostats
+from server import Server
+from service import Service
+
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ('get-list', 'get-one', 'get-attribute', 'put', 'patch')
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('p999', 0.999))
+DEFAULT_MIX = 'get-list=1,get-one=10,get-attribute=10,put=2,patch=1'
+
+
+def parse_mix(mix):
+    """Parse a comma separated list of operation=weight pairs
+
+    >>> sorted(parse_mix('get-one=3,put=1').items())
+    [('get-one', 3), ('put', 1)]
+    >>> parse_mix('get-one=3,post=1')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown operation post
+    """
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS:
+            raise ValueError('unknown operation {}'.format(name))
+        weights[name] = int(weight or 1)
+    if sum(weights.values()) < 1:
+        raise ValueError('operation weights must not all be zero')
+    return weights
+
+
+def percentile(latencies, fraction):
+    """Return the given percentile of a sorted list of latencies
+
+    >>> percentile(range(1, 101), 0.95), percentile(range(1, 101), 0.999)
+    (95, 100)
+    """
+    if not latencies:
+        return None
+    index = int(math.ceil(fraction * len(latencies))) - 1
+    return latencies[min(len(latencies) - 1, max(0, index))]
+
+
+def summarize(latencies, errors, elapsed):
+    """Summarize the latencies, in seconds, of one kind of request"""
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+    }
+    for name, fraction in PERCENTILES:
+        value = percentile(latencies, fraction)
+        result[name] = None if value is None else value * 1000.0
+    return result
+
+
+class Client(threading.Thread):
+    """A thread issuing a mix of requests over a keep-alive connection"""
+
+    def __init__(self, port, weights, count, deadline, seed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.count = count
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.choices = []
+        for name in OPERATIONS:
+            self.choices += [name] * weights.get(name, 0)
+        self.latencies = dict((name, []) for name in OPERATIONS)
+        self.errors = dict((name, 0) for name in OPERATIONS)
+
+    def request(self, name):
+        id = self.random.randrange(self.count)
+        if name == 'get-list':
+            return 'GET', '/thermostats/', None
+        elif name == 'get-one':
+            return 'GET', '/thermostats/{}/'.format(id), None
+        elif name == 'get-attribute':
+            attribute = self.random.choice(['name', 'current-temp',
+                                            'operating-mode', 'fan-mode'])
+            return 'GET', '/thermostats/{}/{}/'.format(id, attribute), None
+        elif name == 'put':
+            value = self.random.randint(70, 85)
+            return 'PUT', '/thermostats/{}/cool-setpoint/'.format(id), \
+                json.dumps(value)
+        value = {'heat-setpoint': self.random.randint(55, 69),
+                 'fan-mode': self.random.choice(['auto', 'on'])}
+        return 'PATCH', '/thermostats/{}/'.format(id), json.dumps(value)
+
+    def run(self):
+        connection = None
+        headers = {'Content-Type': 'application/json'}
+        while time.time() < self.deadline:
+            name = self.random.choice(self.choices)
+            method, url, body = self.request(name)
+            if connection is None:
+                connection = httplib.HTTPConnection('127.0.0.1', self.port)
+            start = time.time()
+            try:
+                connection.request(method, url, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (httplib.HTTPException, socket.error):
+                self.errors[name] += 1
+                connection.close()
+                connection = None
+                continue
+            self.latencies[name].append(time.time() - start)
+            if response.status >= 400:
+                self.errors[name] += 1
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+
+
+def start_server(engine, count):
+    """Fork a process serving a fleet of count thermostats
+
+    Returns the process id and the port the server is listening on.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    if engine == 'asyncore':
+        sock.listen(1024)
+    else:
+        sock.close()
+
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            app = Server(Service(thermostats(count))).app.wsgifunc()
+            if engine == 'asyncore':
+                HTTPServer(app, sock=sock).serve_forever()
+            else:
+                import web
+                web.httpserver.WSGIServer(('127.0.0.1', port), app).start()
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            logger.exception('benchmark server failed')
+            status = 1
+        finally:
+            os._exit(status)
+    if engine == 'asyncore':
+        sock.close()
+
+    deadline = time.time() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return pid, port
+        except socket.error:
+            if time.time() > deadline:
+                stop_server(pid)
+                raise RuntimeError('benchmark server did not start')
+            time.sleep(0.05)
+
+
+def stop_server(pid):
+    """Stop a server started by start_server"""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+def run(engine='asyncore', thermostats=1000, concurrency=10, duration=10.0,
+        mix=DEFAULT_MIX, warmup=1.0, seed=0):
+    """Run a benchmark and return its results
+
+    A server for a fleet of the given number of thermostats is started
+    in a separate process and driven by concurrent clients for the
+    duration, in seconds, after a warm up period whose requests are not
+    counted. Latencies in the results are in milliseconds.
+    """
+    weights = parse_mix(mix)
+    pid, port = start_server(engine, thermostats)
+    try:
+        if warmup > 0:
+            deadline = time.time() + warmup
+            clients = [Client(port, weights, thermostats, deadline, -i)
+                       for i in range(concurrency)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+
+        start = time.time()
+        deadline = start + duration
+        clients = [Client(port, weights, thermostats, deadline, seed + i)
+                   for i in range(concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.time() - start
+    finally:
+        stop_server(pid)
+
+    operations = {}
+    every = []
+    for name in OPERATIONS:
+        latencies = []
+        errors = 0
+        for client in clients:
+            latencies += client.latencies[name]
+            errors += client.errors[name]
+        every += latencies
+        if weights.get(name):
+            operations[name] = summarize(latencies, errors, elapsed)
+    return {
+        'version': vivint.__version__,
+        'python': sys.version.split()[0],
+        'engine': engine,
+        'thermostats': thermostats,
+        'concurrency': concurrency,
+        'duration': elapsed,
+        'mix': weights,
+        'total': summarize(every, sum(o['errors'] for o in operations.values()),
+                           elapsed),
+        'operations': operations,
+    }
+
+
+def report(results, out=sys.stdout):
+    """Write a human readable table of benchmark results"""
+    out.write('{} engine, {} thermostats, {} clients, {:.1f}s\n\n'.format(
+        results['engine'], results['thermostats'], results['concurrency'],
+        results['duration']))
+    columns = ['requests', 'errors', 'req/s'] + [n for n, _ in PERCENTILES]
+    out.write('{:<14}'.format('operation') +
+              ''.join('{:>10}'.format(c) for c in columns) + '\n')
+    rows = sorted(results['operations'].items()) + [('total', results['total'])]
+    for name, summary in rows:
+        values = [summary['requests'], summary['errors'],
+                  '{:.0f}'.format(summary['throughput'])]
+        values += ['-' if summary[n] is None else '{:.2f}'.format(summary[n])
+                   for n, _ in PERCENTILES]
+        out.write('{:<14}'.format(name) +
+                  ''.join('{:>10}'.format(v) for v in values) + '\n')
+    out.write('\nlatencies in milliseconds\n')
+
+
+def main(argv=None):
+    """Run the benchmark from the command line"""
+    parser = argparse.ArgumentParser(
+        prog='vivint bench',
+        description='Benchmark the thermostat web service on localhost')
+    parser.add_argument('--engine', default='asyncore',
+                        choices=['webpy', 'asyncore'],
+                        help='web server implementation (default: asyncore)')
+    parser.add_argument('--thermostats', type=int, default=1000,
+                        help='number of thermostats (default: 1000)')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='number of concurrent clients (default: 10)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to measure for (default: 10)')
+    parser.add_argument('--warmup', type=float, default=1.0,
+                        help='seconds to warm up for (default: 1)')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weighted mix of operations from {} '
+                             '(default: {})'.format(', '.join(OPERATIONS),
+                                                    DEFAULT_MIX))
+    parser.add_argument('--json', dest='output',
+                        help="write results as JSON to a file, or '-' for "
+                             'standard output')
+    args = parser.parse_args(argv)
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = run(args.engine, args.thermostats, args.concurrency,
+                  args.duration, args.mix, args.warmup)
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+        return
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,267 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+from serializers import JSONSerializer
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """A cache of encoded responses for thermostat reads
+
+    Thermostat data only changes when the service sets an attribute, so
+    rather than encoding the whole fleet on every request the encoded
+    form of each thermostat is kept and only the entries for thermostats
+    that have changed are rebuilt.
+
+    Entries are stamped with the service version they were built from
+    and are rebuilt once that version moves on, so the cache remains
+    correct even when the data is modified by another process. The
+    listing of every thermostat keeps the encoded thermostats in order
+    of id and only replaces those the service reports as changed, or
+    checks the version of each if it cannot say.
+
+    The hits and misses attributes count how often a response could be
+    served without encoding anything.
+    """
+
+    def __init__(self, service, serializer=None):
+        """Create a new cache for the responses of the given service
+
+        Thermostats are encoded by the serializer, a JSONSerializer
+        unless another is given.
+        """
+        self.service = service
+        self.serializer = serializer or JSONSerializer()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._encoded = {}
+        self._positions = {}
+        self._all = (None, None, None)
+
+    def thermostats(self):
+        """Return the encoded response for all known thermostats
+
+        >>> from service import Service
+        >>> cache = ResponseCache(Service())
+        >>> expected = json.dumps({'result': list(Service().thermostats())})
+        >>> cache.thermostats() == expected
+        True
+        >>> cache.thermostats() == expected
+        True
+        >>> (cache.hits, cache.misses)
+        (1, 1)
+        """
+        version = self.service.version()
+        cached_version, result, bodies = self._all
+        if cached_version == version:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        changed = None
+        if bodies is not None:
+            changed = self.service.changed(cached_version)
+        if changed is None:
+            ids = list(self.service.ids())
+            bodies = [self._encode(id)[0] for id in ids]
+            self._positions = dict((id, i) for i, id in enumerate(ids))
+        else:
+            bodies = list(bodies)
+            for id in changed:
+                bodies[self._positions[id]] = self._encode(id)[0]
+        result = self.serializer.results(bodies)
+        with self._lock:
+            if self._all[0] is None or self._all[0] < version:
+                self._all = (version, result, bodies)
+        return result
+
+    def thermostat(self, id):
+        """Return the encoded response for a single thermostat
+
+        >>> from service import Service
+        >>> service = Service()
+        >>> cache = ResponseCache(service)
+        >>> cache.thermostat(100)
+        '{"result": {"name": "Upstairs Thermostat", "operating-mode": "heat", "cool-setpoint": 75, "heat-setpoint": 65, "fan-mode": "auto", "current-temp": 71, "id": 100}}'
+        >>> service.set_attribute(100, 'fan-mode', 'on')
+        >>> cache.thermostat(100)
+        '{"result": {"name": "Upstairs Thermostat", "operating-mode": "heat", "cool-setpoint": 75, "heat-setpoint": 65, "fan-mode": "on", "current-temp": 71, "id": 100}}'
+
+
+        An UnknownThermostatError will be raised if the id does not
+        match a known thermostat.
+
+        >>> ResponseCache(Service()).thermostat(102)
+        Traceback (most recent call last):
+        ...
+        UnknownThermostatError
+        """
+        return self._encode(id, count=True)[1]
+
+    def _encode(self, id, count=False):
+        # The version is read before the data so an entry can never be
+        # stamped with a version newer than the data it holds.
+        version = self.service.version(id)
+        entry = self._encoded.get(int(id))
+        if entry is not None and entry[0] == version:
+            if count:
+                self.hits += 1
+            return entry[1]
+
+        if count:
+            self.misses += 1
+        thermostat = self.service.thermostat(id)
+        body = self.serializer.dumps(thermostat)
+        encoded = (body, self.serializer.result(body))
+        with self._lock:
+            entry = self._encoded.get(thermostat['id'])
+            if entry is None or entry[0] < version:
+                self._encoded[thermostat['id']] = (version, encoded)
+        logger.debug('encoded thermostat %s', thermostat['id'])
+        return encoded
+
+
+class ReadThroughCache:
+    """A bounded cache of values loaded on demand
+
+    Values are loaded by calling load with their key, and each read
+    gives the age of value it will accept. An older value is still
+    returned for up to stale more seconds while it is reloaded in the
+    background, and only a value older than both is waited for. Readers
+    missing the same key at the same time share one load. At most size
+    values are kept, the least recently used being evicted first.
+
+    The hits, stale_hits and misses attributes count how reads were
+    served.
+
+    >>> now = [0]
+    >>> cache = ReadThroughCache(lambda key: (key, now[0]), size=2,
+    ...                          stale=10, clock=lambda: now[0])
+    >>> cache.get('a', 5)
+    ('a', 0)
+    >>> now[0] = 4
+    >>> cache.get('a', 5)
+    ('a', 0)
+    >>> now[0] = 20
+    >>> cache.get('a', 5)
+    ('a', 20)
+    >>> (cache.hits, cache.stale_hits, cache.misses)
+    (1, 0, 2)
+    """
+
+    def __init__(self, load, size=10000, stale=0, clock=time.time):
+        """Create a cache of the values produced by load"""
+        self.load = load
+        self.size = size
+        self.stale = stale
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._loads = {}
+
+    def get(self, key, ttl):
+        """Return the value for a key, loaded at most ttl seconds ago
+
+        Errors raised by load are raised to every reader waiting for the
+        value and nothing is cached.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                value, loaded = entry
+                if now - loaded <= ttl:
+                    self.hits += 1
+                    return value
+                elif now - loaded <= ttl + self.stale:
+                    self.stale_hits += 1
+                    if key not in self._loads:
+                        load = self._loads[key] = _Load()
+                        thread = threading.Thread(target=self._load,
+                                                  args=(key, load))
+                        thread.daemon = True
+                        thread.start()
+                    return value
+            self.misses += 1
+            load = self._loads.get(key)
+            leader = load is None
+            if leader:
+                load = self._loads[key] = _Load()
+        if leader:
+            self._load(key, load)
+        return load.wait()
+
+    def put(self, key, value):
+        """Cache a current value, superseding any load under way"""
+        with self._lock:
+            self._supersede(key)
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self.clock())
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Discard the value for a key, superseding any load under way"""
+        with self._lock:
+            self._supersede(key)
+            self._entries.pop(key, None)
+
+    def _supersede(self, key):
+        load = self._loads.pop(key, None)
+        if load is not None:
+            load.superseded = True
+
+    def _load(self, key, load):
+        loaded = self.clock()
+        try:
+            value = self.load(key)
+        except Exception as e:
+            with self._lock:
+                if self._loads.get(key) is load:
+                    del self._loads[key]
+            load.fail(e)
+            logger.debug('loading %s failed: %s', key, e)
+            return
+        with self._lock:
+            if self._loads.get(key) is load:
+                del self._loads[key]
+            if not load.superseded:
+                self._entries.pop(key, None)
+                self._entries[key] = (value, loaded)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        load.set(value)
+
+
+class _Load:
+    """A load of a value that readers can wait for"""
+
+    def __init__(self):
+        self.superseded = False
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set(self, value):
+        self._value = value
+        self._event.set()
+
+    def fail(self, error):
+        self._error = error
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
@@ -3,23 +3,81 @@ import logging
 import vivint
 import sys
 
-from server import Server
-from service import Service
-
 
 logger = logging.getLogger('vivint')
 
 
 def main():
+    # The web framework and services are only imported once they are
+    # needed, so that --help, --version and the subcommands start quickly
+    if sys.argv[1:2] == ['bench']:
+        import bench
+        return bench.main(sys.argv[2:])
+    if sys.argv[1:2] == ['simulate']:
+        import simulator
+        return simulator.main(sys.argv[2:])
+    if sys.argv[1:2] == ['shard']:
+        import shards
+        return shards.main(sys.argv[2:])
+
     # Parse CLI args
     parser = argparse.ArgumentParser(description='Run thermostat web service')
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s {}'.format(vivint.__version__))
     parser.add_argument('--log', dest='loglevel', default='info',
                         help='log level (default: info)')
-    parser.add_argument('port', nargs='?', action='store', default=8080,
+    parser.add_argument('--engine', default='webpy',
+                        choices=['webpy', 'asyncore'],
+                        help='web server implementation (default: webpy)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, requires the '
+                             'asyncore engine (default: 1)')
+    parser.add_argument('--keep-alive', type=float, metavar='SECONDS',
+                        help='with the asyncore engine, close connections '
+                             'idle for this many seconds (default: never)')
+    parser.add_argument('--max-requests', type=int, metavar='N',
+                        help='with the asyncore engine, close connections '
+                             'after they have made this many requests '
+                             '(default: unlimited)')
+    parser.add_argument('--data-dir',
+                        help='keep thermostat state in this directory so it '
+                             'survives restarts (default: in memory only)')
+    parser.add_argument('--devices', metavar='HOST:PORT[,HOST:PORT]',
+                        help='communicate with the thermostats served by '
+                             'these device gateways, such as one started '
+                             'with vivint simulate')
+    parser.add_argument('--shards', metavar='HOST:PORT[,HOST:PORT]',
+                        help='serve a fleet split over these shards, each '
+                             'started with vivint shard and the same list')
+    parser.add_argument('--write-window', type=float, metavar='SECONDS',
+                        help='with --devices, coalesce the changes made to '
+                             'each thermostat over this many seconds and '
+                             'send them together (default: send each change '
+                             'straight away)')
+    parser.add_argument('port', nargs='?', type=int, default=8080,
                         help='web server port (defaul: 8080)')
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.workers > 1 and args.engine != 'asyncore':
+        parser.error('--workers requires --engine asyncore')
+    if (args.keep_alive is not None or args.max_requests is not None) and \
+            args.engine != 'asyncore':
+        parser.error('--keep-alive and --max-requests require '
+                     '--engine asyncore')
+    if args.keep_alive is not None and args.keep_alive <= 0:
+        parser.error('--keep-alive must be positive')
+    if args.max_requests is not None and args.max_requests < 1:
+        parser.error('--max-requests must be at least 1')
+    if args.workers > 1 and args.data_dir:
+        parser.error('--data-dir cannot be used with --workers')
+    if args.devices and (args.data_dir or args.workers > 1):
+        parser.error('--devices cannot be used with --data-dir or --workers')
+    if args.shards and (args.devices or args.data_dir or args.workers > 1):
+        parser.error('--shards cannot be used with --devices, --data-dir or '
+                     '--workers')
+    if args.write_window is not None and not args.devices:
+        parser.error('--write-window requires --devices')
 
     # Setup logging
     format = '%(levelname)s\t[%(asctime)s]'
@@ -29,13 +87,33 @@ def main():
         raise ValueError('Invalid log level: %s' % loglevel)
     logging.basicConfig(format=format, level=numeric_level)
 
-    # Hack because web.py is a huge idiot
-    port = str(args.port)
-    if len(sys.argv) < 2:
-        sys.argv.append(port)
-    else:
-        sys.argv[1] = port
-
     # Run web server
-    Server(Service()).run()
+    if args.workers > 1:
+        from shared import SharedService
+        service = SharedService()
+    elif args.data_dir:
+        from durable import DurableService
+        service = DurableService(args.data_dir)
+    elif args.devices:
+        from devices import CachedDeviceService
+        from transport import Transport, parse_addresses
+        service = CachedDeviceService(
+            Transport.discover(parse_addresses(args.devices)),
+            window=args.write_window)
+    elif args.shards:
+        from shards import ShardedService
+        from transport import parse_addresses
+        service = ShardedService(parse_addresses(args.shards))
+    else:
+        from service import Service
+        service = Service()
+    from server import Server
+    server = Server(service)
+    if args.engine == 'asyncore':
+        server.serve(args.port, args.workers, idle_timeout=args.keep_alive,
+                     max_requests=args.max_requests)
+    else:
+        server.run(args.port)
+    if args.data_dir or args.devices or args.shards:
+        service.close()
     logger.info('Shutdown')
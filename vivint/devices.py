@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+
+from cache import ReadThroughCache
+from errors import UnknownAttributeError, UnknownThermostatError
+from records import ThermostatRecord
+from service import Service
+from writes import WriteQueue
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceService(Service):
+    """A service communicating with thermostat devices
+
+    The thermostats live on their devices and every read and change is
+    a request made through a Transport, which pools and pipelines the
+    connections to the devices. Changes are validated before they are
+    sent, and fetches of the same thermostat made at the same time
+    share one round trip.
+
+    The version of the fleet counts the changes made through this
+    service, changes made on the devices themselves only show up in the
+    versions of the individual thermostats. Nothing is indexed, so
+    filtered listings fetch every thermostat. The current-temp of each
+    state fetched from a device is added to the thermostat's history.
+
+    >>> from simulator import DeviceSimulator
+    >>> from transport import Transport
+    >>> simulator = DeviceSimulator()
+    >>> simulator.start()
+    >>> service = DeviceService(Transport.discover([simulator.server_address]))
+    >>> service.set_attribute(100, 'cool-setpoint', 80)
+    >>> simulator.service.get_attribute(100, 'cool-setpoint')
+    80
+    >>> service.get_attribute(100, 'cool-setpoint'), service.version(100)
+    (80, 1)
+    >>> service.transport.close()
+    >>> simulator.stop()
+    """
+
+    def __init__(self, transport):
+        """Create a service for the thermostats reached by a transport"""
+        Service.__init__(self, [])
+        self.transport = transport
+        self._ids = sorted(transport.devices)
+        self._indexes = {}
+        self._stats = None
+        self._lock = threading.Lock()
+
+    # Thermostats change on their devices without this service knowing
+    COMPLETE_VERSION = False
+
+    def record_temperature(self, id, value, at=None):
+        """Record a temperature reported by a thermostat
+
+        Only the thermostat's history is changed, as its current-temp is
+        read from the device.
+        """
+        id = self._id(id)
+        if id not in self.transport.devices:
+            raise UnknownThermostatError(id)
+        self._sample(id, self._temperature(value), at)
+
+    def _record(self, id):
+        return self._fetch(self._id(id))
+
+    def _id(self, id):
+        try:
+            return int(id)
+        except ValueError:
+            raise UnknownThermostatError(id)
+
+    def _fetch(self, id):
+        return self._from_state(self.transport.fetch(id))
+
+    def _from_state(self, state):
+        record = ThermostatRecord.from_dict(state)
+        record.version = state['version']
+        self._sample(record.id, record.current_temp)
+        return record
+
+    def _store(self, id, values):
+        self.transport.apply(id, values)
+        with self._lock:
+            self._version += 1
+
+
+class CachedDeviceService(DeviceService):
+    """A device service answering reads from a read-through cache
+
+    The state of each thermostat is cached when it is fetched and reads
+    use the cached state for as long as the attributes read are fresh.
+    How long an attribute stays fresh depends on how quickly it changes
+    on the device, so current-temp is refetched after a few seconds
+    while a name is kept for an hour. Reading several attributes at once,
+    as thermostat and the listings do, uses the shortest of their TTLs.
+
+    For a while after it expires a cached state is still returned, and
+    a refetch is started in the background, so reads only wait on a
+    device when nothing usable is cached. Changes made through the
+    service replace the cached state with the one the device reports.
+
+    Given a write window, changes are validated and queued rather than
+    sent, and the changes to each thermostat queued within the window are
+    sent to its device together in one request. Reads see queued changes
+    straight away and each queued change counts towards the version of
+    its thermostat until it is sent, so versions never go backwards.
+
+    >>> from simulator import DeviceSimulator
+    >>> from transport import Transport
+    >>> simulator = DeviceSimulator()
+    >>> simulator.start()
+    >>> service = CachedDeviceService(
+    ...     Transport.discover([simulator.server_address]))
+    >>> simulator.requests = 0
+    >>> service.get_attribute(100, 'name'), service.get_attribute(100, 'name')
+    (u'Upstairs Thermostat', u'Upstairs Thermostat')
+    >>> simulator.requests
+    1
+    >>> service.transport.close()
+    >>> simulator.stop()
+    """
+
+    TTLS = {
+        'current-temp': 5,
+        'name': 3600,
+    }
+
+    def __init__(self, transport, ttls=None, ttl=60, stale=30, size=10000,
+                 window=None, clock=time.time):
+        """Create a cached service for the thermostats reached by a transport
+
+        The ttls map attribute names to the seconds they are fresh for,
+        adding to and overriding TTLS, and other attributes are fresh for
+        ttl seconds. Expired states are used for up to stale seconds
+        while they are refetched. At most size thermostats are cached.
+        Changes are sent straight away unless a window of seconds to
+        coalesce them over is given.
+        """
+        DeviceService.__init__(self, transport)
+        self.ttls = dict(self.TTLS)
+        self.ttls.update(ttls or {})
+        self.ttl = ttl
+        self._shortest = min([ttl] + self.ttls.values())
+        self.cache = ReadThroughCache(self._fetch, size, stale, clock)
+        self.writes = None
+        self._offsets = {}
+        if window is not None:
+            self.writes = WriteQueue(self._send, window, clock)
+
+    def close(self):
+        """Send any queued changes"""
+        if self.writes is not None:
+            self.writes.close()
+
+    def get_attribute(self, id, name):
+        """Return the value for a named attribute
+
+        The cached state is used while the attribute is fresh.
+        """
+        id = self._id(id)
+        record = self._overlay(id, self.cache.get(
+            id, self.ttls.get(name, self.ttl)))
+        try:
+            return record.get(name)
+        except KeyError:
+            raise UnknownAttributeError(name)
+
+    def _record(self, id):
+        id = self._id(id)
+        return self._overlay(id, self.cache.get(id, self._shortest))
+
+    def _overlay(self, id, record):
+        # Each queued change counts as one towards the version of the
+        # thermostat but the device only counts one for a whole batch,
+        # so the difference is carried as an offset from then on
+        if id not in self._offsets:
+            return record
+        record = record.copy()
+        for name, value in self.writes.pending(id).items():
+            record.set(name, value)
+        record.version += self._offsets.get(id, 0)
+        return record
+
+    def _store(self, id, values):
+        if self.writes is None:
+            self._send(id, values)
+            with self._lock:
+                self._version += 1
+            return
+        with self._lock:
+            self._offsets[id] = self._offsets.get(id, 0) + 1
+            self.writes.submit(id, values)
+            self._version += 1
+
+    def _send(self, id, values):
+        state = self.transport.apply(id, values)
+        self.cache.put(id, self._from_state(state))
+        if self.writes is not None:
+            with self._lock:
+                self._offsets[id] -= 1
+                if not self._offsets[id]:
+                    del self._offsets[id]
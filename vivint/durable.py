@@ -0,0 +1,401 @@
+import errno
+import gc
+import itertools
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from errors import ValidationError
+from records import FAN_MODES, OPERATING_MODES, ThermostatRecord
+from service import Service
+
+
+logger = logging.getLogger(__name__)
+
+
+class DurableService(Service):
+    """A service keeping thermostat state on disk across restarts
+
+    Every change is appended to a write-ahead log in the data directory
+    before the setting call returns, and the log is synced to disk by a
+    background thread which batches together all of the changes made
+    since its last sync. Periodically a compact binary snapshot of every
+    thermostat is written and the log it covers is discarded, so that a
+    restart only has to map the snapshot and replay the changes since.
+
+    Snapshots are written by a forked child process from its copy of the
+    thermostats, which keeps the service responsive while a large fleet
+    is written out.
+
+    By default a change is acknowledged once it has been written to the
+    log, so it survives the process crashing but changes made within
+    the last sync delay can be lost if the host itself fails. With sync
+    enabled each change instead waits for the sync covering it.
+
+    >>> import shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> service = DurableService(directory)
+    >>> service.set_attribute(100, 'name', 'Attic')
+    >>> service.close()
+    >>> service = DurableService(directory)
+    >>> service.get_attribute(100, 'name'), service.version()
+    (u'Attic', 1)
+    >>> service.close()
+    >>> shutil.rmtree(directory)
+    """
+
+    SNAPSHOT = 'snapshot'
+    LOG_PREFIX = 'log.'
+    MAGIC = 'VIVSNAP1'
+    # magic, fleet version, number of thermostats
+    HEADER = struct.Struct('<8sQQ')
+    # A snapshot holds a column of each attribute in turn, with the
+    # names stored as their lengths followed by all of the names
+    COLUMNS = (('id', 'I'), ('version', 'Q'), ('current-temp', 'h'),
+               ('cool-setpoint', 'h'), ('heat-setpoint', 'h'),
+               ('operating-mode', 'B'), ('fan-mode', 'B'), ('name', 'I'))
+    # length and crc32 of the entry body
+    ENTRY = struct.Struct('<II')
+    # fleet version after the change, thermostat id, number of values;
+    # followed by each attribute index and value
+    CHANGE = struct.Struct('<QIB')
+    VALUE = struct.Struct('<Bh')
+    NAME = struct.Struct('<BH')
+    NAME_SIZE = 0xffff
+
+    def __init__(self, directory, thermostats=None, sync=False, delay=0.01,
+                 snapshot_every=100000):
+        """Open the service stored in a directory
+
+        The directory is created if needed and, if it holds no snapshot,
+        starts with the given thermostats or the sample thermostats.
+        Otherwise the thermostats argument is ignored and the stored
+        state is restored. The log is synced every delay seconds and a
+        snapshot is taken after every snapshot_every changes.
+        """
+        Service.__init__(self, [])
+        self.directory = directory
+        self.sync = sync
+        self.delay = delay
+        self.snapshot_every = snapshot_every
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Loading creates no reference cycles, and collecting while
+        # millions of records are created would dominate restart time
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            path = os.path.join(directory, self.SNAPSHOT)
+            if os.path.exists(path):
+                self._load_snapshot(path)
+            else:
+                self._data = Service(thermostats)._data
+                self._write_snapshot(path, self._version)
+            self._replay()
+            self._build_indexes()
+        finally:
+            if collecting:
+                gc.enable()
+
+        self._lock = threading.Lock()
+        self._reaping = threading.Lock()
+        self._condition = threading.Condition(threading.Lock())
+        self._written = 0
+        self._synced = 0
+        self._changes = 0
+        self._snapshotting = None
+        self._closed = False
+        self._fd = None
+        self._open_log()
+        self._wakeup = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop)
+        self._syncer.daemon = True
+        self._syncer.start()
+
+    def snapshot(self, wait=False):
+        """Start writing a snapshot of the current state
+
+        Any snapshot already being written is finished first. If wait is
+        set this returns once the snapshot is complete and the log it
+        covers has been removed.
+        """
+        self._reap(block=True)
+        with self._lock:
+            if self._snapshotting is None:
+                self._start_snapshot()
+        if wait:
+            self._reap(block=True)
+
+    def close(self):
+        """Sync the log, finish any snapshot and stop the service"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self._syncer.join()
+        self._sync()
+        self._reap(block=True)
+        os.close(self._fd)
+
+    def _store(self, id, values):
+        # The entry is encoded from a copy before anything is changed so
+        # a change that cannot be logged leaves no gap in the versions
+        record = self._data[id].copy()
+        for name, value in values.items():
+            record.set(name, value)
+        with self._lock:
+            entry = self._encode(self._version + 1, record, values)
+            Service._store(self, id, values)
+            os.write(self._fd, entry)
+            self._written += 1
+            sequence = self._written
+            self._changes += 1
+            if self._changes >= self.snapshot_every and \
+                    self._snapshotting is None:
+                self._start_snapshot()
+        if self.sync:
+            self._wakeup.set()
+            with self._condition:
+                while self._synced < sequence:
+                    self._condition.wait()
+        elif self.delay == 0:
+            self._sync()
+
+    def _name_validation(self, value):
+        Service._name_validation(self, value)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if len(value) > self.NAME_SIZE:
+            raise ValidationError(
+                'name',
+                'value cannot be longer than {} bytes'.format(self.NAME_SIZE)
+            )
+
+    ###########
+    #   LOG   #
+    ###########
+
+    def _encode(self, version, record, values):
+        body = [self.CHANGE.pack(version, record.id, len(values))]
+        for name in values:
+            attribute = ThermostatRecord.ATTRIBUTES.index(name)
+            if name == 'name':
+                name = record.name
+                if isinstance(name, unicode):
+                    name = name.encode('utf-8')
+                body.append(self.NAME.pack(attribute, len(name)))
+                body.append(name)
+            elif name == 'operating-mode':
+                body.append(self.VALUE.pack(attribute, record.operating_mode))
+            elif name == 'fan-mode':
+                body.append(self.VALUE.pack(attribute, record.fan_mode))
+            else:
+                body.append(self.VALUE.pack(attribute, record.get(name)))
+        body = ''.join(body)
+        return self.ENTRY.pack(len(body), zlib.crc32(body) & 0xffffffff) + \
+            body
+
+    def _decode(self, body):
+        version, id, count = self.CHANGE.unpack_from(body, 0)
+        offset = self.CHANGE.size
+        values = {}
+        for _ in range(count):
+            name = ThermostatRecord.ATTRIBUTES[ord(body[offset])]
+            if name == 'name':
+                length = self.NAME.unpack_from(body, offset)[1]
+                offset += self.NAME.size
+                value = body[offset:offset + length].decode('utf-8')
+                offset += length
+            else:
+                value = self.VALUE.unpack_from(body, offset)[1]
+                offset += self.VALUE.size
+                if name == 'operating-mode':
+                    value = OPERATING_MODES[value]
+                elif name == 'fan-mode':
+                    value = FAN_MODES[value]
+            values[name] = value
+        return version, id, values
+
+    def _segments(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(self.LOG_PREFIX)]
+        return sorted(names, key=self._segment_version)
+
+    def _segment_version(self, name):
+        return int(name[len(self.LOG_PREFIX):])
+
+    def _replay(self):
+        """Apply the changes logged after the snapshot was taken
+
+        Replay stops at the first entry that is incomplete or corrupt,
+        as left by a crash part way through a write, and the log is
+        truncated there so new changes follow the last good entry.
+        """
+        segments = self._segments()
+        for position, name in enumerate(segments):
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset < len(data):
+                end = offset + self.ENTRY.size
+                if end > len(data):
+                    break
+                length, crc = self.ENTRY.unpack_from(data, offset)
+                body = data[end:end + length]
+                if len(body) < length or \
+                        zlib.crc32(body) & 0xffffffff != crc:
+                    break
+                version, id, values = self._decode(body)
+                if version > self._version + 1 or id not in self._data:
+                    break
+                if version == self._version + 1:
+                    Service._store(self, id, values)
+                offset = end + length
+            if offset < len(data):
+                logger.warning('discarding %s bytes of damaged log in %s',
+                               len(data) - offset, path)
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+                for later in segments[position + 1:]:
+                    os.remove(os.path.join(self.directory, later))
+                break
+
+    def _open_log(self):
+        name = '{}{}'.format(self.LOG_PREFIX, self._version)
+        self._fd = os.open(os.path.join(self.directory, name),
+                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        self._sync_directory()
+
+    def _sync(self):
+        with self._condition:
+            sequence = self._written
+            if sequence != self._synced:
+                os.fsync(self._fd)
+                self._synced = sequence
+                self._condition.notify_all()
+
+    def _sync_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.delay or None)
+            self._wakeup.clear()
+            self._sync()
+            self._reap()
+
+    def _sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    ###############
+    #  SNAPSHOTS  #
+    ###############
+
+    def _load_snapshot(self, path):
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self._version, count = self.HEADER.unpack_from(data, 0)
+            if magic != self.MAGIC:
+                raise ValueError('{} is not a thermostat snapshot'.format(path))
+            offset = self.HEADER.size
+            columns = []
+            for _, code in self.COLUMNS:
+                column = struct.Struct('<{}{}'.format(count, code))
+                columns.append(column.unpack_from(data, offset))
+                offset += column.size
+            lengths = columns.pop()
+            text = data[offset:].decode('utf-8')
+        finally:
+            data.close()
+
+        names = []
+        start = 0
+        for length in lengths:
+            names.append(text[start:start + length])
+            start += length
+        ids, versions, temps, cools, heats, modes, fans = columns
+        self._data = dict(itertools.izip(ids, itertools.imap(
+            ThermostatRecord, ids, names, temps, modes, cools, heats, fans,
+            versions
+        )))
+
+    def _write_snapshot(self, path, version):
+        records = self._data.values()
+        columns = [ThermostatRecord.column(name, records, encoded=True)
+                   for name, _ in self.COLUMNS]
+        names = [name if isinstance(name, unicode) else name.decode('utf-8')
+                 for name in columns.pop()]
+        columns.append([len(name) for name in names])
+
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, version, len(records)))
+            for (_, code), column in zip(self.COLUMNS, columns):
+                f.write(struct.pack('<{}{}'.format(len(column), code),
+                                    *column))
+            f.write(u''.join(names).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary, path)
+        self._sync_directory()
+
+    def _start_snapshot(self):
+        # Called holding the lock so the child sees a consistent state
+        # and the log is switched exactly at the snapshot's version
+        self._sync()
+        with self._condition:
+            os.close(self._fd)
+            self._open_log()
+        self._changes = 0
+        version = self._version
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._write_snapshot(
+                    os.path.join(self.directory, self.SNAPSHOT), version)
+                status = 0
+            finally:
+                os._exit(status)
+        self._snapshotting = pid, version
+
+    def _reap(self, block=False):
+        # Only one thread waits for the child at a time, so its status
+        # is seen exactly once and the log is only removed after the
+        # snapshot covering it is known to have been written
+        if not self._reaping.acquire(block):
+            return
+        try:
+            snapshotting = self._snapshotting
+            if snapshotting is None:
+                return
+            pid, version = snapshotting
+            try:
+                done, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                # The status was taken by someone else, so the snapshot
+                # cannot be trusted and the log it covers is kept
+                done, status = pid, None
+            if not done:
+                return
+            with self._lock:
+                self._snapshotting = None
+            if status != 0:
+                logger.error('writing snapshot at version %s failed', version)
+                return
+            for name in self._segments():
+                if self._segment_version(name) < version:
+                    os.remove(os.path.join(self.directory, name))
+            logger.info('wrote snapshot at version %s', version)
+        finally:
+            self._reaping.release()
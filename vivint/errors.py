@@ -28,3 +28,18 @@ class ValidationError(ServiceError):
     def __init__(self, name, message):
         self.name = name
         self.message = message
+
+
+class DeviceError(ServiceError):
+
+    def __init__(self, id, message):
+        self.name = id
+        self.message = 'thermostat {} unavailable: {}'.format(id, message)
+
+
+class GatewayError(DeviceError):
+
+    def __init__(self, address, message):
+        self.name = address
+        self.message = '{}:{} unavailable: {}'.format(
+            address[0], address[1], message)
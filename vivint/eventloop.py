@@ -0,0 +1,411 @@
+import asynchat
+import asyncore
+import logging
+import os
+import signal
+import socket
+import StringIO
+import sys
+import time
+import urllib
+
+
+logger = logging.getLogger(__name__)
+
+# Set in the WSGI environ to tell applications that they must not block.
+# Applications streaming a text/event-stream response may yield an empty
+# string when they have nothing to send, and will be asked again later.
+NONBLOCKING = 'vivint.nonblocking'
+
+
+class Channel(asynchat.async_chat):
+    """A single client connection to the event loop server
+
+    Requests are read from the connection one at a time and handed to
+    the WSGI application. Small responses are queued whole, larger ones
+    are pulled from the application as the client reads them. Connections
+    are kept open between requests unless the client asks otherwise or
+    the server's limit of requests per connection is reached. Pipelined
+    requests are answered in the order they arrive.
+    """
+
+    MAX_HEADER_SIZE = 65536
+    BUFFER_SIZE = 65536
+
+    def __init__(self, server, sock, address):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.address = address
+        self.requests = 0
+        self.last_active = time.time()
+        self._closing = False
+        self._reset()
+
+    def idle(self, now, timeout):
+        """Return whether nothing has been received or sent for a while
+
+        A connection still sending a response is never idle.
+        """
+        return not self.producer_fifo and now - self.last_active >= timeout
+
+    def _reset(self):
+        self._buffer = []
+        self._size = 0
+        self._environ = None
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        if self._closing:
+            return
+        self.last_active = time.time()
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._environ is None and self._size > self.MAX_HEADER_SIZE:
+            logger.warn('request headers from {} too large'.format(
+                self.address))
+            self._abort('431 Request Header Fields Too Large')
+
+    def found_terminator(self):
+        if self._closing:
+            return
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        if self._environ is None:
+            try:
+                self._environ = self._parse(data)
+            except ValueError:
+                logger.warn('malformed request from {}'.format(self.address))
+                return self._abort('400 Bad Request')
+            length = int(self._environ.get('CONTENT_LENGTH') or 0)
+            if length > 0:
+                self.set_terminator(length)
+                return
+            data = ''
+        environ = self._environ
+        environ['wsgi.input'] = StringIO.StringIO(data)
+        self._respond(environ)
+        if not self._closing:
+            self._reset()
+
+    def handle_error(self):
+        logger.exception('error handling connection from {}'.format(
+            self.address))
+        self.close()
+
+    def _parse(self, data):
+        lines = data.lstrip('\r\n').split('\r\n')
+        method, target, protocol = lines[0].split(' ')
+        if not protocol.startswith('HTTP/'):
+            raise ValueError(protocol)
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.server.server_name,
+            'SERVER_PORT': str(self.server.server_port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': self.address[0] if self.address else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            NONBLOCKING: True,
+        }
+        for line in lines[1:]:
+            name, value = line.split(':', 1)
+            name = name.strip().upper().replace('-', '_')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value.strip()
+            else:
+                environ['HTTP_' + name] = value.strip()
+        int(environ.get('CONTENT_LENGTH') or 0)
+        return environ
+
+    def _keep_alive(self, environ):
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def _respond(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        # Responses which fit in the buffer are sent with a Content-Length,
+        # anything longer is streamed from the application as it is sent.
+        result = self.server.app(environ, start_response)
+        iterator = iter(result)
+        body = []
+        size = 0
+        complete = True
+        events = any(name.lower() == 'content-type' and
+                     value.startswith('text/event-stream')
+                     for name, value in response['headers'])
+        for chunk in iterator:
+            body.append(chunk)
+            size += len(chunk)
+            if events or (size >= self.BUFFER_SIZE and
+                          environ['REQUEST_METHOD'] != 'HEAD'):
+                complete = False
+                break
+        body = ''.join(body)
+        if complete and hasattr(result, 'close'):
+            result.close()
+
+        status = response['status']
+        self.requests += 1
+        keep_alive = self._keep_alive(environ) and (
+            not self.server.max_requests or
+            self.requests < self.server.max_requests)
+        chunked = False
+        lines = ['{} {}'.format(environ['SERVER_PROTOCOL'], status)]
+        for name, value in response['headers']:
+            if name.lower() not in ('content-length', 'connection'):
+                lines.append('{}: {}'.format(name, value))
+        if status[:3] in ('204', '304'):
+            body = ''
+        elif complete:
+            lines.append('Content-Length: {}'.format(len(body)))
+        elif environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+            keep_alive = False
+        else:
+            chunked = True
+            lines.append('Transfer-Encoding: chunked')
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            body = ''
+        if keep_alive:
+            if environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+                lines.append('Connection: keep-alive')
+        else:
+            lines.append('Connection: close')
+        logger.debug('%s %s %s', environ['REQUEST_METHOD'],
+                     environ['PATH_INFO'], status)
+
+        if chunked:
+            body = _chunk(body)
+        self.push('\r\n'.join(lines) + '\r\n\r\n' + body)
+        self.last_active = time.time()
+        if not complete:
+            self.push_with_producer(
+                _Producer(result, iterator, chunked, pausable=events))
+        if not keep_alive:
+            self._close_when_done()
+
+    def writable(self):
+        first = self.producer_fifo[0] if self.producer_fifo else None
+        if isinstance(first, _Producer):
+            return first.fill()
+        return asynchat.async_chat.writable(self)
+
+    def initiate_send(self):
+        first = self.producer_fifo[0] if self.producer_fifo else None
+        if isinstance(first, _Producer) and not first.fill():
+            return
+        asynchat.async_chat.initiate_send(self)
+
+    def _abort(self, status):
+        self.push('HTTP/1.1 {}\r\nConnection: close\r\n'
+                  'Content-Length: 0\r\n\r\n'.format(status))
+        self._close_when_done()
+
+    def _close_when_done(self):
+        self._closing = True
+        self._buffer = []
+        self.set_terminator(None)
+        self.close_when_done()
+
+
+def _chunk(data):
+    if not data:
+        return ''
+    return '{:x}\r\n{}\r\n'.format(len(data), data)
+
+
+class _Producer:
+    """Pull the rest of a response body as the connection can take it
+
+    A pausable producer treats an empty chunk from the application as
+    having nothing to send yet, and the connection will not be written
+    to until a later poll of fill finds more data.
+    """
+
+    def __init__(self, result, iterator, chunked, pausable=False):
+        self.result = result
+        self.iterator = iterator
+        self.chunked = chunked
+        self.pausable = pausable
+        self.buffer = ''
+
+    def fill(self):
+        """Fetch the next chunk, returning False if none is ready"""
+        while not self.buffer and self.iterator is not None:
+            try:
+                data = next(self.iterator)
+            except StopIteration:
+                self.iterator = None
+                if hasattr(self.result, 'close'):
+                    self.result.close()
+                self.buffer = '0\r\n\r\n' if self.chunked else ''
+                break
+            if data:
+                self.buffer = _chunk(data) if self.chunked else data
+            elif self.pausable:
+                return False
+        return True
+
+    def more(self):
+        self.fill()
+        data, self.buffer = self.buffer, ''
+        return data
+
+
+class HTTPServer(asyncore.dispatcher):
+    """A single-threaded HTTP server for a WSGI application
+
+    All connections are served from one asyncore event loop, so a large
+    number of idle keep-alive connections costs little more than their
+    sockets. The application is called synchronously from the loop and
+    should not block.
+
+    Connections are kept alive between requests, and may pipeline them,
+    until they have been idle for idle_timeout seconds or have made
+    max_requests requests, either being unlimited when None.
+    """
+
+    def __init__(self, app, address=None, sock=None, backlog=1024,
+                 idle_timeout=None, max_requests=None):
+        """Create a new server for a WSGI application
+
+        The server will listen on the given (host, port) address. An
+        already listening socket may be provided instead, in which case
+        the address is ignored.
+        """
+        self.app = app
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        if sock is None:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+            self.bind(address)
+            self.listen(backlog)
+        else:
+            sock.setblocking(0)
+            self.set_socket(sock, self.map)
+            self.accepting = True
+        self.server_name, self.server_port = self.socket.getsockname()[:2]
+        self._running = False
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            sock, address = pair
+            Channel(self, sock, address)
+
+    def handle_error(self):
+        logger.exception('error accepting connection')
+
+    def serve_forever(self, timeout=0.1):
+        """Run the event loop until stop is called
+
+        Event streams with nothing to send are polled again after the
+        timeout. Idle connections are looked for at most once a second.
+        All connections are closed once the loop exits.
+        """
+        logger.info('serving on http://{}:{}/'.format(
+            self.server_name, self.server_port))
+        self._running = True
+        swept = time.time()
+        try:
+            while self._running:
+                asyncore.loop(timeout=timeout, map=self.map, count=1)
+                if self.idle_timeout is not None:
+                    now = time.time()
+                    if now - swept >= min(1, self.idle_timeout):
+                        self.close_idle(now)
+                        swept = now
+        finally:
+            asyncore.close_all(map=self.map)
+
+    def close_idle(self, now=None):
+        """Close the connections idle for longer than the idle timeout"""
+        now = time.time() if now is None else now
+        for channel in self.map.values():
+            if isinstance(channel, Channel) and \
+                    channel.idle(now, self.idle_timeout):
+                logger.debug('closing idle connection from %s',
+                             channel.address)
+                channel.close()
+
+    def stop(self):
+        """Ask the event loop to stop
+
+        This may be called from another thread, the loop will exit
+        within the timeout given to serve_forever.
+        """
+        self._running = False
+
+
+def serve_workers(app, address=None, workers=2, sock=None, backlog=1024,
+                  **options):
+    """Serve a WSGI application from several forked worker processes
+
+    The listening socket is created before forking so that the kernel
+    spreads incoming connections over the workers, each of which runs
+    its own HTTPServer with any other options given. Any state the
+    application shares between the workers, such as a SharedService,
+    must be created before calling this. The call returns once all of
+    the workers have exited and terminating the parent terminates the
+    workers.
+    """
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                HTTPServer(app, sock=sock, **options).serve_forever()
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                logger.exception('worker {} failed'.format(os.getpid()))
+                status = 1
+            finally:
+                os._exit(status)
+        logger.info('started worker {}'.format(pid))
+        children.append(pid)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    previous = signal.signal(signal.SIGTERM, terminate)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        sock.close()
@@ -0,0 +1,88 @@
+import collections
+import itertools
+import json
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventLog:
+    """A bounded log of recent thermostat changes
+
+    Every attribute change made through the service is recorded as an
+    event with a sequence number. Only the most recent events are kept
+    so clients resuming a stream after a long gap will miss the older
+    events. Event ids include the service epoch so ids issued by another
+    instance of the service are never mistaken for our own.
+
+    >>> from service import Service
+    >>> service = Service()
+    >>> log = EventLog(service, size=2)
+    >>> last = log.last_id()
+    >>> for value in ['Attic', 'Den', 'Loft']:
+    ...     service.set_attribute(100, 'name', value)
+    >>> [data for _, _, data in log.since(last)[1]]
+    ['{"id": 100, "name": "name", "value": "Den"}', '{"id": 100, "name": "name", "value": "Loft"}']
+    """
+
+    def __init__(self, service, size=1024):
+        """Create a log of the changes made through a service
+
+        At most size events are retained.
+        """
+        self.epoch = service.epoch
+        self._events = collections.deque(maxlen=size)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        service.subscribe(self.append)
+
+    def append(self, id, name, value):
+        """Record a change to a thermostat attribute"""
+        data = '{{"id": {}, "name": {}, "value": {}}}'.format(
+            json.dumps(id), json.dumps(name), json.dumps(value))
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, id, data))
+            self._condition.notify_all()
+
+    def last_id(self):
+        """Return the id of the most recent event"""
+        return '{}-{}'.format(self.epoch, self._sequence)
+
+    def since(self, last_id, thermostat=None):
+        """Return the events following the one with the given id
+
+        The id of the last event examined is returned along with a list
+        of the events as (event id, thermostat id, data) tuples, limited
+        to a single thermostat if one is given. If the id was not issued
+        by this log all of the retained events are returned.
+        """
+        sequence = self._parse(last_id)
+        with self._condition:
+            last_id = '{}-{}'.format(self.epoch, self._sequence)
+            if not self._events:
+                return last_id, []
+            start = max(0, sequence - self._events[0][0] + 1)
+            events = list(itertools.islice(self._events, start, None))
+        return last_id, [('{}-{}'.format(self.epoch, s), id, data)
+                         for s, id, data in events
+                         if thermostat is None or id == thermostat]
+
+    def wait(self, last_id, timeout):
+        """Block until there is an event following the given id
+
+        Returns False if the timeout expired first.
+        """
+        sequence = self._parse(last_id)
+        with self._condition:
+            if self._sequence <= sequence:
+                self._condition.wait(timeout)
+            return self._sequence > sequence
+
+    def _parse(self, last_id):
+        epoch, _, sequence = (last_id or '').partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return 0
+        return min(int(sequence), self._sequence)
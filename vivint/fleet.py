@@ -0,0 +1,19 @@
+def thermostats(count):
+    """Generate a fleet of count thermostats for benchmarking
+
+    The fleet is given in the form accepted by Service, with the modes
+    spread evenly over the thermostats.
+
+    >>> [t['operating-mode'] for t in thermostats(4)]
+    ['cool', 'heat', 'off', 'cool']
+    """
+    for id in xrange(count):
+        yield {
+            'id': id,
+            'name': 'Thermostat {}'.format(id),
+            'current-temp': 60 + id % 20,
+            'operating-mode': ('cool', 'heat', 'off')[id % 3],
+            'cool-setpoint': 75,
+            'heat-setpoint': 65,
+            'fan-mode': ('auto', 'on')[id % 2],
+        }
@@ -0,0 +1,149 @@
+from array import array
+
+
+class Rollup(object):
+    """The minimum, maximum and mean of samples over fixed intervals
+
+    Each interval of the given number of seconds is summarized in one
+    slot of a ring buffer of size slots, held in fixed size arrays, so
+    the rollup keeps the last size intervals in 22 bytes each no matter
+    how many samples arrive. A slot is reused once its interval falls
+    out of the buffer and samples for intervals already dropped are
+    ignored.
+
+    >>> rollup = Rollup(60, 3)
+    >>> for at, value in [(0, 70), (30, 72), (60, 74)]:
+    ...     rollup.add(at, value)
+    >>> rollup.points(0, 180, 60)
+    [(0, 70.0, 72.0, 71.0, 2), (60, 74.0, 74.0, 74.0, 1)]
+    >>> rollup.points(0, 180, 120)
+    [(0, 70.0, 74.0, 72.0, 3)]
+    >>> rollup.add(250, 68)
+    >>> rollup.points(0, 300, 60)
+    [(240, 68.0, 68.0, 68.0, 1)]
+    """
+
+    __slots__ = ('interval', 'size', '_intervals', '_counts', '_sums',
+                 '_mins', '_maxs')
+
+    def __init__(self, interval, size):
+        """Create an empty rollup of size intervals of interval seconds"""
+        self.interval = interval
+        self.size = size
+        self._intervals = array('i', [-1]) * size
+        self._counts = array('H', [0]) * size
+        self._sums = array('d', [0]) * size
+        self._mins = array('f', [0]) * size
+        self._maxs = array('f', [0]) * size
+
+    def add(self, at, value):
+        """Add a sample taken at a time in seconds since the epoch"""
+        interval = int(at // self.interval)
+        slot = interval % self.size
+        current = self._intervals[slot]
+        if interval < current:
+            return
+        if interval > current:
+            self._intervals[slot] = interval
+            self._counts[slot] = 1
+            self._sums[slot] = self._mins[slot] = self._maxs[slot] = value
+        elif self._counts[slot] < 0xffff:
+            self._counts[slot] += 1
+            self._sums[slot] += value
+            if value < self._mins[slot]:
+                self._mins[slot] = value
+            elif value > self._maxs[slot]:
+                self._maxs[slot] = value
+
+    def points(self, start, end, step):
+        """Summarize the samples from start up to end every step seconds
+
+        The step must be a multiple of the interval. Each point is a
+        (time, min, max, mean, count) tuple for a step starting at time,
+        steps being aligned to multiples of step, and steps without
+        samples are left out. The cost is proportional to the number of
+        intervals covered, at most size.
+        """
+        per_step = step // self.interval
+        first = int(start // step) * per_step
+        last = -(-int(end) // self.interval)
+        first = max(first, last - self.size)
+        points = []
+        point = None
+        for interval in xrange(first, last):
+            slot = interval % self.size
+            if self._intervals[slot] != interval:
+                continue
+            time = interval // per_step * step
+            count = self._counts[slot]
+            if point is None or point[0] != time:
+                if point is not None:
+                    points.append(_point(*point))
+                point = [time, self._mins[slot], self._maxs[slot],
+                         self._sums[slot], count]
+            else:
+                point[1] = min(point[1], self._mins[slot])
+                point[2] = max(point[2], self._maxs[slot])
+                point[3] += self._sums[slot]
+                point[4] += count
+        if point is not None:
+            points.append(_point(*point))
+        return points
+
+
+def _point(time, low, high, total, count):
+    return (time, low, high, total / count, count)
+
+
+class TemperatureHistory(object):
+    """The recent temperatures of a thermostat at several resolutions
+
+    Samples are rolled up by the minute and by the hour, keeping minutes
+    and hours of each, so the memory used is fixed whatever the rate of
+    samples. Queries are answered from the coarsest rollup whose
+    interval divides the step.
+
+    Samples must be added by one thread at a time but any number of
+    threads may read without locking. Each add is counted before and
+    after it changes the rollups, and a read that overlaps an add is
+    retried, so reads never see a sample half added.
+
+    >>> history = TemperatureHistory()
+    >>> for minute in range(120):
+    ...     history.add(minute * 60, 60 + minute % 10)
+    >>> history.points(0, 7200, 3600)
+    [(0, 60.0, 69.0, 64.5, 60), (3600, 60.0, 69.0, 64.5, 60)]
+    >>> history.points(0, 180, 60)
+    [(0, 60.0, 60.0, 60.0, 1), (60, 61.0, 61.0, 61.0, 1), (120, 62.0, 62.0, 62.0, 1)]
+    """
+
+    __slots__ = ('rollups', '_changes')
+
+    def __init__(self, minutes=120, hours=168):
+        """Create an empty history keeping minutes and hours of rollups"""
+        self.rollups = (Rollup(60, minutes), Rollup(3600, hours))
+        self._changes = 0
+
+    def add(self, at, value):
+        """Add a sample taken at a time in seconds since the epoch"""
+        self._changes += 1
+        for rollup in self.rollups:
+            rollup.add(at, value)
+        self._changes += 1
+
+    def points(self, start, end, step):
+        """Summarize the samples from start up to end every step seconds
+
+        Points are given as by Rollup.points. A ValueError is raised if
+        the step is not a positive multiple of a minute.
+        """
+        if step <= 0 or step % 60:
+            raise ValueError('step must be a positive multiple of 60')
+        rollup = self.rollups[1] if step % 3600 == 0 else self.rollups[0]
+        while True:
+            changes = self._changes
+            if changes % 2:
+                continue
+            points = rollup.points(start, end, step)
+            if changes == self._changes:
+                return points
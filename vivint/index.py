@@ -0,0 +1,91 @@
+import bisect
+import itertools
+
+
+class Index:
+    """A secondary index from attribute values to thermostat ids
+
+    Each distinct value of the indexed attribute maps to the sorted list
+    of ids of the thermostats currently holding that value, so the
+    thermostats with a value can be found, and read in order of id from
+    any id on with a binary search, in time proportional to the number
+    of ids read rather than the size of the fleet.
+
+    >>> index = Index()
+    >>> index.add(101, 'heat')
+    >>> index.add(100, 'heat')
+    >>> index.move(101, 'heat', 'cool')
+    >>> index.find('heat'), index.find('cool'), index.find('off')
+    ([100], [101], [])
+    """
+
+    def __init__(self):
+        """Create a new empty index"""
+        self._buckets = {}
+
+    def add(self, id, value):
+        """Record that a thermostat holds a value"""
+        bucket = self._buckets.get(value)
+        if bucket is None:
+            bucket = self._buckets[value] = []
+        bisect.insort(bucket, id)
+
+    def update(self, ids, values):
+        """Record that each thermostat holds the corresponding value
+
+        >>> index = Index()
+        >>> index.update([102, 101, 100], ['heat', 'cool', 'heat'])
+        >>> index.find('heat')
+        [100, 102]
+        """
+        buckets = self._buckets
+        for id, value in itertools.izip(ids, values):
+            bucket = buckets.get(value)
+            if bucket is None:
+                bucket = buckets[value] = []
+            bucket.append(id)
+        for bucket in buckets.values():
+            bucket.sort()
+
+    def remove(self, id, value):
+        """Record that a thermostat no longer holds a value
+
+        Empty lists are kept, so a list returned by find or buckets
+        follows every later change to the thermostats holding its value.
+        """
+        bucket = self._buckets.get(value)
+        if bucket is not None:
+            position = bisect.bisect_left(bucket, id)
+            if position < len(bucket) and bucket[position] == id:
+                del bucket[position]
+
+    def move(self, id, old, new):
+        """Record that a thermostat's value has changed"""
+        if old != new:
+            self.remove(id, old)
+            self.add(id, new)
+
+    def find(self, value):
+        """Return the sorted ids of the thermostats holding a value
+
+        The returned list must not be modified.
+        """
+        return self._buckets.get(value, [])
+
+    def buckets(self, low=None, high=None):
+        """Return the sorted ids of each value in a range
+
+        Both bounds are inclusive and either may be None to leave that
+        end of the range open. A list of ids is returned for each
+        distinct value in the range, which must not be modified. The
+        cost is proportional to the number of distinct values indexed.
+
+        >>> index = Index()
+        >>> for id, value in enumerate([60, 65, 70, 75, 80, 65]):
+        ...     index.add(id, value)
+        >>> sorted(index.buckets(65, 75)), index.buckets(high=60)
+        ([[1, 5], [2], [3]], [[0]])
+        """
+        return [bucket for value, bucket in self._buckets.items()
+                if (low is None or value >= low) and
+                (high is None or value <= high)]
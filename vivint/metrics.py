@@ -0,0 +1,182 @@
+import time
+
+from bisect import bisect_left
+
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """A count of observed values in fixed buckets
+
+    The buckets are cumulative when reported, as Prometheus expects, but
+    each observation only increments the count of the first bucket
+    whose bound is at least the value so that observing is cheap.
+
+    >>> histogram = Histogram((1, 5))
+    >>> for value in [0.5, 1, 3, 10]:
+    ...     histogram.observe(value)
+    >>> histogram.cumulative(), histogram.sum
+    ([('1', 2), ('5', 3), ('+Inf', 4)], 14.5)
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """Create a histogram with the given upper bucket bounds"""
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record an observed value"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Add the observations of a histogram with the same buckets"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def cumulative(self):
+        """Return the (bound, count) pairs of the cumulative buckets"""
+        result = []
+        total = 0
+        for bound, count in zip(self.bounds + ['+Inf'], self.counts):
+            total += count
+            result.append((bound if bound == '+Inf' else repr(bound), total))
+        return result
+
+
+class Metrics:
+    """Measurements of the requests handled and service operations
+
+    Request durations are reported per route and method, response
+    counts per route and status and operation durations per service
+    method. No locks are taken when recording, which keeps recording a
+    request to about a microsecond and measuring one in all to about two,
+    but means that with the threaded web.py server an update may
+    occasionally be lost when two threads record the same metric at
+    once. The asyncore engine is single threaded so its counts are
+    exact. With several workers each process reports its own metrics.
+
+    >>> metrics = Metrics()
+    >>> metrics.observe('thermostat', 'GET', '200', 0.002)
+    >>> print metrics.render()  # doctest: +ELLIPSIS
+    # HELP vivint_request_duration_seconds Time taken to handle requests.
+    # TYPE vivint_request_duration_seconds histogram
+    vivint_request_duration_seconds_bucket{route="thermostat",method="GET",le="0.0005"} 0
+    ...
+    vivint_responses_total{route="thermostat",status="200"} 1
+    ...
+    """
+
+    def __init__(self):
+        """Create an empty set of metrics"""
+        self.requests = {}
+        self.operations = {}
+
+    def observe(self, route, method, status, seconds):
+        """Record a request handled in the given number of seconds
+
+        Requests are kept in one histogram per route, method and status
+        so that recording one is a single lookup, and are combined into
+        the request durations and response counts when rendered.
+        """
+        histogram = self.requests.get((route, method, status))
+        if histogram is None:
+            histogram = self.requests.setdefault((route, method, status),
+                                                 Histogram())
+        # Histogram.observe inlined, this is called for every request
+        histogram.counts[bisect_left(histogram.bounds, seconds)] += 1
+        histogram.sum += seconds
+
+    def instrument(self, obj, *names):
+        """Return a proxy for an object timing calls to the named methods
+
+        Every attribute of the proxy is that of the object except the
+        named methods, which are wrapped to record the duration of every
+        call as an operation of the same name. The object itself is left
+        as it was, so instrumenting it again for another set of metrics
+        does not time its calls twice.
+
+        >>> from service import Service
+        >>> metrics = Metrics()
+        >>> service = Service()
+        >>> timed = metrics.instrument(service, 'get_attribute')
+        >>> timed.get_attribute(100, 'fan-mode'), timed.version()
+        ('auto', 0)
+        >>> service.get_attribute(100, 'fan-mode')
+        'auto'
+        >>> sum(metrics.operations['get_attribute'].counts)
+        1
+        """
+        return _Instrumented(obj, dict(
+            (name, self._timed(name, getattr(obj, name))) for name in names))
+
+    def _timed(self, name, method):
+        observe = self.operations.setdefault(name, Histogram()).observe
+        clock = time.time
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                observe(clock() - start)
+        timed.__name__ = method.__name__
+        timed.__doc__ = method.__doc__
+        return timed
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        durations = {}
+        responses = {}
+        for (route, method, status), histogram in self.requests.items():
+            combined = durations.get((route, method))
+            if combined is None:
+                combined = durations[route, method] = Histogram(
+                    histogram.bounds)
+            combined.merge(histogram)
+            count = responses.get((route, status), 0)
+            responses[route, status] = count + sum(histogram.counts)
+
+        lines = []
+        self._render_histograms(
+            lines, 'vivint_request_duration_seconds',
+            'Time taken to handle requests.', ('route', 'method'), durations)
+        lines.append('# HELP vivint_responses_total Responses sent.')
+        lines.append('# TYPE vivint_responses_total counter')
+        for (route, status), count in sorted(responses.items()):
+            lines.append('vivint_responses_total{{route="{}",status="{}"}} {}'
+                         .format(route, status, count))
+        self._render_histograms(
+            lines, 'vivint_service_duration_seconds',
+            'Time taken by thermostat service operations.', ('operation',),
+            dict(((name,), h) for name, h in self.operations.items()))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines, name, help, labels, histograms):
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} histogram'.format(name))
+        for key, histogram in sorted(histograms.items()):
+            label = ','.join('{}="{}"'.format(l, v)
+                             for l, v in zip(labels, key))
+            total = 0
+            for bound, total in histogram.cumulative():
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, label, bound, total))
+            lines.append('{}_sum{{{}}} {!r}'.format(name, label,
+                                                   histogram.sum))
+            lines.append('{}_count{{{}}} {}'.format(name, label, total))
+
+
+class _Instrumented:
+    """A proxy for an object with some of its methods replaced"""
+
+    def __init__(self, target, methods):
+        self.__dict__.update(methods)
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
@@ -0,0 +1,155 @@
+from operator import attrgetter
+
+
+OPERATING_MODES = ('cool', 'heat', 'off')
+FAN_MODES = ('auto', 'on')
+
+
+class ThermostatRecord(object):
+    """A compact in memory representation of a thermostat
+
+    Attributes are held in slots rather than a per-thermostat dict and
+    the operating and fan modes are held as small integer codes, their
+    index in OPERATING_MODES and FAN_MODES, which keeps the cost of each
+    thermostat to a small fixed size. Records are converted to the
+    dict form used by the API with to_dict.
+
+    >>> record = ThermostatRecord.from_dict({
+    ...     'id': 100,
+    ...     'name': 'Upstairs Thermostat',
+    ...     'current-temp': 71,
+    ...     'operating-mode': 'heat',
+    ...     'cool-setpoint': 75,
+    ...     'heat-setpoint': 65,
+    ...     'fan-mode': 'auto'
+    ... })
+    >>> record.operating_mode, record.fan_mode
+    (1, 0)
+    >>> record.to_dict()
+    {'name': 'Upstairs Thermostat', 'operating-mode': 'heat', 'cool-setpoint': 75, 'heat-setpoint': 65, 'fan-mode': 'auto', 'current-temp': 71, 'id': 100}
+    """
+
+    __slots__ = ('id', 'version', 'name', 'current_temp', 'operating_mode',
+                 'cool_setpoint', 'heat_setpoint', 'fan_mode')
+
+    ATTRIBUTES = ('id', 'name', 'current-temp', 'operating-mode',
+                  'cool-setpoint', 'heat-setpoint', 'fan-mode')
+
+    def __init__(self, id, name, current_temp, operating_mode, cool_setpoint,
+                 heat_setpoint, fan_mode, version=0):
+        """Create a record from already encoded values"""
+        self.id = id
+        self.version = version
+        self.name = name
+        self.current_temp = current_temp
+        self.operating_mode = operating_mode
+        self.cool_setpoint = cool_setpoint
+        self.heat_setpoint = heat_setpoint
+        self.fan_mode = fan_mode
+
+    @classmethod
+    def from_dict(cls, thermostat):
+        """Create a record from the dict form of a thermostat"""
+        return cls(
+            thermostat['id'],
+            thermostat['name'],
+            thermostat['current-temp'],
+            OPERATING_MODES.index(thermostat['operating-mode']),
+            int(thermostat['cool-setpoint']),
+            int(thermostat['heat-setpoint']),
+            FAN_MODES.index(thermostat['fan-mode']),
+        )
+
+    def to_dict(self):
+        """Return the dict form of the thermostat"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'current-temp': self.current_temp,
+            'operating-mode': OPERATING_MODES[self.operating_mode],
+            'cool-setpoint': self.cool_setpoint,
+            'heat-setpoint': self.heat_setpoint,
+            'fan-mode': FAN_MODES[self.fan_mode],
+        }
+
+    def copy(self):
+        """Return a new record with the same values
+
+        >>> record = ThermostatRecord(100, 'Attic', 70, 2, 75, 65, 1, 3)
+        >>> copy = record.copy()
+        >>> copy.set('fan-mode', 'auto')
+        >>> record.fan_mode, copy.fan_mode, copy.version
+        (1, 0, 3)
+        """
+        return ThermostatRecord(
+            self.id, self.name, self.current_temp, self.operating_mode,
+            self.cool_setpoint, self.heat_setpoint, self.fan_mode,
+            self.version
+        )
+
+    @staticmethod
+    def column(name, records, encoded=False):
+        """Return the values of a named attribute of many records
+
+        The values are in the same form as get returns unless encoded is
+        set, in which case the modes are left as their integer codes.
+        The version of each record can be fetched as well.
+
+        >>> records = [ThermostatRecord(100, 'Attic', 70, 2, 75, 65, 1),
+        ...            ThermostatRecord(101, 'Den', 68, 0, 72, 60, 0)]
+        >>> ThermostatRecord.column('operating-mode', records)
+        ['off', 'cool']
+        >>> ThermostatRecord.column('operating-mode', records, encoded=True)
+        [2, 0]
+        """
+        values = map(attrgetter(_SLOTS.get(name, name)), records)
+        if encoded:
+            return values
+        elif name == 'operating-mode':
+            return map(OPERATING_MODES.__getitem__, values)
+        elif name == 'fan-mode':
+            return map(FAN_MODES.__getitem__, values)
+        return values
+
+    def get(self, name):
+        """Return the value of a named attribute
+
+        A KeyError will be raised for unknown attributes.
+
+        >>> record = ThermostatRecord(100, 'Attic', 70, 2, 75, 65, 1)
+        >>> record.get('operating-mode'), record.get('current-temp')
+        ('off', 70)
+        >>> record.get('size')
+        Traceback (most recent call last):
+        ...
+        KeyError: 'size'
+        """
+        if name == 'operating-mode':
+            return OPERATING_MODES[self.operating_mode]
+        elif name == 'fan-mode':
+            return FAN_MODES[self.fan_mode]
+        return getattr(self, _SLOTS[name])
+
+    def set(self, name, value):
+        """Set the value of a named attribute
+
+        The value is expected to have already been validated.
+
+        >>> record = ThermostatRecord(100, 'Attic', 70, 2, 75, 65, 1)
+        >>> record.set('fan-mode', u'auto')
+        >>> record.set('cool-setpoint', '80')
+        >>> record.fan_mode, record.cool_setpoint
+        (0, 80)
+        """
+        if name == 'operating-mode':
+            self.operating_mode = OPERATING_MODES.index(value)
+        elif name == 'fan-mode':
+            self.fan_mode = FAN_MODES.index(value)
+        elif name in ('cool-setpoint', 'heat-setpoint'):
+            setattr(self, _SLOTS[name], int(value))
+        else:
+            setattr(self, _SLOTS[name], value)
+
+
+_SLOTS = dict((name, name.replace('-', '_'))
+              for name in ThermostatRecord.ATTRIBUTES)
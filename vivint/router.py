@@ -0,0 +1,89 @@
+class Router:
+    """Match request paths to handlers with a trie of path segments
+
+    Routes are paths such as /thermostats/<id>/<name>/, where a segment
+    in angle brackets matches any single segment and passes its value
+    to the handler. A path is split into segments once and each segment
+    is looked up in the children of the node matched so far, so the
+    cost of matching depends on the depth of the path rather than the
+    number of routes. Literal segments take precedence over parameters,
+    which are only tried when no route continues from the literal.
+
+    >>> router = Router([
+    ...     ('/thermostats/', 'Thermostats'),
+    ...     ('/thermostats/events/', 'Events'),
+    ...     ('/thermostats/<id>/', 'Thermostat'),
+    ...     ('/thermostats/<id>/<name>/', 'Attribute'),
+    ...     ('/thermostats/<id>/current-temp/history/', 'History'),
+    ... ])
+    >>> router.match('/thermostats/100/fan-mode/')
+    ('Attribute', ['100', 'fan-mode'])
+    >>> router.match('/thermostats/100/current-temp/')
+    ('Attribute', ['100', 'current-temp'])
+    >>> router.match('/thermostats/100/current-temp/history/')
+    ('History', ['100'])
+    >>> router.match('/thermostats/events/')
+    ('Events', [])
+    >>> router.match('/thermostats/100/fan-mode/extra/')
+    (None, None)
+    """
+
+    def __init__(self, routes=()):
+        """Create a router for a sequence of (path, handler) pairs"""
+        self._root = _Node()
+        for path, handler in routes:
+            self.add(path, handler)
+
+    def add(self, path, handler):
+        """Route a path, which must start and end with a slash"""
+        if not path.startswith('/') or not path.endswith('/'):
+            raise ValueError('route {} must start and end with /'.format(path))
+        node = self._root
+        for segment in path[1:-1].split('/') if path != '/' else ():
+            if segment.startswith('<') and segment.endswith('>'):
+                if node.parameter is None:
+                    node.parameter = _Node()
+                node = node.parameter
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.handler = handler
+
+    def match(self, path):
+        """Return the handler for a path and the values of its parameters
+
+        The path should end with a slash, as routes do. (None, None) is
+        returned if no route matches.
+        """
+        segments = path[1:-1].split('/') if path != '/' else []
+        args = []
+        handler = self._match(self._root, segments, 0, args)
+        if handler is None:
+            return None, None
+        return handler, args
+
+    def _match(self, node, segments, index, args):
+        if index == len(segments):
+            return node.handler
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            handler = self._match(child, segments, index + 1, args)
+            if handler is not None:
+                return handler
+        if node.parameter is None or not segment:
+            return None
+        args.append(segment)
+        handler = self._match(node.parameter, segments, index + 1, args)
+        if handler is None:
+            args.pop()
+        return handler
+
+
+class _Node(object):
+
+    __slots__ = ('children', 'parameter', 'handler')
+
+    def __init__(self):
+        self.children = {}
+        self.parameter = None
+        self.handler = None
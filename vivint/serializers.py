@@ -0,0 +1,128 @@
+import json
+
+from json import encoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONSerializer:
+    """Encode response bodies as JSON and decode request payloads
+
+    Encoding produces exactly the same bytes as json.dumps, but builds
+    the standard library's C encoder once rather than on every call,
+    which for the small objects the handlers encode is most of the
+    cost. Payloads are decoded by json.loads, raising a ValueError for
+    invalid JSON. Faster decoders such as ujson were passed over as they
+    mangle lone surrogates and reject NaN and integers of 2**64 or more.
+
+    >>> serializer = JSONSerializer()
+    >>> body = serializer.dumps({'result': [u'\\u2603', 75, None]})
+    >>> body
+    '{"result": ["\\\\u2603", 75, null]}'
+    >>> body == json.dumps({'result': [u'\\u2603', 75, None]})
+    True
+    >>> serializer.loads(body)
+    {u'result': [u'\\u2603', 75, None]}
+    """
+
+    name = 'json'
+    media_type = 'application/json'
+    media_types = ('application/json',)
+
+    def __init__(self):
+        """Create a serializer using the fastest encoders available"""
+        if encoder.c_make_encoder is None:
+            self.dumps = json.JSONEncoder().encode
+        else:
+            # The arguments json.dumps passes to the C encoder by default,
+            # except that objects are not checked for cycles
+            self._encode = encoder.c_make_encoder(
+                None, json.JSONEncoder().default,
+                encoder.encode_basestring_ascii, None, ': ', ', ', False,
+                False, True)
+        self.loads = json.loads
+
+    def dumps(self, value):
+        """Return the JSON encoding of a value as a byte string"""
+        return ''.join(self._encode(value, 0))
+
+    def result(self, body):
+        """Wrap an encoded value as the result of a response
+
+        >>> JSONSerializer().result('75')
+        '{"result": 75}'
+        """
+        return '{"result": ' + body + '}'
+
+    def results(self, bodies):
+        """Wrap a list of encoded values as the result of a response
+
+        >>> JSONSerializer().results(['75', '"on"'])
+        '{"result": [75, "on"]}'
+        """
+        return '{"result": [' + ', '.join(bodies) + ']}'
+
+
+class MessagePackSerializer:
+    """Encode response bodies and decode payloads as MessagePack
+
+    MessagePack carries the same values as JSON in fewer bytes, which
+    matters to clients polling over slow links. Byte strings are encoded
+    as text, as they would be in JSON, and text is decoded to unicode.
+    Available when the msgpack package is installed. Invalid payloads
+    raise a ValueError.
+    """
+
+    name = 'msgpack'
+    media_type = 'application/msgpack'
+    media_types = ('application/msgpack', 'application/x-msgpack')
+
+    def __init__(self):
+        """Create a serializer"""
+        self._packer = msgpack.Packer(use_bin_type=False)
+        self._prefix = self._packer.pack_map_header(1) + \
+            self._packer.pack(u'result')
+
+    def dumps(self, value):
+        """Return the MessagePack encoding of a value"""
+        return msgpack.packb(value, use_bin_type=False)
+
+    def loads(self, data):
+        """Return the value encoded in a MessagePack payload"""
+        try:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise ValueError('invalid MessagePack: {}'.format(e))
+
+    def result(self, body):
+        """Wrap an encoded value as the result of a response"""
+        return self._prefix + body
+
+    def results(self, bodies):
+        """Wrap a list of encoded values as the result of a response"""
+        return self._prefix + self._packer.pack_array_header(len(bodies)) + \
+            ''.join(bodies)
+
+
+def serializer(name='json'):
+    """Return a serializer for the named format
+
+    A ValueError is raised for unknown formats.
+
+    >>> serializer().media_type
+    'application/json'
+    """
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError('unknown serialization format {}'.format(name))
+
+
+SERIALIZERS = {
+    'json': JSONSerializer,
+}
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = MessagePackSerializer
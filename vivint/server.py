@@ -1,45 +1,152 @@
-import json
 import logging
+import sys
+import time
 import web
+import zlib
 
-from errors import (ReadonlyError, ServiceError, UnknownAttributeError,
+from cache import ResponseCache
+from errors import (DeviceError, ReadonlyError, UnknownAttributeError,
                     UnknownThermostatError, ValidationError)
+from events import EventLog
+from eventloop import NONBLOCKING, HTTPServer, serve_workers
+from metrics import Metrics
+from records import ThermostatRecord
+from router import Router
+from serializers import SERIALIZERS, JSONSerializer
 from service import Service
+from stats import FleetStats
 
 
 logger = logging.getLogger(__name__)
 
 
-class Thermostats:
+class Resource:
+    """A base for request handlers naming their route in the metrics"""
+
+    route = None
+
+    def __init__(self):
+        web.webapi.ctx.route = self.route or self.__class__.__name__.lower()
+
+
+class Thermostats(Resource):
     """Handle requests at the level of all thermostats"""
 
     def GET(self):
         """Return all data about all known thermostats
 
-        The response will be returned in JSON format and will contain all
-        information currently known to the system about all thermostats.
+        The response will be returned in JSON format, or MessagePack if
+        the Accept header prefers it, and will contain all information
+        currently known to the system about all thermostats.
+
+        The thermostats can be fetched a page at a time, in order of their
+        ids, by including a limit parameter in the query. The response will
+        then include a next value which should be passed as the cursor
+        parameter to fetch the following page, or null after the last page.
+
+        Including a stream parameter will send the thermostats as they are
+        encoded rather than encoding them all before responding, which
+        keeps the memory used constant for very large fleets. Only JSON
+        responses can be streamed.
+
+        The thermostats can be filtered by operating-mode and fan-mode,
+        and by cool-setpoint and heat-setpoint either exactly or within a
+        range given by the setpoint name with a -min or -max suffix, for
+        example cool-setpoint-min=70. The attributes included for each
+        thermostat can be limited with a comma separated list of names in
+        the fields parameter.
+
+        A limit or cursor which is not a positive integer, or an invalid
+        filter or field, will result in a bad request response.
+
+        If the request includes an If-None-Match header matching the
+        current entity tag a not modified response will be returned. A
+        service whose fleet version does not count every change, as when
+        thermostats change on their devices, gives listings no entity tag
+        and they are always built afresh.
         """
-        web.header('Content-Type', 'application/json')
-        result = json.dumps({'result': service.thermostats()})
-        logger.debug('result = {}', result)
+        try:
+            options = listing_options(web.input())
+        except (ValueError, ValidationError) as e:
+            logger.warn('invalid listing query: {}'.format(e))
+            return web.badrequest()
+
+        complete = service.COMPLETE_VERSION
+        tag = [service.epoch, service.version()]
+        query = web.webapi.ctx.env.get('QUERY_STRING')
+        if query:
+            tag.append('{:08x}'.format(zlib.crc32(query) & 0xffffffff))
+        if complete and not_modified(*tag):
+            raise web.notmodified()
+        serializer = web.webapi.ctx.serializer
+        web.header('Content-Type', serializer.media_type)
+        stream = options.pop('stream')
+        if complete and not stream and \
+                all(v is None for v in options.values()):
+            result = caches[serializer.name].thermostats()
+            logger.debug('result = %s', result)
+            return result
+
+        result = encode_thermostats(serializer=serializer, **options)
+        if not stream:
+            result = ''.join(result)
+        return result
+
+    def PATCH(self):
+        """Modify sets of attributes on many thermostats at once.
+
+        The payload should be a JSON, or MessagePack, object mapping
+        thermostat ids to objects of attribute names and values, as would
+        be sent to each thermostat individually. The response will be an
+        object with
+        the same ids, each mapped to the results of the individual changes
+        in the same form as a single thermostat patch. Every attribute for
+        an unknown thermostat will report the thermostat as unknown.
+
+        A request payload that cannot be decoded, is something other than
+        an object or has values other than objects will result in a bad
+        request response.
+        """
+        data = web.data()
+        try:
+            value = web.webapi.ctx.decoder.loads(data)
+        except ValueError:
+            logger.warn('request payload was invalid: %r', data)
+            return web.badrequest()
+        if not isinstance(value, dict) or \
+                not all(isinstance(v, dict) for v in value.values()):
+            logger.warn('request payload not an object of objects')
+            return web.badrequest()
+
+        result = service.update_many(value)
+        serializer = web.webapi.ctx.serializer
+        web.header('Content-Type', serializer.media_type)
+        result = serializer.dumps({'result': result})
+        logger.debug('result = %s', result)
         return result
 
 
-class Thermostat:
+class Thermostat(Resource):
     """Handle requests at the level of an individual thermostat."""
 
     def GET(self, id):
         """Retrieve all known data about a thermostat.
 
         All known information for a thermostat will be returned in JSON
-        format. If the thermostat indicated by the id cannot be found a
-        not found response will be returned.
+        format, or MessagePack if the Accept header prefers it. If the
+        thermostat indicated by the id cannot be found a not found
+        response will be returned.
+
+        If the request includes an If-None-Match header matching the
+        current entity tag a not modified response will be returned.
         """
         try:
-            result = service.thermostat(id)
-            web.header('Content-Type', 'application/json')
-            result = json.dumps({'result': result})
-            logger.debug('result = {}', result)
+            if not_modified(service.epoch, id, service.version(id)):
+                raise web.notmodified()
+            serializer = web.webapi.ctx.serializer
+            result = caches[serializer.name].thermostat(id)
+            web.header('Content-Type', serializer.media_type)
+            logger.debug('result = %s', result)
             return result
         except UnknownThermostatError:
             logger.warn('request for unknown thermostat {}'.format(id))
@@ -48,9 +155,9 @@ class Thermostat:
     def PATCH(self, id):
         """Modify a set of attributes on a particular thermostat.
 
-        The group of attributes should be a JSON object containing a
-        attribute name and value mapping. The response will be a JSON
-        object with the attribute names and the result of each individual
+        The group of attributes should be a JSON, or MessagePack, object
+        containing a attribute name and value mapping. The response will be
+        an object with the attribute names and the result of each individual
         change operation. If the change was sucessful the value will be 'ok',
         otherwise the value will be an informative explination of why the
         change could not be made.
@@ -58,51 +165,84 @@ class Thermostat:
         Failure to identify the indicated thermostate will result in a not
         found response.
 
-        A request payload that is not valid json or is something other than
-        a JSON object will result in a bad request response.
+        A request payload that cannot be decoded or is something other than
+        an object will result in a bad request response.
         """
         data = web.data()
         try:
-            value = json.loads(data)
+            value = web.webapi.ctx.decoder.loads(data)
         except ValueError:
-            logger.warn('request payload was invalid JSON: {}'.format(data))
-            # Not valid JSON
+            logger.warn('request payload was invalid: %r', data)
             return web.badrequest()
         if not isinstance(value, dict):
-            logger.warn('request payload not a JSON object: {}'.format(value))
+            logger.warn('request payload not an object: {}'.format(value))
             return web.badrequest()
 
-        result = {}
+        try:
+            result = service.update(id, value)
+        except UnknownThermostatError:
+            logger.warn('request to patch unknown thermostat {}'.format(id))
+            return web.notfound()
+        serializer = web.webapi.ctx.serializer
+        web.header('Content-Type', serializer.media_type)
+        result = serializer.dumps({'result': result})
+        logger.debug('result = %s', result)
+        return result
+
+
+class Events(Resource):
+    """Handle requests for the stream of thermostat changes"""
+
+    def GET(self, id=None):
+        """Stream changes to thermostats as server-sent events.
+
+        Each time an attribute is set a change event is sent with data
+        holding a JSON object of the thermostat id and the name and new
+        value of the attribute. If a thermostat id is given only changes
+        to that thermostat will be sent, and a not found response will
+        be returned if the thermostat cannot be found.
 
-        for k, v in value.items():
+        A client reconnecting with a Last-Event-ID header will be sent
+        the events it missed, as long as they are still held in the
+        server's bounded event log.
+        """
+        if id is not None:
             try:
-                service.set_attribute(id, k, v)
-                result[k] = 'ok'
+                service.version(id)
             except UnknownThermostatError:
+                logger.warn('request for unknown thermostat {}'.format(id))
                 return web.notfound()
-            except ServiceError as e:
-                result[k] = e.message
-        web.header('Content-Type', 'application/json')
-        result = json.dumps({'result': result})
-        logger.debug('result = {}'.format(result))
-        return result
+            id = int(id)
+        env = web.webapi.ctx.env
+        last_id = env.get('HTTP_LAST_EVENT_ID') or events.last_id()
+        web.header('Content-Type', 'text/event-stream')
+        web.header('Cache-Control', 'no-cache')
+        return stream_events(last_id, id, block=not env.get(NONBLOCKING))
 
 
-class Attribute:
+class Attribute(Resource):
     """Handle requests at the level of individual attriubtes"""
 
     def GET(self, id, name):
         """Retrieve an attribute.
 
-        This will return the value of an attribute in JSON format.
+        This will return the value of an attribute in JSON format, or
+        MessagePack if the Accept header prefers it.
         Failure to location the specified thermostat or attribute
         will result in an appropriate not found response.
+
+        If the request includes an If-None-Match header matching the
+        current entity tag a not modified response will be returned.
         """
         try:
+            version = service.version(id)
             result = service.get_attribute(id, name)
-            web.header('Content-Type', 'application/json')
-            result = json.dumps({'result': result})
-            logger.debug('result = {}'.format(result))
+            if not_modified(service.epoch, id, version, name):
+                raise web.notmodified()
+            serializer = web.webapi.ctx.serializer
+            web.header('Content-Type', serializer.media_type)
+            result = serializer.dumps({'result': result})
+            logger.debug('result = %s', result)
             return result
         except (UnknownAttributeError, UnknownThermostatError) as e:
             if isinstance(e, UnknownAttributeError):
@@ -114,11 +254,11 @@ class Attribute:
     def PUT(self, id, name):
         """Modify the value of the indicated attribute.
 
-        The payload of the request must be in JSON format and be either
-        a string or an interger depending on the expected value of the
-        indicated attribute.
+        The payload of the request must be in JSON, or MessagePack, format
+        and be either a string or an interger depending on the expected
+        value of the indicated attribute.
 
-        If the payload is not in JSON format a bad request will be returned.
+        If the payload cannot be decoded a bad request will be returned.
 
         If the attrubte cannot be modified, for example the id attribute,
         than a forbidden response will be returned.
@@ -131,7 +271,7 @@ class Attribute:
         # TODO add a text/plain API
         data = web.data()
         try:
-            value = json.loads(data)
+            value = web.webapi.ctx.decoder.loads(data)
             service.set_attribute(id, name, value)
             logger.debug('value set')
             return web.nocontent()
@@ -140,7 +280,7 @@ class Attribute:
                 msg = 'got invalid value ({}) for {}; {}'
                 logger.warn(msg.format(value, name, e.message))
             else:
-                logger.warn('got invalid JSON payload: {}'.format(data))
+                logger.warn('got invalid payload: %r', data)
             return web.badrequest()
         except ReadonlyError:
             logger.warn('got request to change readonly value {}'.format(name))
@@ -155,40 +295,431 @@ class Attribute:
             return web.notfound()
 
 
-def redirect_to_slash(handler):
-    """Redirect request if not ending in '/'
+class Stats(Resource):
+    """Handle requests for the summary of the whole fleet"""
+
+    def GET(self):
+        """Summarize the fleet of thermostats.
+
+        The result holds the number of thermostats, their numbers in each
+        operating mode and fan mode and the averages of their current
+        temperatures and setpoints, null for an empty fleet. With a
+        group-by parameter of operating-mode or fan-mode the result maps
+        each mode to the summary of the thermostats in it. Any other
+        group will result in a bad request response.
+
+        If the request includes an If-None-Match header matching the
+        current entity tag, which is built from the version of the fleet,
+        a not modified response will be returned without summarizing it.
+        Summaries have no entity tag when the fleet version does not count
+        every change to the thermostats.
+        """
+        group_by = web.input().get('group-by')
+        tag = [service.epoch, service.version(), 'stats']
+        if group_by is not None:
+            if group_by not in FleetStats.GROUPS:
+                logger.warn('invalid stats query: cannot group by {}'
+                            .format(group_by))
+                return web.badrequest()
+            tag.append(group_by)
+        if service.COMPLETE_VERSION and not_modified(*tag):
+            raise web.notmodified()
+        result = service.stats(group_by)
+        serializer = web.webapi.ctx.serializer
+        web.header('Content-Type', serializer.media_type)
+        return serializer.dumps({'result': result})
+
+
+class History(Resource):
+    """Handle requests for the temperature history of a thermostat"""
+
+    MAX_POINTS = 10000
+
+    def GET(self, id):
+        """Summarize the temperatures recorded by a thermostat.
+
+        The from and to query parameters give the range of the history
+        in seconds since the epoch, defaulting to the last hour, and
+        step the seconds summarized by each point, a multiple of 60
+        defaulting to 60. The result is a list of points, each with the
+        time its step starts and the minimum, maximum and average
+        temperature and number of samples in the step. Steps without
+        samples are left out.
+
+        Invalid parameters, or a range of more than MAX_POINTS steps,
+        will result in a bad request response and an unknown thermostat
+        in a not found response.
+        """
+        try:
+            start, end, step = history_options(web.input())
+        except ValueError as e:
+            logger.warn('invalid history query: {}'.format(e))
+            return web.badrequest()
+        try:
+            result = service.temperature_history(id, start, end, step)
+        except UnknownThermostatError:
+            logger.warn('request for unknown thermostat {}'.format(id))
+            return web.notfound()
+        serializer = web.webapi.ctx.serializer
+        web.header('Content-Type', serializer.media_type)
+        return serializer.dumps({'result': result})
+
+
+class Exposition(Resource):
+    """Handle requests for the service metrics"""
+
+    route = 'metrics'
 
-    A request to a path not ending will receive a redirect request to
-    the same path, but with a slash append.
+    def GET(self):
+        """Return the metrics in the Prometheus text format.
+
+        Request durations by route and method, response counts by route
+        and status and the durations of the service operations are
+        included.
+        """
+        web.header('Content-Type', 'text/plain; version=0.0.4')
+        return metrics.render()
+
+
+def listing_options(query):
+    """Convert the query of a thermostat listing to encoding options
+
+    The options are returned as a dict of the arguments to pass to
+    encode_thermostats along with whether the response should be
+    streamed. A ValueError or ValidationError will be raised if any of
+    the query parameters are invalid.
+    """
+    options = {
+        'after': None,
+        'limit': None,
+        'criteria': None,
+        'fields': None,
+        'stream': 'stream' in query,
+    }
+    if 'cursor' in query:
+        options['after'] = int(query.cursor)
+    if 'limit' in query:
+        options['limit'] = int(query.limit)
+        if options['limit'] < 1:
+            raise ValueError('limit must be positive')
+
+    criteria = {}
+    for name in ('operating-mode', 'fan-mode'):
+        if name in query:
+            service.validators[name](query[name])
+            criteria[name] = query[name]
+    for name in ('cool-setpoint', 'heat-setpoint'):
+        if name in query:
+            criteria[name] = int(query[name])
+        elif name + '-min' in query or name + '-max' in query:
+            low = query.get(name + '-min')
+            high = query.get(name + '-max')
+            criteria[name] = (None if low is None else int(low),
+                              None if high is None else int(high))
+    options['criteria'] = criteria or None
+
+    if 'fields' in query:
+        fields = [str(field) for field in query.fields.split(',')]
+        for field in fields:
+            if field not in ThermostatRecord.ATTRIBUTES:
+                raise ValueError('unknown field {}'.format(field))
+        options['fields'] = fields
+    return options
+
+
+def history_options(query, clock=time.time):
+    """Convert the query of a history request to a (from, to, step) range
+
+    A ValueError will be raised if any of the query parameters are
+    invalid.
+
+    >>> from web.utils import storage
+    >>> history_options(storage({'from': '0', 'to': '7200', 'step': '3600'}))
+    (0, 7200, 3600)
+    >>> history_options(storage(), clock=lambda: 7200.5)
+    (3601, 7201, 60)
+    """
+    # The default range runs to the end of the current second so that
+    # it takes in the samples just recorded
+    end = int(query['to']) if 'to' in query else int(clock()) + 1
+    start = int(query['from']) if 'from' in query else end - 3600
+    step = int(query['step']) if 'step' in query else 60
+    if step <= 0 or step % 60:
+        raise ValueError('step must be a positive multiple of 60')
+    if start > end:
+        raise ValueError('from must not be after to')
+    if (end - start) // step > History.MAX_POINTS:
+        raise ValueError('at most {} points may be requested'.format(
+            History.MAX_POINTS))
+    return start, end, step
+
+
+def encode_thermostats(after=None, limit=None, criteria=None, fields=None,
+                       serializer=None):
+    """Produce the encoded response for a range of thermostats
+
+    The response includes the thermostats starting after the given id.
+    Only the thermostats matching the criteria, as accepted by
+    Service.find, are included and each is limited to the given fields
+    if any are given. If a limit is given the response will include the
+    id to continue from in next.
+
+    JSON responses are produced in pieces, one per thermostat, while
+    other formats, needing the length of the list up front, are produced
+    in one piece. The server's default serializer is used unless another
+    is given.
+    """
+    serializer = serializer or serializers[0]
+    page = {}
+    thermostats = select_thermostats(after, limit, criteria, fields, page)
+    if not isinstance(serializer, JSONSerializer):
+        result = {'result': list(thermostats)}
+        if limit is not None:
+            result['next'] = page['next']
+        yield serializer.dumps(result)
+        return
+
+    yield '{"result": ['
+    for count, thermostat in enumerate(thermostats):
+        yield serializer.dumps(thermostat) if count == 0 else \
+            ', ' + serializer.dumps(thermostat)
+
+    if limit is None:
+        yield ']}'
+    else:
+        yield '], "next": {}}}'.format(serializer.dumps(page['next']))
+
+
+def select_thermostats(after, limit, criteria, fields, page):
+    """Produce the thermostats in a page of a listing
+
+    Once every thermostat has been produced the next value of the page
+    dict is set to the cursor to continue from, or None after the last
+    page.
     """
-    path = web.webapi.ctx.env['PATH_INFO']
-    logger.debug('request to path: {}'.format(path))
-    if path is not None and path[-1] != '/':
-        return web.redirect(path + '/')
-    return handler()
+    count = 0
+    last = None
+    for thermostat in service.thermostats(after, criteria):
+        if count == limit:
+            break
+        last = thermostat['id']
+        if fields is not None:
+            thermostat = dict((field, thermostat[field]) for field in fields)
+        yield thermostat
+        count += 1
+    else:
+        last = None
+    page['next'] = None if last is None else str(last)
+
+
+def stream_events(last_id, thermostat=None, block=True):
+    """Produce server-sent events for the changes following an event
+
+    Events are limited to a single thermostat if one is given. When
+    blocking, a comment is sent if no events arrive within a while so
+    that dead connections are noticed. Otherwise an empty string is
+    produced whenever there is nothing to send.
+    """
+    yield 'retry: 3000\n\n'
+    while True:
+        last_id, changes = events.since(last_id, thermostat)
+        for event_id, _, data in changes:
+            yield 'id: {}\nevent: change\ndata: {}\n\n'.format(event_id, data)
+        if not block:
+            yield ''
+        elif not events.wait(last_id, 15):
+            yield ': keep-alive\n\n'
+
+
+def not_modified(*parts):
+    """Set the ETag header and check it against If-None-Match
+
+    The entity tag is built from the given parts, which should identify
+    both the resource and its version, and from the format of the
+    response unless it is the default. True is returned if the request
+    included an If-None-Match header matching the tag, in which case the
+    response body does not need to be built.
+    """
+    serializer = web.webapi.ctx.serializer
+    if serializer is not serializers[0]:
+        parts += (serializer.name,)
+    tag = '"{}"'.format('-'.join(str(part) for part in parts))
+    web.header('ETag', tag)
+    header = web.webapi.ctx.env.get('HTTP_IF_NONE_MATCH')
+    if header is None:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == tag or candidate == '*':
+            logger.debug('entity tag %s not modified', tag)
+            return True
+    return False
+
+
+def measure(handler, clock=time.time):
+    """Record the duration and status of every request in the metrics
+
+    Requests rejected before reaching a handler are recorded under the
+    route none. The duration of a streamed response only covers the
+    time taken to start the stream.
+    """
+    ctx = web.webapi.ctx
+    start = clock()
+    try:
+        return handler()
+    finally:
+        metrics.observe(getattr(ctx, 'route', 'none'), ctx.method,
+                        ctx.status[:3], clock() - start)
+
+
+def report_unavailable(internalerror):
+    """Respond with a gateway timeout when a device cannot be reached
+
+    Wraps an application's internal error handler, which web.py calls
+    while handling any unexpected exception. Services communicating
+    with real thermostats raise a DeviceError when a device fails to
+    respond, which is reported as a gateway timeout rather than as an
+    internal error.
+    """
+    def handle():
+        error = sys.exc_info()[1]
+        if isinstance(error, DeviceError):
+            logger.warn(error.message)
+            return web.HTTPError('504 Gateway Timeout',
+                                 {'Content-Type': 'text/plain'},
+                                 '504 Gateway Timeout')
+        return internalerror()
+    return handle
 
 
-def require_json(handler):
-    """Reject payload requests not in json
+def negotiate():
+    """Choose the formats of the request payload and response
 
     Requests with PUT or PATCH methods will be required to include a
-    Content-Type header with the value of application/json. Requests
-    without the header will receive a bad request response. Those with
-    a value other than application/json will receive a unsupported
-    media type response.
+    Content-Type header naming a supported format, application/json or,
+    when msgpack is installed, application/msgpack. Requests without the
+    header will receive a bad request response. Those with any other
+    value will receive a unsupported media type response.
+
+    The response is encoded in the supported format the Accept header
+    prefers. Without an Accept header it is encoded in the format of the
+    payload, if there is one, and if the Accept header names none of the
+    supported formats it is encoded in the default format, JSON. Every
+    response varies with the Accept header, including those to requests
+    without one, so each is sent with Vary: Accept to stop shared
+    caches serving one format to a client asking for another.
+
+    The response rejecting the payload is returned, or None if the
+    request can be handled.
     """
-    env = web.webapi.ctx.env
+    ctx = web.webapi.ctx
+    env = ctx.env
     method = env['REQUEST_METHOD']
+    ctx.decoder = None
     if method == 'PUT' or method == 'PATCH':
         if 'CONTENT_TYPE' not in env:
             logger.warn('{} request without Content-Type'.format(method))
             return web.badrequest()
         content_type = env['CONTENT_TYPE']
-        if not content_type.startswith('application/json'):
+        ctx.decoder = media_types.get(
+            content_type.split(';', 1)[0].strip().lower())
+        if ctx.decoder is None:
             msg = '{} request with Content-Type of {}'
             logger.warn(msg.format(method, content_type))
             return web.unsupportedmediatype()
-    return handler()
+
+    accept = env.get('HTTP_ACCEPT')
+    if accept is None:
+        ctx.serializer = ctx.decoder or serializers[0]
+    else:
+        ctx.serializer = preferred(accept)
+    web.header('Vary', 'Accept')
+
+
+def preferred(accept):
+    """Return the serializer an Accept header prefers
+
+    The supported media type with the highest quality is chosen, the
+    first listed winning ties, and wildcards choose the default
+    serializer. The default is also returned if no supported media type
+    is acceptable.
+    """
+    best = serializers[0]
+    quality = 0
+    for item in accept.split(','):
+        parts = item.split(';')
+        media_type = parts[0].strip().lower()
+        if media_type == '*/*' or media_type == 'application/*':
+            serializer = serializers[0]
+        else:
+            serializer = media_types.get(media_type)
+        if serializer is None:
+            continue
+        q = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > quality:
+            best = serializer
+            quality = q
+    return best
+
+
+class Application(web.application):
+    """A web.py application dispatching requests through a Router
+
+    web.py tries the path against each of its url patterns in turn and
+    then passes every request through each processor. Here the path is
+    looked up once in a trie of routes, and redirecting paths missing
+    their trailing slash and negotiating formats are part of the same
+    dispatch step rather than processors of their own.
+    """
+
+    def __init__(self, routes, fvars):
+        """Create an application for a sequence of (path, class) pairs
+
+        Routes are given as to Router, and requests are handled by an
+        instance of the class routed to, calling the method named by
+        the request method with the values of the path's parameters.
+        Modules are never reloaded, which web.py would otherwise check
+        for on every request while web.config.debug is set, as it is by
+        default.
+        """
+        web.application.__init__(self, (), fvars, autoreload=False)
+        self.router = Router(routes)
+
+    def handle(self):
+        """Redirect, negotiate and dispatch the current request
+
+        A request to a path not ending in a slash will receive a redirect
+        to the same path with a slash appended. Requests which cannot be
+        routed receive a not found response and those with a method the
+        handler lacks a method not allowed response.
+        """
+        ctx = web.webapi.ctx
+        path = ctx.env['PATH_INFO']
+        if path is not None and path[-1:] != '/':
+            return web.redirect(path + '/')
+        rejected = negotiate()
+        if rejected is not None:
+            return rejected
+
+        cls, args = self.router.match(ctx.path)
+        if cls is None:
+            raise web.notfound()
+        name = ctx.method
+        if name == 'HEAD' and not hasattr(cls, name):
+            name = 'GET'
+        method = getattr(cls, name, None)
+        if method is None:
+            raise web.nomethod(cls)
+        return method(cls(), *args)
 
 
 class Server:
@@ -202,24 +733,76 @@ class Server:
     This object can also be stated to expose a web server.
     """
 
-    def __init__(self, service):
+    def __init__(self, service, serializer=None):
         """Create a new web server
 
         Requires a service to be provided to which the commnunication
-        with the thermostats will be deligated.
+        with the thermostats will be deligated. Encoded responses for
+        thermostat reads are kept in the cache attribute and recent
+        changes for event streams in the events attribute, and
+        measurements of the requests handled in the metrics attribute.
+        Bodies are encoded and decoded by the serializer, a
+        JSONSerializer unless another is given, and by a serializer for
+        each other format available when requested. The serializers
+        attribute holds them all, the default first, and a cache of
+        encoded responses is kept for each in caches, keyed by the name
+        of the format, the default's being the cache attribute.
         """
         logger.debug('initializing web service')
-        urls = (
-            '/thermostats/', Thermostats,
-            '/thermostats/(\w+)/', Thermostat,
-            '/thermostats/(\w+)/([^/]+)/', Attribute,
+        routes = (
+            ('/thermostats/', Thermostats),
+            ('/thermostats/events/', Events),
+            ('/thermostats/stats/', Stats),
+            ('/thermostats/<id>/', Thermostat),
+            ('/thermostats/<id>/events/', Events),
+            ('/thermostats/<id>/<name>/', Attribute),
+            ('/thermostats/<id>/current-temp/history/', History),
+            ('/metrics/', Exposition),
         )
         env = globals()
+        serializer = serializer or JSONSerializer()
+        self.serializers = [serializer] + [
+            SERIALIZERS[name]() for name in sorted(SERIALIZERS)
+            if name != serializer.name]
+        self.events = EventLog(service)
+        self.metrics = Metrics()
+        service = self.metrics.instrument(
+            service, 'thermostat', 'get_attribute', 'set_attribute',
+            'update', 'update_many')
+        self.caches = dict((s.name, ResponseCache(service, s))
+                           for s in self.serializers)
+        self.cache = self.caches[serializer.name]
         env['service'] = service
-        self.app = web.application(urls, env)
-        self.app.add_processor(redirect_to_slash)
-        self.app.add_processor(require_json)
+        env['serializers'] = self.serializers
+        env['media_types'] = dict((media_type, s) for s in self.serializers
+                                  for media_type in s.media_types)
+        env['caches'] = self.caches
+        env['events'] = self.events
+        env['metrics'] = self.metrics
+        self.app = Application(routes, env)
+        self.app.internalerror = report_unavailable(self.app.internalerror)
+        self.app.add_processor(measure)
+
+    def run(self, port=8080):
+        """Start the web server
+
+        Each connection is handled in its own thread by web.py's server.
+        """
+        web.httpserver.runsimple(self.app.wsgifunc(), ('0.0.0.0', int(port)))
 
-    def run(self):
-        """Start the web server"""
-        self.app.run()
+    def serve(self, port, workers=1, idle_timeout=None, max_requests=None):
+        """Start the web server on a single-threaded event loop
+
+        Unlike run, all connections are handled by one asyncore loop
+        and are kept alive between requests, until they have been idle
+        for idle_timeout seconds or have made max_requests requests if
+        given. With more than one worker the loop is run in that many
+        forked processes sharing the port, in which case the service
+        should be a SharedService.
+        """
+        address = ('0.0.0.0', int(port))
+        options = dict(idle_timeout=idle_timeout, max_requests=max_requests)
+        if workers > 1:
+            serve_workers(self.app.wsgifunc(), address, workers, **options)
+        else:
+            HTTPServer(self.app.wsgifunc(), address, **options).serve_forever()
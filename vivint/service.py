@@ -1,7 +1,19 @@
+import bisect
+import collections
+import itertools
 import logging
+import random
+import threading
+import time
 
-from errors import (ReadonlyError, UnknownAttributeError,
+from operator import itemgetter
+
+from errors import (ReadonlyError, ServiceError, UnknownAttributeError,
                     UnknownThermostatError, ValidationError)
+from history import TemperatureHistory
+from index import Index
+from records import ThermostatRecord
+from stats import FleetStats
 
 
 logger = logging.getLogger(__name__)
@@ -12,34 +24,68 @@ class Service:
 
     This version of the service is an in memory stub mock but could be
     replaced or updated to actually communication with real thermostats.
+
+    The service may be used from many threads. Records are never changed
+    once readers can see them: a change is applied to a copy of the
+    record, which then replaces the original, so reads take no locks and
+    always see every change made by a single update or none of them.
+    Changes to a thermostat are serialized by one of a fixed number of
+    striped locks, so writes to different thermostats rarely contend.
     """
 
     FAN_MODES = {u'auto', u'on'}
     OPERATING_MODES = {u'cool', u'heat', u'off'}
-
-    def __init__(self):
-        """Create a new service"""
+    INDEXED = ('operating-mode', 'fan-mode', 'cool-setpoint', 'heat-setpoint')
+    # Values known to pass setpoint validation, in both the integer and
+    # string forms requests commonly carry, so most can be checked with
+    # a single lookup
+    SETPOINTS = frozenset(range(30, 101) + map(unicode, range(30, 101)))
+    # Temperatures a thermostat may report, in degrees
+    TEMPERATURES = (-100, 200)
+    STRIPES = 64
+    # Minutes and hours of temperature history kept for each thermostat
+    HISTORY = (120, 168)
+    # Number of recent changes whose thermostats are remembered
+    CHANGES = 10000
+    # Whether the version of the fleet moves on with every change to the
+    # thermostats, so that it identifies the state of the whole fleet
+    COMPLETE_VERSION = True
+
+    def __init__(self, thermostats=None):
+        """Create a new service
+
+        The service manages the given thermostats, an iterable of dicts
+        in the same form as returned by thermostat, or a pair of sample
+        thermostats if none are provided. Internally each thermostat is
+        held as a compact ThermostatRecord.
+        """
         logger.debug('initializing thermostat service')
-        self._data = {
-            100: {
-                'id': 100,
-                'name': 'Upstairs Thermostat',
-                'current-temp': 71,
-                'operating-mode': 'heat',
-                'cool-setpoint': 75,
-                'heat-setpoint': 65,
-                'fan-mode': 'auto'
-            },
-            101: {
-                'id': 101,
-                'name': 'Downstairs Thermostat',
-                'current-temp': 69,
-                'operating-mode': 'heat',
-                'cool-setpoint': 75,
-                'heat-setpoint': 65,
-                'fan-mode': 'auto'
-            }
-        }
+        if thermostats is None:
+            thermostats = [
+                {
+                    'id': 100,
+                    'name': 'Upstairs Thermostat',
+                    'current-temp': 71,
+                    'operating-mode': 'heat',
+                    'cool-setpoint': 75,
+                    'heat-setpoint': 65,
+                    'fan-mode': 'auto'
+                },
+                {
+                    'id': 101,
+                    'name': 'Downstairs Thermostat',
+                    'current-temp': 69,
+                    'operating-mode': 'heat',
+                    'cool-setpoint': 75,
+                    'heat-setpoint': 65,
+                    'fan-mode': 'auto'
+                }
+            ]
+        self._data = {}
+        for thermostat in thermostats:
+            record = ThermostatRecord.from_dict(thermostat)
+            self._data[record.id] = record
+        self._build_indexes()
         self.validators = {
             'name': self._name_validation,
             'operating-mode': self._operating_mode_validation,
@@ -47,15 +93,203 @@ class Service:
             'heat-setpoint': self._heat_setpoint_validation,
             'fan-mode': self._fan_mode_validation,
         }
+        self._valid_values = {
+            'operating-mode': self.OPERATING_MODES,
+            'cool-setpoint': self.SETPOINTS,
+            'heat-setpoint': self.SETPOINTS,
+            'fan-mode': self.FAN_MODES,
+        }
+        self._listeners = []
+        self._version = 0
+        self._changed = collections.deque(maxlen=self.CHANGES)
+        self._locks = [threading.Lock() for _ in xrange(self.STRIPES)]
+        self._index_lock = threading.Lock()
+        self._history = {}
+        self._history_lock = threading.Lock()
+        self.epoch = '{:08x}'.format(random.getrandbits(32))
+
+    def subscribe(self, listener):
+        """Register a callable to be notified of attribute changes
+
+        The listener will be called with the thermostat id, attribute
+        name and new value each time an attribute is successfully set.
+
+        >>> service = Service()
+        >>> changes = []
+        >>> service.subscribe(lambda *change: changes.append(change))
+        >>> service.set_attribute('100', 'fan-mode', 'on')
+        >>> changes
+        [(100, 'fan-mode', 'on')]
+        """
+        self._listeners.append(listener)
+
+    def version(self, id=None):
+        """Return the version of a thermostat or of all thermostats
+
+        Versions increase each time an attribute is set so they can be
+        used to tell whether data has changed. Without an id the version
+        of the whole fleet is returned. The epoch attribute distinguishes
+        versions handed out by different instances of the service.
+
+        >>> service = Service()
+        >>> service.version(), service.version(100), service.version(101)
+        (0, 0, 0)
+        >>> service.set_attribute(100, 'fan-mode', 'on')
+        >>> service.version(), service.version(100), service.version(101)
+        (1, 1, 0)
+
+
+        If the provided id is unknown then an UnknownThermostatError
+        will be raised.
+
+        >>> Service().version(102)
+        Traceback (most recent call last):
+        ...
+        UnknownThermostatError
+        """
+        if id is None:
+            return self._version
+        return self._record(id).version
+
+    def changed(self, version):
+        """Return the ids of the thermostats changed since a version
+
+        The set of ids changed after the given version of the fleet is
+        returned, or None if the changes are no longer remembered or
+        were not made through this service.
+
+        >>> service = Service()
+        >>> service.set_attribute(100, 'fan-mode', 'on')
+        >>> service.set_attribute(101, 'fan-mode', 'on')
+        >>> service.changed(1), service.changed(2)
+        (set([101]), set([]))
+        >>> Service().changed(-1) is None
+        True
+        """
+        with self._index_lock:
+            count = self.version() - version
+            if not 0 <= count <= len(self._changed):
+                return None
+            return set(itertools.islice(reversed(self._changed), count))
 
-    def thermostats(self):
-        """Return information about all known thermostats.
+    def thermostats(self, after=None, criteria=None):
+        """Iterate over information about all known thermostats.
 
-        >>> Service().thermostats()
+        Thermostats are produced in order of their ids, which allows the
+        iteration to be resumed after a given id.
+
+        >>> list(Service().thermostats())
         [{'name': 'Upstairs Thermostat', 'operating-mode': 'heat', 'cool-setpoint': 75, 'heat-setpoint': 65, 'fan-mode': 'auto', 'current-temp': 71, 'id': 100}, {'name': 'Downstairs Thermostat', 'operating-mode': 'heat', 'cool-setpoint': 75, 'heat-setpoint': 65, 'fan-mode': 'auto', 'current-temp': 69, 'id': 101}]
+        >>> [t['id'] for t in Service().thermostats(after=100)]
+        [101]
+
+
+        Only the thermostats matching the criteria, as accepted by find,
+        will be produced if any are given.
+
+        >>> service = Service()
+        >>> service.set_attribute(101, 'operating-mode', 'cool')
+        >>> [t['id'] for t in service.thermostats(criteria={
+        ...     'operating-mode': 'cool'})]
+        [101]
+        """
+        logger.debug('fetch thermostats after %s', after)
+        for id in self.ids(after, criteria):
+            yield self._record(id).to_dict()
+
+    def ids(self, after=None, criteria=None):
+        """Iterate over the ids of the known thermostats in order
+
+        Only the ids following after, if given, of the thermostats
+        matching the criteria, as accepted by find, are produced.
+
+        Criteria on indexed attributes are met by stepping through the
+        sorted ids each index holds for them together, searching ahead
+        in each for the next id all of them share, so reading a page of
+        matches costs time in proportion to the page rather than to
+        every match. The lock guarding the indexes is held while each
+        id is searched for.
+
+        >>> service = Service()
+        >>> list(service.ids(after=100))
+        [101]
+        >>> service.set_attribute(101, 'fan-mode', 'on')
+        >>> list(service.ids(criteria={'fan-mode': 'on',
+        ...                            'cool-setpoint': (70, 80)}))
+        [101]
         """
-        logger.debug('fetch thermostats')
-        return self._data.values()
+        streams = []
+        scan = {}
+        for name, condition in sorted((criteria or {}).items()):
+            if name not in ThermostatRecord.ATTRIBUTES:
+                raise UnknownAttributeError(name)
+            index = self._indexes.get(name)
+            if index is None:
+                scan[name] = condition
+            elif isinstance(condition, tuple):
+                streams.append(index.buckets(*condition))
+            else:
+                streams.append([index.find(condition)])
+
+        if not streams:
+            ids = self._ids
+            start = 0 if after is None else bisect.bisect_right(ids, after)
+            for index in xrange(start, len(ids)):
+                if not scan or self._matches(self._record(ids[index]), scan):
+                    yield ids[index]
+            return
+
+        low = float('-inf') if after is None else int(after) + 1
+        while True:
+            with self._index_lock:
+                id = _intersect(streams, low)
+            if id is None:
+                return
+            if not scan or self._matches(self._record(id), scan):
+                yield id
+            low = id + 1
+
+    def find(self, criteria):
+        """Return the ids of the thermostats matching all of the criteria
+
+        The criteria map attribute names to either the value the attribute
+        must have or a (low, high) pair of inclusive bounds, either of
+        which may be None. The ids are returned in order.
+
+        Operating mode, fan mode and setpoints are indexed so the cost of
+        criteria on those is proportional to the number of matches, other
+        attributes are checked against each matching thermostat.
+
+        >>> service = Service()
+        >>> service.set_attribute(100, 'cool-setpoint', 80)
+        >>> service.find({'cool-setpoint': (78, None)})
+        [100]
+        >>> service.find({'operating-mode': 'heat', 'name': 'Upstairs Thermostat'})
+        [100]
+        >>> service.find({'fan-mode': 'on'})
+        []
+
+
+        If an attribute is unknown an UnknownAttributeError will be raised.
+
+        >>> Service().find({'size': 5})
+        Traceback (most recent call last):
+        ...
+        UnknownAttributeError
+        """
+        return list(self.ids(criteria=criteria))
+
+    def _matches(self, record, criteria):
+        for name, condition in criteria.items():
+            value = record.get(name)
+            if isinstance(condition, tuple):
+                low, high = condition
+                if (low is not None and value < low) or \
+                        (high is not None and value > high):
+                    return False
+            elif value != condition:
+                return False
+        return True
 
     def thermostat(self, id):
         """Return information about a specific thermostat.
@@ -80,11 +314,8 @@ class Service:
         ...
         UnknownThermostatError
         """
-        logger.debug('fetch thermostat {}'.format(id))
-        try:
-            return self._data[int(id)]
-        except (ValueError, KeyError):
-            raise UnknownThermostatError(id)
+        logger.debug('fetch thermostat %s', id)
+        return self._record(id).to_dict()
 
     def get_attribute(self, id, name):
         """Return the value for a named attribute
@@ -110,10 +341,10 @@ class Service:
         ...
         UnknownAttributeError
         """
+        record = self._record(id)
+        logger.debug('fetch %s', name)
         try:
-            thermostat = self.thermostat(id)
-            logger.debug('fetch {}'.format(name))
-            return thermostat[name]
+            return record.get(name)
         except KeyError:
             raise UnknownAttributeError(name)
 
@@ -161,22 +392,324 @@ class Service:
         ...
         ValidationError
         """
-        thermostat = self.thermostat(id)
-        logger.debug('set {} to {}'.format(name, value))
-        if name not in thermostat:
+        record = self._record(id)
+        logger.debug('set %s to %s', name, value)
+        self._validate(name, value)
+        self._commit(record.id, {name: value})
+
+    def record_temperature(self, id, value, at=None):
+        """Record a temperature reported by a thermostat
+
+        The sample, taken at the given time or now, is added to the
+        thermostat's history, and if the temperature has changed the
+        current-temp attribute, which cannot be set through the API, is
+        changed as any other attribute would be.
+
+        >>> service = Service()
+        >>> service.record_temperature(100, 73, at=600)
+        >>> service.record_temperature(100, 73, at=660)
+        >>> service.get_attribute(100, 'current-temp'), service.version(100)
+        (73, 1)
+
+
+        The value must be an integer within TEMPERATURES or a
+        ValidationError will be raised.
+
+        >>> service.record_temperature(100, 'warm')
+        Traceback (most recent call last):
+        ...
+        ValidationError
+        >>> service.record_temperature(100, 40000)
+        Traceback (most recent call last):
+        ...
+        ValidationError
+        """
+        record = self._record(id)
+        value = self._temperature(value)
+        self._sample(record.id, value, at)
+        if value != record.current_temp:
+            self._commit(record.id, {'current-temp': value})
+
+    def temperature_history(self, id, start, end, step):
+        """Summarize the temperatures of a thermostat over a time range
+
+        The temperatures recorded from start up to end, in seconds since
+        the epoch, are summarized every step seconds, which must be a
+        positive multiple of 60, with the minimum, maximum and average
+        temperature and number of samples. Steps are aligned to
+        multiples of step and steps without samples are left out.
+
+        History is kept by the minute for HISTORY[0] minutes and by the
+        hour for HISTORY[1] hours, and steps of whole hours are answered
+        from the hourly history, so the cost is proportional to the
+        points returned. Reading the history takes no locks.
+
+        >>> service = Service()
+        >>> for minute in range(3):
+        ...     service.record_temperature(100, 70 + minute, at=minute * 60)
+        >>> service.temperature_history(100, 0, 180, 120)
+        [{'count': 2, 'max': 71.0, 'min': 70.0, 'avg': 70.5, 'time': 0}, {'count': 1, 'max': 72.0, 'min': 72.0, 'avg': 72.0, 'time': 120}]
+
+
+        An UnknownThermostatError will be raised for unknown thermostats
+        and a ValueError for invalid steps.
+
+        >>> service.temperature_history(100, 0, 180, 90)
+        Traceback (most recent call last):
+        ...
+        ValueError: step must be a positive multiple of 60
+        """
+        record = self._record(id)
+        history = self._history.get(record.id) or TemperatureHistory(1, 1)
+        points = history.points(start, end, step)
+        return [{'time': time, 'min': low, 'max': high, 'avg': mean,
+                 'count': count} for time, low, high, mean, count in points]
+
+    def update(self, id, values):
+        """Set a group of attributes for an identified thermostat
+
+        Every attribute is validated before any of the valid values are
+        set, and the result of each individual change is returned as
+        'ok' or a message explaining why the value was not set.
+
+        >>> service = Service()
+        >>> result = service.update(100, {'name': 'Attic', 'id': 5})
+        >>> sorted(result.items())
+        [('id', 'value is readonly'), ('name', 'ok')]
+        >>> service.get_attribute(100, 'name'), service.version(100)
+        ('Attic', 1)
+
+
+        If the id doesn't match a known thermostat an
+        UnknownThermostatError will be raised and nothing will be set.
+
+        >>> Service().update(102, {'name': 'Attic'})
+        Traceback (most recent call last):
+        ...
+        UnknownThermostatError
+        """
+        record = self._record(id)
+        result = {}
+        valid = {}
+        for name, value in values.items():
+            try:
+                self._validate(name, value)
+                valid[name] = value
+                result[name] = 'ok'
+            except ServiceError as e:
+                result[name] = e.message
+        logger.debug('update %s with %s', id, valid)
+        if valid:
+            self._commit(record.id, valid)
+        return result
+
+    def update_many(self, changes):
+        """Set groups of attributes for many thermostats at once
+
+        The changes should map thermostat ids to the attributes to set
+        for that thermostat. The result maps the same ids to the results
+        of each change as returned by update. Every attribute for an
+        unknown thermostat is reported as such.
+
+        >>> result = Service().update_many({
+        ...     100: {'fan-mode': 'on'},
+        ...     102: {'fan-mode': 'on'},
+        ... })
+        >>> result[100], result[102]
+        ({'fan-mode': 'ok'}, {'fan-mode': 'unknown thermostat 102'})
+        """
+        result = self.validate_many(changes)
+        for id, values in changes.items():
+            try:
+                record = self._record(id)
+            except UnknownThermostatError as e:
+                result[id] = dict((name, e.message) for name in values)
+                continue
+            valid = dict((name, value) for name, value in values.items()
+                         if result[id][name] == 'ok')
+            logger.debug('update %s with %s', id, valid)
+            if valid:
+                self._commit(record.id, valid)
+        return result
+
+    def validate_many(self, changes):
+        """Validate groups of attributes for many thermostats at once
+
+        The changes are given in the same form as to update_many and the
+        result reports each value as 'ok' or with the message explaining
+        why it is not valid, as update would, without setting anything.
+        The thermostat ids are not checked.
+
+        Values are validated a column at a time, one attribute across
+        every thermostat, against precompiled tables of the values known
+        to be valid, with only the values missing from those tables
+        going through the individual validators.
+
+        >>> result = Service().validate_many({
+        ...     100: {'cool-setpoint': 80, 'fan-mode': 'on'},
+        ...     101: {'cool-setpoint': '20', 'id': 5},
+        ... })
+        >>> sorted(result[100].items())
+        [('cool-setpoint', 'ok'), ('fan-mode', 'ok')]
+        >>> result[101]['cool-setpoint'], result[101]['id']
+        ('value must be in the range 30-100', 'value is readonly')
+        """
+        ids = list(changes)
+        rows = changes.values()
+        result = dict((id, {}) for id in ids)
+        for name in set().union(*rows):
+            try:
+                column = map(itemgetter(name), rows)
+                column_ids = ids
+            except KeyError:
+                column_ids = [id for id in ids if name in changes[id]]
+                column = [changes[id][name] for id in column_ids]
+
+            if name not in ThermostatRecord.ATTRIBUTES:
+                error = UnknownAttributeError(name)
+                messages = itertools.repeat(error.message)
+            elif name not in self.validators:
+                messages = itertools.repeat(ReadonlyError(name).message)
+            else:
+                messages = self._validate_column(
+                    name, column, self._valid_values.get(name, ()))
+            for id, message in itertools.izip(column_ids, messages):
+                result[id][name] = message
+        return result
+
+    def stats(self, group_by=None):
+        """Summarize the whole fleet or each group of it
+
+        The summary, as returned by FleetStats.summary, holds the number
+        of thermostats, their numbers in each operating and fan mode and
+        the averages of their current temperatures and setpoints. The
+        totals are kept up to date as each change is made, so the cost
+        does not depend on the size of the fleet. Thermostats may be
+        grouped by operating-mode or fan-mode.
+
+        >>> service = Service()
+        >>> service.set_attribute(101, 'operating-mode', 'cool')
+        >>> summary = service.stats()
+        >>> summary['count'], summary['average']['current-temp']
+        (2, 70.0)
+        >>> service.stats('operating-mode')['cool']['count']
+        1
+
+
+        A ValueError is raised for any other group.
+
+        >>> Service().stats('name')
+        Traceback (most recent call last):
+        ...
+        ValueError: cannot group by name
+        """
+        if self._stats is None:
+            # Services not holding the thermostats themselves have them
+            # counted from a listing each time
+            stats = FleetStats()
+            stats.summary(group_by)  # rejects unknown groups up front
+            for thermostat in self.thermostats():
+                stats.add(ThermostatRecord.from_dict(thermostat))
+            return stats.summary(group_by)
+        with self._index_lock:
+            return self._stats.summary(group_by)
+
+    def _validate(self, name, value):
+        if name not in ThermostatRecord.ATTRIBUTES:
             raise UnknownAttributeError(name)
 
         try:
-            self.validators[name](value)
+            validator = self.validators[name]
         except KeyError:
             raise ReadonlyError(name)
+        validator(value)
+
+    def _validate_column(self, name, values, valid_values):
+        # Values found in valid_values are accepted without calling the
+        # validator, which is left to explain why the others are invalid
+        validator = self.validators[name]
+        messages = ['ok'] * len(values)
+        for index, value in enumerate(values):
+            try:
+                if value in valid_values:
+                    continue
+            except TypeError:
+                pass
+            try:
+                validator(value)
+            except ServiceError as e:
+                messages[index] = e.message
+        return messages
+
+    def _build_indexes(self):
+        self._ids = sorted(self._data)
+        self._indexes = {}
+        records = self._data.values()
+        ids = ThermostatRecord.column('id', records)
+        for name in self.INDEXED:
+            index = self._indexes[name] = Index()
+            index.update(ids, ThermostatRecord.column(name, records))
+        self._stats = FleetStats(records)
+
+    def _record(self, id):
+        try:
+            return self._data[int(id)]
+        except (ValueError, KeyError):
+            raise UnknownThermostatError(id)
 
-        thermostat[name] = value
+    def _sample(self, id, value, at=None):
+        # A history allows only one writer at a time. Samples have a
+        # lock of their own as device services take them from states
+        # fetched while a striped lock is held.
+        history = self._history.get(id)
+        if history is None:
+            history = self._history.setdefault(
+                id, TemperatureHistory(*self.HISTORY))
+        with self._history_lock:
+            history.add(time.time() if at is None else at, value)
+
+    def _commit(self, id, values):
+        # Listeners are notified under the same lock so that they see
+        # the changes to each thermostat in the order they were made
+        with self._locks[id % self.STRIPES]:
+            self._store(id, values)
+            for name, value in values.items():
+                for listener in self._listeners:
+                    listener(id, name, value)
+
+    def _store(self, id, values):
+        old = self._data[id]
+        record = old.copy()
+        for name, value in values.items():
+            record.set(name, value)
+        record.version += 1
+        self._data[id] = record
+        with self._index_lock:
+            for name in values:
+                index = self._indexes.get(name)
+                if index is not None:
+                    index.move(id, old.get(name), record.get(name))
+            self._stats.move(old, record)
+            self._version += 1
+            self._changed.append(id)
 
     ########################
     #  VALIDATION METHODS  #
     ########################
 
+    def _temperature(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError('current-temp', 'value must be an integer')
+        low, high = self.TEMPERATURES
+        if value < low or value > high:
+            raise ValidationError(
+                'current-temp',
+                'value must be in the range {}-{}'.format(low, high)
+            )
+        return value
+
     def _name_validation(self, value):
         if not isinstance(value, basestring) or value == '':
             raise ValidationError('name', 'value cannot be blank')
@@ -215,3 +748,33 @@ class Service:
                     value, valid_values
                 )
             )
+
+
+def _intersect(streams, low):
+    # The first id of at least low in every stream, each a list of
+    # sorted lists of ids, or None. Each stream in turn is searched for
+    # the id the others have reached until all of them agree on it.
+    id = low
+    agreed = 0
+    position = 0
+    while agreed < len(streams):
+        found = _seek(streams[position], id)
+        if found is None:
+            return None
+        if found == id:
+            agreed += 1
+        else:
+            id = found
+            agreed = 1
+        position = (position + 1) % len(streams)
+    return id
+
+
+def _seek(lists, low):
+    # The smallest id of at least low in any of the sorted lists
+    found = None
+    for ids in lists:
+        position = bisect.bisect_left(ids, low)
+        if position < len(ids) and (found is None or ids[position] < found):
+            found = ids[position]
+    return found
@@ -0,0 +1,200 @@
+import argparse
+import bisect
+import hashlib
+import heapq
+import logging
+import struct
+
+from devices import DeviceService
+from errors import UnknownAttributeError
+from fleet import thermostats
+from records import ThermostatRecord
+from simulator import DeviceSimulator
+from transport import Transport, parse_addresses
+
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """A consistent hash ring assigning keys to nodes
+
+    Each node is hashed onto the ring at replicas points and a key
+    belongs to the node at the first point following the key's hash.
+    Adding a node therefore only takes keys from the nodes preceding its
+    points, and removing one only hands its own keys on, so about 1/N of
+    the keys move when an Nth node joins or leaves.
+
+    >>> ring = HashRing(['a', 'b', 'c'])
+    >>> before = dict((id, ring.node(id)) for id in range(10000))
+    >>> ring.add('d')
+    >>> moved = [id for id in before if ring.node(id) != before[id]]
+    >>> set(ring.node(id) for id in moved)
+    set(['d'])
+    >>> 0.2 < len(moved) / 10000.0 < 0.3
+    True
+    """
+
+    HASH = struct.Struct('>Q')
+
+    def __init__(self, nodes=(), replicas=100):
+        """Create a ring of nodes, which may be any hashable values
+
+        Nodes are placed by the hash of their str, so rings built from
+        equal nodes in any process assign keys alike.
+        """
+        self.replicas = replicas
+        self.nodes = []
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        """Add a node to the ring"""
+        if node in self.nodes:
+            raise ValueError('{} is already in the ring'.format(node))
+        self.nodes.append(node)
+        for replica in xrange(self.replicas):
+            point = self._hash('{}#{}'.format(node, replica))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        """Remove a node from the ring"""
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner
+                in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node(self, key):
+        """Return the node a key belongs to
+
+        A LookupError is raised if the ring is empty.
+        """
+        if not self._points:
+            raise LookupError('the ring has no nodes')
+        index = bisect.bisect(self._points, self._hash(str(key)))
+        return self._owners[index % len(self._owners)]
+
+    def _hash(self, value):
+        return self.HASH.unpack_from(hashlib.md5(value).digest())[0]
+
+
+class ShardedService(DeviceService):
+    """A service for a fleet of thermostats split over several shards
+
+    Each shard is a process serving its share of the fleet over the
+    device protocol, as vivint shard does, and thermostats are placed on
+    shards by a HashRing of the shard addresses. Reads and changes to a
+    thermostat are forwarded to its shard over the transport's pooled
+    connections, while listings are requested from every shard at once
+    and merged in order of id, with any criteria applied by the shards.
+    Listings are fetched from each shard in batches of batch thermostats
+    so that reading a page does not fetch the whole fleet.
+
+    Every shard must hold exactly the thermostats the ring places on it,
+    a ValueError is raised otherwise. Adding or removing a shard moves
+    about 1/N of the fleet to other shards.
+    """
+
+    def __init__(self, addresses, replicas=100, batch=500, **options):
+        """Create a service for the shards at (host, port) addresses
+
+        Other options are passed to the Transport.
+        """
+        self.ring = HashRing(addresses, replicas)
+        transport = Transport.discover(addresses, **options)
+        for id, address in transport.devices.items():
+            owner = self.ring.node(id)
+            if owner != address:
+                transport.close()
+                raise ValueError(
+                    'thermostat {} is held by {}:{} but belongs on {}:{}'
+                    .format(id, address[0], address[1], *owner))
+        DeviceService.__init__(self, transport)
+        self.batch = batch
+
+    def thermostats(self, after=None, criteria=None):
+        """Iterate over information about all known thermostats
+
+        Thermostats are produced in order of their ids, after the given
+        id and matching the criteria, as with Service.
+        """
+        logger.debug('fetch thermostats after %s', after)
+        message = {'op': 'states', 'limit': self.batch}
+        if after is not None:
+            message['after'] = int(after)
+        if criteria:
+            for name in criteria:
+                if name not in ThermostatRecord.ATTRIBUTES:
+                    raise UnknownAttributeError(name)
+            message['criteria'] = criteria
+        responses = self.transport.broadcast(message)
+        streams = [self._states(address, message, response['states'])
+                   for address, response in responses.items()]
+        for id, state in heapq.merge(*streams):
+            del state['version']
+            self._sample(id, state['current-temp'])
+            yield state
+
+    def find(self, criteria):
+        """Return the ids of the thermostats matching all of the criteria"""
+        return [state['id'] for state in self.thermostats(criteria=criteria)]
+
+    def close(self):
+        """Close the connections to the shards"""
+        self.transport.close()
+
+    def _states(self, address, message, states):
+        # Produces (id, state) pairs from one shard, fetching the next
+        # batch whenever a full one runs out
+        while True:
+            for state in states:
+                yield state['id'], state
+            if len(states) < self.batch:
+                return
+            message = dict(message, after=states[-1]['id'])
+            states = self.transport.request(address, message)['states']
+
+
+def main(argv=None):
+    """Serve one shard of a fleet from the command line"""
+    parser = argparse.ArgumentParser(
+        prog='vivint shard',
+        description='Serve the thermostats placed on one of several shards')
+    parser.add_argument('--thermostats', type=int,
+                        help='size of the whole fleet, of which this shard '
+                             'serves its share (default: the two sample '
+                             'thermostats)')
+    parser.add_argument('--replicas', type=int, default=100,
+                        help='points on the hash ring per shard, which must '
+                             'match the service (default: 100)')
+    parser.add_argument('shards', metavar='HOST:PORT[,HOST:PORT]',
+                        help='the addresses of every shard')
+    parser.add_argument('index', type=int,
+                        help='the position of this shard in the list')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    addresses = parse_addresses(args.shards)
+    if not 0 <= args.index < len(addresses):
+        parser.error('index must be less than the number of shards')
+    address = addresses[args.index]
+    ring = HashRing(addresses, args.replicas)
+    if args.thermostats is None:
+        from service import Service
+        fleet = Service().thermostats()
+    else:
+        fleet = thermostats(args.thermostats)
+    shard = DeviceSimulator(
+        [t for t in fleet if ring.node(t['id']) == address],
+        ('0.0.0.0', address[1]))
+    logger.info('serving %s thermostats on port %s',
+                len(shard.service._ids), address[1])
+    try:
+        shard.serve_forever()
+    except KeyboardInterrupt:
+        shard.server_close()
@@ -0,0 +1,127 @@
+import logging
+import mmap
+import multiprocessing
+import struct
+
+from errors import UnknownThermostatError, ValidationError
+from records import ThermostatRecord
+from service import Service
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedService(Service):
+    """A service keeping thermostat state in shared memory
+
+    Thermostats are stored as fixed size records in an anonymous shared
+    memory map, so every process forked after the service is created
+    reads and writes the same data. This allows several server workers
+    to run on one host without their views of the thermostats diverging.
+
+    Change notifications from subscribe are only delivered within the
+    process that made the change.
+
+    >>> import os
+    >>> service = SharedService()
+    >>> pid = os.fork()
+    >>> if pid == 0:
+    ...     service.set_attribute(100, 'cool-setpoint', 80)
+    ...     os._exit(0)
+    >>> os.waitpid(pid, 0)[1]
+    0
+    >>> service.get_attribute(100, 'cool-setpoint')
+    80
+    >>> service.version(), service.version(100)
+    (1, 1)
+    """
+
+    HEADER = struct.Struct('<Q')
+    # id, version, current-temp, cool-setpoint, heat-setpoint,
+    # operating-mode, fan-mode, name length, name
+    RECORD = struct.Struct('<IQhhhBBB63s')
+    NAME_SIZE = 63
+
+    def __init__(self, thermostats=None):
+        """Create a new service in a new shared memory map"""
+        Service.__init__(self, thermostats)
+        data = self._data
+        del self._data, self._version
+
+        # Indexes and totals would only follow the changes made by this
+        # process
+        self._indexes = {}
+        self._stats = None
+
+        self._lock = multiprocessing.Lock()
+        self._map = mmap.mmap(
+            -1, self.HEADER.size + self.RECORD.size * len(data)
+        )
+        self._offsets = {}
+        for index, id in enumerate(self._ids):
+            offset = self.HEADER.size + self.RECORD.size * index
+            self._offsets[id] = offset
+            self._write(offset, data[id])
+        self.HEADER.pack_into(self._map, 0, 0)
+
+    def version(self, id=None):
+        """Return the version of a thermostat or of all thermostats
+
+        >>> SharedService().version(102)
+        Traceback (most recent call last):
+        ...
+        UnknownThermostatError
+        """
+        if id is not None:
+            return self._record(id).version
+        with self._lock:
+            return self.HEADER.unpack_from(self._map, 0)[0]
+
+    def _record(self, id):
+        try:
+            offset = self._offsets[int(id)]
+        except (ValueError, KeyError):
+            raise UnknownThermostatError(id)
+        with self._lock:
+            return self._read(offset)
+
+    def _read(self, offset):
+        (id, version, current_temp, cool_setpoint, heat_setpoint,
+         operating_mode, fan_mode, length, name) = \
+            self.RECORD.unpack_from(self._map, offset)
+        return ThermostatRecord(
+            id, name[:length].decode('utf-8'), current_temp, operating_mode,
+            cool_setpoint, heat_setpoint, fan_mode, version
+        )
+
+    def _write(self, offset, record):
+        name = self._encode_name(record.name)
+        self.RECORD.pack_into(
+            self._map, offset, record.id, record.version, record.current_temp,
+            record.cool_setpoint, record.heat_setpoint, record.operating_mode,
+            record.fan_mode, len(name), name
+        )
+
+    def _store(self, id, values):
+        offset = self._offsets[id]
+        with self._lock:
+            record = self._read(offset)
+            for name, value in values.items():
+                record.set(name, value)
+            record.version += 1
+            self._write(offset, record)
+            version = self.HEADER.unpack_from(self._map, 0)[0]
+            self.HEADER.pack_into(self._map, 0, version + 1)
+
+    def _encode_name(self, name):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return name
+
+    def _name_validation(self, value):
+        Service._name_validation(self, value)
+        if len(self._encode_name(value)) > self.NAME_SIZE:
+            raise ValidationError(
+                'name',
+                'value cannot be longer than {} bytes'.format(self.NAME_SIZE)
+            )
@@ -0,0 +1,208 @@
+import argparse
+import itertools
+import json
+import logging
+import SocketServer
+import threading
+import time
+
+from errors import ServiceError, UnknownThermostatError
+from fleet import thermostats
+from service import Service
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceSimulator(SocketServer.ThreadingTCPServer):
+    """A local stand in for a gateway to real thermostats
+
+    The simulator speaks the protocol used by the transport, answering
+    requests for the thermostats it holds in a Service, so the device
+    backed service can be run and tested without any hardware. Each
+    request can be delayed to mimic the round trip to a real device, and
+    the temperatures can be moved on at an interval, as by tick. The
+    connections and requests attributes count the connections accepted
+    and requests answered.
+
+    >>> from transport import Transport
+    >>> simulator = DeviceSimulator()
+    >>> simulator.start()
+    >>> transport = Transport.discover([simulator.server_address])
+    >>> sorted(transport.devices)
+    [100, 101]
+    >>> transport.fetch(100)['fan-mode']
+    u'auto'
+    >>> transport.close()
+    >>> simulator.stop()
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+    # The temperature thermostats drift towards while neither heating
+    # nor cooling
+    AMBIENT = 65
+
+    def __init__(self, thermostats=None, address=('127.0.0.1', 0),
+                 latency=0, interval=None):
+        """Create a simulator serving the thermostats at an address
+
+        The thermostats are given in the same form as to Service and
+        each response is delayed by latency seconds. If an interval is
+        given the temperatures are moved on every interval seconds while
+        the simulator is serving.
+        """
+        SocketServer.ThreadingTCPServer.__init__(self, address, _Handler)
+        self.service = Service(thermostats)
+        self.latency = latency
+        self.interval = interval
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Serve requests from a background thread"""
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving and close the listening socket"""
+        self._stopped.set()
+        self.shutdown()
+        self.server_close()
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve requests, moving the temperatures on at the interval"""
+        if self.interval:
+            ticker = threading.Thread(target=self._tick_loop)
+            ticker.daemon = True
+            ticker.start()
+        SocketServer.ThreadingTCPServer.serve_forever(self, poll_interval)
+
+    def tick(self, at=None):
+        """Move the temperature of every thermostat a degree on
+
+        A thermostat heating warms towards its heat setpoint and one
+        cooling cools towards its cool setpoint, otherwise temperatures
+        drift towards AMBIENT. Each temperature is recorded as a sample
+        taken at the given time or now.
+
+        >>> simulator = DeviceSimulator()
+        >>> simulator.service.set_attribute(101, 'heat-setpoint', 72)
+        >>> simulator.tick(at=0)
+        >>> simulator.tick(at=60)
+        >>> simulator.service.get_attribute(100, 'current-temp')
+        69
+        >>> simulator.service.temperature_history(101, 0, 120, 60)[1]
+        {'count': 1, 'max': 71.0, 'min': 71.0, 'avg': 71.0, 'time': 60}
+        >>> simulator.server_close()
+        """
+        for id in self.service._ids:
+            record = self.service._record(id)
+            temperature = record.current_temp
+            mode = record.get('operating-mode')
+            if mode == 'heat' and temperature < record.heat_setpoint:
+                target = record.heat_setpoint
+            elif mode == 'cool' and temperature > record.cool_setpoint:
+                target = record.cool_setpoint
+            else:
+                target = self.AMBIENT
+            self.service.record_temperature(
+                id, temperature + cmp(target, temperature), at)
+
+    def _tick_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.tick()
+
+    def respond(self, request):
+        """Return the response to a decoded request"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            response = {'seq': request.get('seq')}
+            try:
+                op = request.get('op')
+                if op == 'list':
+                    response['ids'] = list(self.service._ids)
+                elif op == 'get':
+                    response['state'] = self._state(request['id'])
+                elif op == 'states':
+                    response['states'] = self._states(request)
+                elif op == 'set':
+                    response['results'] = self.service.update(
+                        request['id'], request['values'])
+                    response['state'] = self._state(request['id'])
+                else:
+                    response['error'] = 'unknown operation'
+            except UnknownThermostatError:
+                response['error'] = 'unknown thermostat'
+            except (KeyError, ServiceError):
+                response['error'] = 'malformed request'
+        return response
+
+    def _states(self, request):
+        # The states of the thermostats matching any criteria, in order
+        # of id, after any id given and up to any limit given
+        criteria = request.get('criteria')
+        if criteria:
+            criteria = dict(
+                (name, tuple(value) if isinstance(value, list) else value)
+                for name, value in criteria.items())
+        ids = self.service.ids(request.get('after'), criteria)
+        return [self._state(id)
+                for id in itertools.islice(ids, request.get('limit'))]
+
+    def _state(self, id):
+        state = self.service.thermostat(id)
+        state['version'] = self.service.version(id)
+        return state
+
+
+def main(argv=None):
+    """Run a simulated gateway from the command line"""
+    parser = argparse.ArgumentParser(
+        prog='vivint simulate',
+        description='Serve simulated thermostats over the device protocol')
+    parser.add_argument('--thermostats', type=int,
+                        help='number of thermostats to simulate (default: '
+                             'the two sample thermostats)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to delay each response (default: 0)')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='seconds between changes to the temperatures '
+                             '(default: 60)')
+    parser.add_argument('port', nargs='?', type=int, default=9090,
+                        help='port to listen on (default: 9090)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    fleet = None
+    if args.thermostats is not None:
+        fleet = thermostats(args.thermostats)
+    simulator = DeviceSimulator(fleet, ('0.0.0.0', args.port),
+                                args.latency, args.interval)
+    logger.info('simulating %s thermostats on port %s',
+                len(simulator.service._ids), args.port)
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        simulator.server_close()
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        with self.server._lock:
+            self.server.connections += 1
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                logger.warn('malformed request from %s', self.client_address)
+                return
+            self.wfile.write(json.dumps(self.server.respond(request)) + '\n')
@@ -0,0 +1,103 @@
+from records import FAN_MODES, OPERATING_MODES
+
+
+class FleetStats:
+    """Totals over a fleet of thermostats kept up to date as they change
+
+    Thermostats are counted, and their temperatures and setpoints
+    summed, in one cell for each combination of operating and fan mode.
+    A change moves a thermostat's contribution between cells, and any
+    summary, for the whole fleet or grouped by either mode, is built
+    from the handful of cells, so both cost the same however large the
+    fleet.
+
+    >>> from records import ThermostatRecord
+    >>> records = [ThermostatRecord(100, 'Attic', 70, 1, 75, 65, 0),
+    ...            ThermostatRecord(101, 'Hall', 74, 0, 78, 60, 1)]
+    >>> stats = FleetStats(records)
+    >>> summary = stats.summary()
+    >>> summary['count'], summary['operating-mode']
+    (2, {'heat': 1, 'off': 0, 'cool': 1})
+    >>> summary['average']['current-temp']
+    72.0
+    >>> changed = records[1].copy()
+    >>> changed.operating_mode = 1
+    >>> stats.move(records[1], changed)
+    >>> stats.summary('operating-mode')['heat']['count']
+    2
+    """
+
+    SUMMED = ('current-temp', 'cool-setpoint', 'heat-setpoint')
+    GROUPS = {
+        'operating-mode': (0, OPERATING_MODES),
+        'fan-mode': (1, FAN_MODES),
+    }
+
+    def __init__(self, records=()):
+        """Create the totals for a sequence of ThermostatRecords"""
+        self._cells = {}
+        for operating_mode in range(len(OPERATING_MODES)):
+            for fan_mode in range(len(FAN_MODES)):
+                self._cells[operating_mode, fan_mode] = [0, 0, 0, 0]
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """Count a thermostat"""
+        cell = self._cells[record.operating_mode, record.fan_mode]
+        cell[0] += 1
+        cell[1] += record.current_temp
+        cell[2] += record.cool_setpoint
+        cell[3] += record.heat_setpoint
+
+    def remove(self, record):
+        """Stop counting a thermostat"""
+        cell = self._cells[record.operating_mode, record.fan_mode]
+        cell[0] -= 1
+        cell[1] -= record.current_temp
+        cell[2] -= record.cool_setpoint
+        cell[3] -= record.heat_setpoint
+
+    def move(self, old, new):
+        """Count the new state of a thermostat in place of the old"""
+        self.remove(old)
+        self.add(new)
+
+    def summary(self, group_by=None):
+        """Summarize the fleet or each group of it
+
+        A summary holds the number of thermostats, their numbers in each
+        operating and fan mode and the average of their temperatures
+        and setpoints, None when there are no thermostats. Grouped by
+        operating-mode or fan-mode, a summary is returned for each mode
+        keyed by its name. A ValueError is raised for other groups.
+        """
+        cells = self._cells.items()
+        if group_by is None:
+            return self._summarize(cells)
+        try:
+            position, names = self.GROUPS[group_by]
+        except KeyError:
+            raise ValueError('cannot group by {}'.format(group_by))
+        return dict((name, self._summarize(
+            [(key, cell) for key, cell in cells if key[position] == code]))
+            for code, name in enumerate(names))
+
+    def _summarize(self, cells):
+        totals = [0, 0, 0, 0]
+        modes = [dict.fromkeys(OPERATING_MODES, 0),
+                 dict.fromkeys(FAN_MODES, 0)]
+        for key, cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+            modes[0][OPERATING_MODES[key[0]]] += cell[0]
+            modes[1][FAN_MODES[key[1]]] += cell[0]
+        count = totals[0]
+        return {
+            'count': count,
+            'operating-mode': modes[0],
+            'fan-mode': modes[1],
+            'average': dict(
+                (name, float(total) / count if count else None)
+                for name, total in zip(self.SUMMED, totals[1:])),
+        }
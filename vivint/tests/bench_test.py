@@ -0,0 +1,22 @@
+import json
+
+from vivint import bench
+
+
+def test_run():
+    results = bench.run(thermostats=10, concurrency=2, duration=0.3,
+                        mix='get-one=1,put=1', warmup=0)
+    assert 'asyncore' == results['engine']
+    assert ['get-one', 'put'] == sorted(results['operations'])
+    assert 0 == results['total']['errors']
+    assert results['total']['requests'] > 0
+    assert results['total']['p50'] <= results['total']['p99']
+    json.dumps(results)
+
+
+def test_run_webpy():
+    results = bench.run('webpy', thermostats=10, concurrency=2, duration=0.3,
+                        mix='get-list=1,patch=1', warmup=0)
+    assert ['get-list', 'patch'] == sorted(results['operations'])
+    assert 0 == results['total']['errors']
+    assert results['total']['requests'] > 0
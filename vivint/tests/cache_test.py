@@ -0,0 +1,156 @@
+import collections
+import json
+import pytest
+import threading
+import time
+
+from vivint.cache import ReadThroughCache, ResponseCache
+from vivint.errors import UnknownThermostatError
+from vivint.fleet import thermostats
+from vivint.service import Service
+
+
+def test_thermostats():
+    service = Service()
+    cache = ResponseCache(service)
+
+    expected = json.dumps({'result': list(Service().thermostats())})
+    assert expected == cache.thermostats()
+    assert (0, 1) == (cache.hits, cache.misses)
+    assert expected == cache.thermostats()
+    assert (1, 1) == (cache.hits, cache.misses)
+
+    service.set_attribute(101, 'cool-setpoint', 80)
+    expected = json.dumps({'result': list(service.thermostats())})
+    assert expected == cache.thermostats()
+    assert (1, 2) == (cache.hits, cache.misses)
+
+
+def test_thermostats_rebuild():
+    service = Service(thermostats(100))
+    cache = ResponseCache(service)
+    cache.thermostats()
+    encoded = []
+    dumps = cache.serializer.dumps
+    cache.serializer.dumps = lambda value: encoded.append(value) or \
+        dumps(value)
+
+    # Only the thermostats changed since the last listing are encoded
+    service.set_attribute(50, 'fan-mode', 'on')
+    service.set_attribute(7, 'name', 'Attic')
+    expected = json.dumps({'result': list(service.thermostats())})
+    assert expected == cache.thermostats()
+    assert [7, 50] == sorted(t['id'] for t in encoded)
+
+    # Changes that are no longer remembered fall back to the versions
+    del encoded[:]
+    service._changed = collections.deque(maxlen=1)
+    service.set_attribute(3, 'fan-mode', 'on')
+    service.set_attribute(90, 'fan-mode', 'on')
+    expected = json.dumps({'result': list(service.thermostats())})
+    assert expected == cache.thermostats()
+    assert [3, 90] == sorted(t['id'] for t in encoded)
+
+
+def test_thermostat():
+    service = Service()
+    cache = ResponseCache(service)
+
+    expected = json.dumps({'result': service.thermostat(100)})
+    assert expected == cache.thermostat(100)
+    assert expected == cache.thermostat('100')
+    assert (1, 1) == (cache.hits, cache.misses)
+
+    with pytest.raises(UnknownThermostatError):
+        cache.thermostat(102)
+
+
+def test_invalidate_only_touched_thermostat():
+    service = Service()
+    cache = ResponseCache(service)
+    cache.thermostats()
+    assert (0, 1) == (cache.hits, cache.misses)
+
+    service.set_attribute(100, 'name', 'Attic')
+    cache.thermostat(101)
+    assert (1, 1) == (cache.hits, cache.misses)
+
+    expected = json.dumps({'result': service.thermostat(100)})
+    assert expected == cache.thermostat(100)
+    assert (1, 2) == (cache.hits, cache.misses)
+
+
+def test_read_through_stale_while_revalidate():
+    now = [0]
+    loaded = threading.Event()
+    values = iter(['first', 'second'])
+
+    def load(key):
+        value = next(values)
+        if value == 'second':
+            loaded.set()
+        return value
+
+    cache = ReadThroughCache(load, stale=10, clock=lambda: now[0])
+    assert 'first' == cache.get('a', 5)
+    now[0] = 12
+    assert 'first' == cache.get('a', 5)
+    assert loaded.wait(5)
+    for _ in range(100):
+        if cache.get('a', 5) == 'second':
+            break
+        time.sleep(0.01)
+    assert 'second' == cache.get('a', 5)
+    assert 1 == cache.misses
+
+
+def test_read_through_single_flight():
+    release = threading.Event()
+    calls = []
+
+    def load(key):
+        calls.append(key)
+        release.wait(5)
+        return key.upper()
+
+    cache = ReadThroughCache(load)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get('a', 5))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert ['A'] * 5 == results
+    assert ['a'] == calls
+
+
+def test_read_through_put_supersedes_load():
+    release = threading.Event()
+    cache = ReadThroughCache(lambda key: release.wait(5) and 'loaded')
+    thread = threading.Thread(target=cache.get, args=('a', 5))
+    thread.start()
+    time.sleep(0.05)
+    cache.put('a', 'written')
+    release.set()
+    thread.join()
+    assert 'written' == cache.get('a', 5)
+
+
+def test_read_through_bounded():
+    loads = []
+    cache = ReadThroughCache(lambda key: loads.append(key) or key, size=2)
+    for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+        cache.get(key, 60)
+    assert ['a', 'b', 'c', 'b'] == loads
+
+
+def test_read_through_errors():
+    cache = ReadThroughCache(lambda key: 1 / key)
+    with pytest.raises(ZeroDivisionError):
+        cache.get(0, 60)
+    with pytest.raises(ZeroDivisionError):
+        cache.get(0, 60)
+    assert 2 == cache.misses
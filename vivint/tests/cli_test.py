@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+
+
+# Runs the command line with the given arguments in a new interpreter and
+# prints the modules it imported
+PROGRAM = '''
+import json
+import sys
+sys.argv = ['vivint'] + sys.argv[1:]
+import vivint.cli
+try:
+    vivint.cli.main()
+except SystemExit:
+    pass
+print(json.dumps(sorted(name for name, module in sys.modules.items()
+                        if module is not None)))
+'''
+
+
+# As PROGRAM but returning at once where a simulator would start serving
+SERVE = PROGRAM.replace('import vivint.cli', """import vivint.cli
+import vivint.simulator
+vivint.simulator.DeviceSimulator.serve_forever = lambda self: None""")
+
+
+def imported(*args, **options):
+    program = options.get('program', PROGRAM)
+    process = subprocess.Popen([sys.executable, '-c', program] + list(args),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert 0 == process.returncode, stderr
+    return set(json.loads(stdout.splitlines()[-1])), stdout + stderr
+
+
+def test_version_imports():
+    modules, output = imported('--version')
+    assert '1.0.0' in output
+    assert 'web' not in modules
+    assert {'vivint', 'vivint.cli'} == \
+        set(name for name in modules if name.startswith('vivint'))
+
+
+def test_help_imports():
+    modules, output = imported('--help')
+    assert '--engine' in output
+    assert 'web' not in modules
+    assert {'vivint', 'vivint.cli'} == \
+        set(name for name in modules if name.startswith('vivint'))
+
+
+def test_simulate_imports():
+    modules, output = imported('simulate', '--help')
+    assert 'vivint simulate' in output
+    assert 'web' not in modules
+    assert 'vivint.server' not in modules
+
+
+def test_simulate_thermostats_imports():
+    for args in [('simulate', '--thermostats', '10', '0'),
+                 ('shard', '--thermostats', '10', '127.0.0.1:0', '0')]:
+        modules, output = imported(*args, program=SERVE)
+        assert '10 thermostats' in output
+        assert 'web' not in modules
+        assert 'vivint.server' not in modules
@@ -0,0 +1,124 @@
+import json
+import os
+import pytest
+import struct
+
+from vivint.durable import DurableService
+from vivint.errors import ValidationError
+from vivint.service import Service
+
+
+@pytest.fixture
+def directory(tmpdir):
+    return str(tmpdir.join('data'))
+
+
+def test_restart(directory):
+    service = DurableService(directory)
+    expected = Service()
+    for values in [{'name': u'Attic \u2603'}, {'operating-mode': 'cool'},
+                   {'cool-setpoint': '80', 'fan-mode': 'on'},
+                   {'heat-setpoint': 60}]:
+        service.update(101, values)
+        expected.update(101, values)
+    service.close()
+
+    service = DurableService(directory)
+    assert json.dumps(list(expected.thermostats())) == \
+        json.dumps(list(service.thermostats()))
+    assert (4, 4) == (service.version(), service.version(101))
+    assert [101] == [t['id'] for t in service.thermostats(
+        criteria={'operating-mode': 'cool'})]
+    service.close()
+
+
+def test_snapshot(directory):
+    service = DurableService(directory, snapshot_every=3)
+    for value in range(70, 75):
+        service.set_attribute(100, 'cool-setpoint', value)
+    service.snapshot(wait=True)
+    service.set_attribute(100, 'name', 'Attic')
+    service.close()
+    assert ['log.5', 'snapshot'] == sorted(os.listdir(directory))
+
+    service = DurableService(directory)
+    assert 74 == service.get_attribute(100, 'cool-setpoint')
+    assert 'Attic' == service.get_attribute(100, 'name')
+    assert (6, 6) == (service.version(), service.version(100))
+    service.close()
+
+
+def test_damaged_log(directory):
+    service = DurableService(directory, sync=True)
+    service.set_attribute(100, 'fan-mode', 'on')
+    service.set_attribute(100, 'cool-setpoint', 80)
+    service.close()
+    path = os.path.join(directory, 'log.0')
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+
+    service = DurableService(directory)
+    assert 'on' == service.get_attribute(100, 'fan-mode')
+    assert 75 == service.get_attribute(100, 'cool-setpoint')
+    service.set_attribute(100, 'heat-setpoint', 60)
+    service.close()
+
+    service = DurableService(directory)
+    assert 60 == service.get_attribute(100, 'heat-setpoint')
+    assert 2 == service.version()
+    service.close()
+
+
+def test_initial_thermostats(directory):
+    thermostats = [dict(t, id=t['id'] + 100) for t in Service().thermostats()]
+    DurableService(directory, thermostats).close()
+    service = DurableService(directory, [])
+    assert [200, 201] == [t['id'] for t in service.thermostats()]
+    service.close()
+
+
+def test_oversized_write(directory):
+    service = DurableService(directory)
+    with pytest.raises(ValidationError):
+        service.set_attribute(100, 'name', u'x' * 70000)
+    with pytest.raises(ValidationError):
+        service.record_temperature(100, 40000)
+    # A change that cannot be logged must leave the service untouched
+    with pytest.raises(struct.error):
+        service._commit(100, {'name': u'x' * 70000})
+    assert (0, 0) == (service.version(), service.version(100))
+    assert 'Upstairs Thermostat' == service.get_attribute(100, 'name')
+    service.set_attribute(100, 'fan-mode', 'on')
+    service.close()
+
+    service = DurableService(directory)
+    assert 'on' == service.get_attribute(100, 'fan-mode')
+    assert 1 == service.version()
+    service.set_attribute(100, 'cool-setpoint', 80)
+    service.close()
+
+    service = DurableService(directory)
+    assert 80 == service.get_attribute(100, 'cool-setpoint')
+    assert 2 == service.version()
+    service.close()
+
+
+def test_failed_snapshot(directory):
+    service = DurableService(directory, delay=0)
+    service.set_attribute(100, 'name', 'Attic')
+
+    def fail(path, version):
+        raise IOError('disk full')
+    service._write_snapshot = fail
+    service.snapshot()
+    # Another waiter taking the child's status must not be mistaken for
+    # a snapshot that was written
+    os.waitpid(service._snapshotting[0], 0)
+    service.snapshot(wait=True)
+    assert ['log.0', 'log.1', 'snapshot'] == sorted(os.listdir(directory))
+    service.close()
+
+    service = DurableService(directory)
+    assert 'Attic' == service.get_attribute(100, 'name')
+    assert 1 == service.version()
+    service.close()
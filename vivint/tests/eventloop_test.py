@@ -0,0 +1,194 @@
+import httplib
+import json
+import pytest
+import socket
+import threading
+
+from vivint.eventloop import HTTPServer
+from vivint.server import Server
+from vivint.service import Service
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(Server(Service()).app.wsgifunc(), ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'timeout': 0.05})
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+
+
+def connect(server):
+    return httplib.HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+
+
+def test_keep_alive(server):
+    conn = connect(server)
+
+    conn.request('GET', '/thermostats/')
+    response = conn.getresponse()
+    assert 200 == response.status
+    assert 'application/json' == response.getheader('Content-Type')
+    assert 2 == len(json.loads(response.read())['result'])
+    sock = conn.sock
+
+    headers = {'Content-Type': 'application/json'}
+    conn.request('PUT', '/thermostats/100/fan-mode/', '"on"', headers)
+    response = conn.getresponse()
+    assert 204 == response.status
+    assert '' == response.read()
+    assert sock is conn.sock
+
+    conn.request('GET', '/thermostats/100/fan-mode/')
+    response = conn.getresponse()
+    assert 200 == response.status
+    assert '{"result": "on"}' == response.read()
+    assert sock is conn.sock
+
+    conn.request('GET', '/thermostats/100')
+    response = conn.getresponse()
+    assert 301 == response.status
+    response.read()
+
+    conn.request('PUT', '/thermostats/100/fan-mode/', '"on"')
+    response = conn.getresponse()
+    assert 400 == response.status
+    response.read()
+
+    conn.request('GET', '/thermostats/102/')
+    response = conn.getresponse()
+    assert 404 == response.status
+    assert '404 Not Found' == response.read()
+    assert sock is conn.sock
+    conn.close()
+
+
+def test_connection_close(server):
+    conn = connect(server)
+    conn.request('GET', '/thermostats/100/', headers={'Connection': 'close'})
+    response = conn.getresponse()
+    assert 200 == response.status
+    assert 'close' == response.getheader('Connection')
+    response.read()
+    conn.close()
+
+    sock = socket.create_connection(('127.0.0.1', server.server_port), 5)
+    sock.sendall('GET /thermostats/100/name/ HTTP/1.0\r\n\r\n')
+    data = ''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    assert data.startswith('HTTP/1.0 200 OK\r\n')
+    assert data.endswith('\r\n\r\n{"result": "Upstairs Thermostat"}')
+
+
+def test_malformed_request(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port), 5)
+    sock.sendall('garbage\r\n\r\n')
+    assert sock.recv(4096).startswith('HTTP/1.1 400 Bad Request\r\n')
+    assert '' == sock.recv(4096)
+    sock.close()
+
+
+def test_streamed_response():
+    thermostats = [{
+        'id': id,
+        'name': 'Thermostat {}'.format(id),
+        'current-temp': 70,
+        'operating-mode': 'heat',
+        'cool-setpoint': 75,
+        'heat-setpoint': 65,
+        'fan-mode': 'auto'
+    } for id in range(2000)]
+    app = Server(Service(thermostats)).app.wsgifunc()
+    server = HTTPServer(app, ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'timeout': 0.05})
+    thread.start()
+    try:
+        conn = connect(server)
+        conn.request('GET', '/thermostats/?stream=1')
+        response = conn.getresponse()
+        assert 200 == response.status
+        assert 'chunked' == response.getheader('Transfer-Encoding')
+        assert thermostats == json.loads(response.read())['result']
+
+        conn.request('GET', '/thermostats/1/')
+        response = conn.getresponse()
+        assert thermostats[1] == json.loads(response.read())['result']
+        conn.close()
+    finally:
+        server.stop()
+        thread.join()
+
+
+def test_pipelining(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port), 5)
+    sock.sendall('GET /thermostats/100/name/ HTTP/1.1\r\n\r\n'
+                 'PUT /thermostats/100/fan-mode/ HTTP/1.1\r\n'
+                 'Content-Type: application/json\r\n'
+                 'Content-Length: 4\r\n\r\n"on"'
+                 'GET /thermostats/100/fan-mode/ HTTP/1.1\r\n'
+                 'Connection: close\r\n\r\n')
+    data = read_all(sock)
+    assert 3 == data.count('HTTP/1.1 ')
+    first, second, third = data.split('HTTP/1.1 ')[1:]
+    assert first.endswith('{"result": "Upstairs Thermostat"}')
+    assert second.startswith('204 ')
+    assert third.endswith('{"result": "on"}')
+
+
+def test_max_requests():
+    server, thread = start(max_requests=2)
+    try:
+        sock = socket.create_connection(('127.0.0.1', server.server_port), 5)
+        sock.sendall('GET /thermostats/100/name/ HTTP/1.1\r\n\r\n' * 3)
+        data = read_all(sock)
+        first, second = data.split('HTTP/1.1 ')[1:]
+        assert 'Connection: close' not in first
+        assert 'Connection: close\r\n' in second
+        assert second.endswith('{"result": "Upstairs Thermostat"}')
+    finally:
+        server.stop()
+        thread.join()
+
+
+def test_idle_timeout():
+    server, thread = start(idle_timeout=0.2)
+    try:
+        conn = connect(server)
+        conn.request('GET', '/thermostats/100/name/')
+        response = conn.getresponse()
+        assert 200 == response.status
+        response.read()
+        conn.sock.settimeout(5)
+        assert '' == conn.sock.recv(4096)
+        conn.close()
+    finally:
+        server.stop()
+        thread.join()
+
+
+def start(**options):
+    server = HTTPServer(Server(Service()).app.wsgifunc(), ('127.0.0.1', 0),
+                        **options)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'timeout': 0.05})
+    thread.start()
+    return server, thread
+
+
+def read_all(sock):
+    data = ''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    return data
@@ -0,0 +1,105 @@
+import httplib
+import json
+import pytest
+import threading
+
+from vivint.events import EventLog
+from vivint.eventloop import HTTPServer
+from vivint.server import Server, stream_events
+from vivint.service import Service
+
+
+def test_event_log():
+    service = Service()
+    log = EventLog(service, size=3)
+    start = log.last_id()
+    assert (start, []) == log.since(start)
+
+    service.set_attribute(100, 'fan-mode', 'on')
+    service.set_attribute(101, 'cool-setpoint', 80)
+    last_id, events = log.since(start)
+    assert [100, 101] == [id for _, id, _ in events]
+    assert {'id': 101, 'name': 'cool-setpoint', 'value': 80} == \
+        json.loads(events[1][2])
+    assert last_id == events[1][0] == log.last_id()
+
+    assert [events[1]] == log.since(events[0][0])[1]
+    assert [events[1]] == log.since(start, thermostat=101)[1]
+    assert (last_id, []) == log.since(last_id)
+
+    # Test old and foreign ids
+    for value in range(60, 64):
+        service.set_attribute(100, 'heat-setpoint', value)
+    assert [61, 62, 63] == [json.loads(data)['value']
+                            for _, _, data in log.since(start)[1]]
+    assert 3 == len(log.since('other-1')[1])
+    assert 3 == len(log.since(None)[1])
+
+    # Test waiting
+    assert not log.wait(log.last_id(), 0.01)
+    assert log.wait(start, 0.01)
+
+
+def test_stream_events():
+    service = Service()
+    server = Server(service)
+    stream = stream_events(server.events.last_id(), 100, block=False)
+    assert 'retry: 3000\n\n' == next(stream)
+    assert '' == next(stream)
+
+    service.set_attribute(101, 'fan-mode', 'on')
+    service.set_attribute(100, 'fan-mode', 'on')
+    event = next(stream)
+    assert event.startswith('id: {}-2\nevent: change\n'.format(service.epoch))
+    assert event.endswith('\ndata: {"id": 100, "name": "fan-mode", '
+                          '"value": "on"}\n\n')
+    assert '' == next(stream)
+
+
+def read_data(response):
+    while True:
+        line = response.fp.readline()
+        if line.startswith('data: '):
+            return json.loads(line[6:])
+
+
+def test_event_stream():
+    service = Service()
+    app = Server(service).app
+    server = HTTPServer(app.wsgifunc(), ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'timeout': 0.01})
+    thread.start()
+    try:
+        conn = httplib.HTTPConnection('127.0.0.1', server.server_port,
+                                      timeout=5)
+        conn.request('GET', '/thermostats/events/')
+        response = conn.getresponse()
+        assert 200 == response.status
+        assert 'text/event-stream' == response.getheader('Content-Type')
+        assert 'chunked' == response.getheader('Transfer-Encoding')
+
+        service.set_attribute(101, 'name', 'Basement')
+        expected = {'id': 101, 'name': 'name', 'value': 'Basement'}
+        assert expected == read_data(response)
+        conn.close()
+
+        # Test resuming a single thermostat stream
+        service.set_attribute(100, 'fan-mode', 'on')
+        service.set_attribute(101, 'fan-mode', 'on')
+        conn = httplib.HTTPConnection('127.0.0.1', server.server_port,
+                                      timeout=5)
+        headers = {'Last-Event-ID': '{}-1'.format(service.epoch)}
+        conn.request('GET', '/thermostats/101/events/', headers=headers)
+        response = conn.getresponse()
+        assert 200 == response.status
+        expected = {'id': 101, 'name': 'fan-mode', 'value': 'on'}
+        assert expected == read_data(response)
+        conn.close()
+    finally:
+        server.stop()
+        thread.join()
+
+    # Test errors
+    response = app.request('/thermostats/102/events/')
+    assert '404 Not Found' == response.status
@@ -0,0 +1,70 @@
+import sys
+import threading
+
+from vivint.history import Rollup, TemperatureHistory
+
+
+def test_rollup_retention():
+    rollup = Rollup(60, 10)
+    for minute in range(25):
+        rollup.add(minute * 60 + 30, minute)
+    points = rollup.points(0, 25 * 60, 60)
+    assert range(15, 25) == [point[4] and int(point[3]) for point in points]
+    assert [] == rollup.points(0, 15 * 60, 60)
+
+    # Samples for dropped intervals are ignored
+    rollup.add(0, 100)
+    assert points == rollup.points(0, 25 * 60, 60)
+
+
+def test_rollup_aggregates():
+    rollup = Rollup(60, 10)
+    for second, value in [(0, 70), (10, 68), (20, 73), (59, 71), (60, 65)]:
+        rollup.add(second, value)
+    assert [(0, 68.0, 73.0, 70.5, 4), (60, 65.0, 65.0, 65.0, 1)] == \
+        rollup.points(0, 120, 60)
+    assert [(0, 65.0, 73.0, 69.4, 5)] == rollup.points(0, 120, 300)
+    assert [(60, 65.0, 65.0, 65.0, 1)] == rollup.points(60, 61, 60)
+
+
+def test_history_resolutions():
+    history = TemperatureHistory(minutes=60, hours=48)
+    for minute in range(24 * 60):
+        history.add(minute * 60, 50 + minute // 60)
+
+    # Minutes older than an hour are gone but hours remain
+    assert [] == history.points(0, 3600, 60)
+    assert (82800, 73.0, 73.0, 73.0, 1) == history.points(82800, 82860, 60)[0]
+    hours = history.points(0, 86400, 3600)
+    assert 24 == len(hours)
+    assert [(hour * 3600, 50.0 + hour, 50.0 + hour, 50.0 + hour, 60)
+            for hour in range(24)] == hours
+    assert (0, 50.0, 55.0, 52.5, 360) == history.points(0, 86400, 21600)[0]
+
+
+def test_history_concurrent_reads():
+    history = TemperatureHistory()
+    errors = []
+    adding = threading.Event()
+    adding.set()
+
+    def read():
+        while adding.is_set():
+            for point in history.points(0, 120, 60):
+                if point[1:4] != (70.0, 70.0, 70.0):
+                    errors.append(point)
+
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        readers = [threading.Thread(target=read) for _ in range(2)]
+        for thread in readers:
+            thread.start()
+        for second in range(20000):
+            history.add(second % 120, 70)
+        adding.clear()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setcheckinterval(interval)
+    assert [] == errors
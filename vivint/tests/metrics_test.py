@@ -0,0 +1,48 @@
+from vivint.metrics import Histogram, Metrics
+from vivint.service import Service
+
+
+def test_histogram():
+    histogram = Histogram()
+    for value in [0.0001, 0.0005, 0.003, 0.2, 7]:
+        histogram.observe(value)
+    buckets = dict(histogram.cumulative())
+    assert 2 == buckets['0.0005']
+    assert 3 == buckets['0.005']
+    assert 4 == buckets['5.0']
+    assert 5 == buckets['+Inf']
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.observe('attribute', 'GET', '200', 0.003)
+    metrics.observe('attribute', 'GET', '404', 0.0002)
+    lines = metrics.render().splitlines()
+    prefix = 'vivint_request_duration_seconds'
+    labels = 'route="attribute",method="GET"'
+    assert '{}_bucket{{{},le="0.0005"}} 1'.format(prefix, labels) in lines
+    assert '{}_bucket{{{},le="+Inf"}} 2'.format(prefix, labels) in lines
+    assert '{}_count{{{}}} 2'.format(prefix, labels) in lines
+    assert 'vivint_responses_total{route="attribute",status="404"} 1' in lines
+
+
+def test_instrument_errors():
+    metrics = Metrics()
+    service = metrics.instrument(Service(), 'thermostat')
+    service.thermostat(100)
+    try:
+        service.thermostat(102)
+    except Exception:
+        pass
+    assert 2 == sum(metrics.operations['thermostat'].counts)
+    assert 'thermostat' == service.thermostat.__name__
+
+
+def test_instrument_twice():
+    service = Service()
+    first, second = Metrics(), Metrics()
+    first.instrument(service, 'thermostat').thermostat(100)
+    second.instrument(service, 'thermostat').thermostat(100)
+    service.thermostat(100)
+    assert 1 == sum(first.operations['thermostat'].counts)
+    assert 1 == sum(second.operations['thermostat'].counts)
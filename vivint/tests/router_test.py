@@ -0,0 +1,51 @@
+import pytest
+
+from vivint.router import Router
+from vivint.server import Server
+from vivint.service import Service
+
+
+def test_match():
+    router = Router([
+        ('/', 'root'),
+        ('/thermostats/', 'thermostats'),
+        ('/thermostats/events/', 'events'),
+        ('/thermostats/<id>/', 'thermostat'),
+        ('/thermostats/<id>/events/', 'events'),
+        ('/thermostats/<id>/<name>/', 'attribute'),
+    ])
+    assert ('root', []) == router.match('/')
+    assert ('thermostats', []) == router.match('/thermostats/')
+    assert ('events', []) == router.match('/thermostats/events/')
+    assert ('thermostat', [u'100']) == router.match(u'/thermostats/100/')
+    assert ('events', ['100']) == router.match('/thermostats/100/events/')
+    assert ('attribute', ['100', 'fan-mode']) == \
+        router.match('/thermostats/100/fan-mode/')
+    for path in ['/metrics/', '/thermostats//', '/thermostats/100//',
+                 '/thermostats/100/fan-mode/extra/', '//']:
+        assert (None, None) == router.match(path)
+
+    with pytest.raises(ValueError):
+        router.add('/thermostats', 'thermostats')
+
+    # A literal segment leading nowhere falls back to the parameter
+    router.add('/thermostats/<id>/current-temp/history/', 'history')
+    assert ('history', ['100']) == \
+        router.match('/thermostats/100/current-temp/history/')
+    assert ('attribute', ['100', 'current-temp']) == \
+        router.match('/thermostats/100/current-temp/')
+    assert (None, None) == router.match('/thermostats/100/current-temp/x/')
+
+
+def test_dispatch():
+    app = Server(Service()).app
+    response = app.request('/thermostats/100/fan-mode/', method='HEAD')
+    assert '200 OK' == response.status
+    response = app.request('/thermostats/100/', method='DELETE')
+    assert '405 Method Not Allowed' == response.status
+    for path in ['/', '/thermostat/', '/thermostats/100/fan-mode/extra/']:
+        assert '404 Not Found' == app.request(path).status
+    response = app.request('/thermostats/100/fan-mode', method='PUT')
+    assert '301 Moved Permanently' == response.status
+    assert 'http://0.0.0.0:8080/thermostats/100/fan-mode/' == \
+        response.headers['Location']
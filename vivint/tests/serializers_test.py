@@ -0,0 +1,62 @@
+import json
+import math
+import pytest
+
+from json import encoder
+
+from vivint.fleet import thermostats
+from vivint.serializers import JSONSerializer, serializer
+
+
+VALUES = [
+    {'result': list(thermostats(50))},
+    {'result': {'name': u'Attic \u2603', 'fan-mode': 'on', 'next': None}},
+    [True, False, 1.5, -7, 2 ** 63 - 1, '/', '"quoted"\n'],
+    u'\u2603',
+    75,
+]
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_json(monkeypatch, fast):
+    if not fast:
+        monkeypatch.setattr(encoder, 'c_make_encoder', None)
+    json_serializer = JSONSerializer()
+    for value in VALUES:
+        assert json.dumps(value) == json_serializer.dumps(value)
+        assert json.loads(json.dumps(value)) == \
+            json_serializer.loads(json.dumps(value))
+    assert '[1180591620717411303424]' == json_serializer.dumps([2 ** 70])
+    for data in ['', '[1,]', '{"a": 1} x']:
+        with pytest.raises(ValueError):
+            json_serializer.loads(data)
+
+    # Valid payloads decode exactly as json.loads decodes them
+    assert [u'\ud800', 2 ** 70] == \
+        json_serializer.loads('["\\ud800", 1180591620717411303424]')
+    assert math.isnan(json_serializer.loads('NaN'))
+    with pytest.raises(TypeError) as error:
+        json_serializer.dumps({'result': object()})
+    assert 'is not JSON serializable' in str(error.value)
+
+
+def test_unknown_format():
+    assert 'json' == serializer('json').name
+    with pytest.raises(ValueError):
+        serializer('xml')
+
+
+def test_msgpack():
+    msgpack = pytest.importorskip('msgpack')
+    msgpack_serializer = serializer('msgpack')
+    value = {'result': {'name': 'Attic', 100: [u'\u2603', 75, None]}}
+    body = msgpack_serializer.dumps(value)
+    assert {u'result': {u'name': u'Attic', 100: [u'\u2603', 75, None]}} == \
+        msgpack_serializer.loads(body)
+    assert body == msgpack_serializer.result(msgpack_serializer.dumps(
+        value['result']))
+    assert msgpack_serializer.dumps({'result': [1, 'on']}) == \
+        msgpack_serializer.results(['\x01', msgpack.packb('on')])
+    for data in ['', '\xc1', body + '\x01']:
+        with pytest.raises(ValueError):
+            msgpack_serializer.loads(data)
@@ -1,8 +1,11 @@
 import json
 import pytest
 
+from vivint.devices import DeviceService
 from vivint.server import Server
 from vivint.service import Service
+from vivint.simulator import DeviceSimulator
+from vivint.transport import Transport
 
 
 def test_get_thermostats():
@@ -59,6 +62,7 @@ def test_get_thermostat():
     }})
     assert '200 OK' == response.status
     assert response.headers['Content-Type'] == 'application/json'
+    assert 'Accept' == response.headers['Vary']
     assert expected == response.data
 
     # Test redirect
@@ -241,3 +245,403 @@ def test_put_attribute():
     assert '415 Unsupported Media Type' == response.status
     assert response.headers['Content-Type'] == 'text/html'
     assert '415 Unsupported Media Type' == response.data
+
+
+def test_conditional_get():
+    service = Service()
+    app = Server(service).app
+
+    for url in ['/thermostats/', '/thermostats/100/',
+                '/thermostats/100/fan-mode/']:
+        response = app.request(url)
+        assert '200 OK' == response.status
+        etag = response.headers['ETag']
+
+        headers = {'If-None-Match': etag}
+        response = app.request(url, headers=headers)
+        assert '304 Not Modified' == response.status
+        assert etag == response.headers['ETag']
+        assert '' == response.data
+
+        headers = {'If-None-Match': '"other", W/' + etag}
+        response = app.request(url, headers=headers)
+        assert '304 Not Modified' == response.status
+
+        headers = {'If-None-Match': '"other"'}
+        response = app.request(url, headers=headers)
+        assert '200 OK' == response.status
+
+    # Test a change produces a new tag
+    url = '/thermostats/100/'
+    etag = app.request(url).headers['ETag']
+    service.set_attribute(100, 'fan-mode', 'on')
+    response = app.request(url, headers={'If-None-Match': etag})
+    assert '200 OK' == response.status
+    assert etag != response.headers['ETag']
+
+    # Test a change to another thermostat keeps the tag
+    etag = app.request(url).headers['ETag']
+    service.set_attribute(101, 'fan-mode', 'on')
+    response = app.request(url, headers={'If-None-Match': etag})
+    assert '304 Not Modified' == response.status
+
+    # Test errors
+    headers = {'If-None-Match': '*'}
+    for url in ['/thermostats/102/', '/thermostats/100/fake/']:
+        response = app.request(url, headers=headers)
+        assert '404 Not Found' == response.status
+
+
+def test_patch_thermostats():
+    service = Service()
+    app = Server(service).app
+
+    # Test happy path
+    payload = json.dumps({
+        '100': {'name': 'New Name', 'id': 5},
+        '101': {'cool-setpoint': 'warm', 'fan-mode': 'on'},
+        '102': {'name': 'Other'},
+    })
+    expected = {'result': {
+        '100': {'name': 'ok', 'id': 'value is readonly'},
+        '101': {'cool-setpoint': 'value must be an integer', 'fan-mode': 'ok'},
+        '102': {'name': 'unknown thermostat 102'},
+    }}
+    headers = {'Content-Type': 'application/json'}
+    url = '/thermostats/'
+    response = app.request(url, method='PATCH', data=payload, headers=headers)
+    assert '200 OK' == response.status
+    assert response.headers['Content-Type'] == 'application/json'
+    assert expected == json.loads(response.data)
+    assert 'New Name' == service.get_attribute(100, 'name')
+    assert 'on' == service.get_attribute(101, 'fan-mode')
+    assert 75 == service.get_attribute(101, 'cool-setpoint')
+
+    # Test errors
+    for data in ['test', '[]', '{"100": []}', '{"100": "test"}']:
+        response = app.request(url, method='PATCH', data=data,
+                               headers=headers)
+        assert '400 Bad Request' == response.status
+
+    response = app.request(url, method='PATCH', data=payload)
+    assert '400 Bad Request' == response.status
+
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    response = app.request(url, method='PATCH', data=payload, headers=headers)
+    assert '415 Unsupported Media Type' == response.status
+
+
+def test_get_thermostats_pages():
+    thermostats = [{
+        'id': id,
+        'name': 'Thermostat {}'.format(id),
+        'current-temp': 70,
+        'operating-mode': 'heat',
+        'cool-setpoint': 75,
+        'heat-setpoint': 65,
+        'fan-mode': 'auto'
+    } for id in range(1, 11)]
+    app = Server(Service(reversed(thermostats))).app
+
+    ids = []
+    url = '/thermostats/?limit=4'
+    while url:
+        response = app.request(url)
+        assert '200 OK' == response.status
+        assert response.headers['Content-Type'] == 'application/json'
+        data = json.loads(response.data)
+        assert len(data['result']) <= 4
+        ids += [t['id'] for t in data['result']]
+        url = data['next'] and '/thermostats/?limit=4&cursor=' + data['next']
+    assert range(1, 11) == ids
+
+    response = app.request('/thermostats/?limit=5&cursor=5')
+    assert {'result': thermostats[5:], 'next': None} == \
+        json.loads(response.data)
+
+    # Test streaming
+    response = app.request('/thermostats/?stream=1')
+    assert '200 OK' == response.status
+    assert app.request('/thermostats/').data == response.data
+
+    response = app.request('/thermostats/?stream=1&limit=3')
+    assert {'result': thermostats[:3], 'next': '3'} == \
+        json.loads(response.data)
+
+    # Test errors
+    for query in ['limit=0', 'limit=-1', 'limit=a', 'cursor=a']:
+        response = app.request('/thermostats/?' + query)
+        assert '400 Bad Request' == response.status
+
+
+def test_get_thermostats_filtered():
+    thermostats = [{
+        'id': id,
+        'name': 'Thermostat {}'.format(id),
+        'current-temp': 60 + id,
+        'operating-mode': ['cool', 'heat', 'off'][id % 3],
+        'cool-setpoint': 70 + id,
+        'heat-setpoint': 60 - id,
+        'fan-mode': ['auto', 'on'][id % 2]
+    } for id in range(12)]
+    service = Service(thermostats)
+    app = Server(service).app
+
+    def ids(url):
+        response = app.request(url)
+        assert '200 OK' == response.status
+        return [t['id'] for t in json.loads(response.data)['result']]
+
+    assert [0, 3, 6, 9] == ids('/thermostats/?operating-mode=cool')
+    assert [3, 9] == ids('/thermostats/?operating-mode=cool&fan-mode=on')
+    assert [5] == ids('/thermostats/?cool-setpoint=75')
+    assert [2, 3, 4] == ids('/thermostats/?cool-setpoint-min=72'
+                            '&cool-setpoint-max=74')
+    assert [9, 10, 11] == ids('/thermostats/?heat-setpoint-max=51')
+    assert [9] == ids('/thermostats/?heat-setpoint-max=51&limit=1&cursor=6')
+    assert [] == ids('/thermostats/?cool-setpoint=100')
+
+    service.set_attribute(11, 'operating-mode', 'cool')
+    service.set_attribute(0, 'cool-setpoint', 90)
+    assert [3, 6, 9, 11] == ids('/thermostats/?operating-mode=cool'
+                                '&cool-setpoint-max=85')
+
+    # Test projection
+    response = app.request('/thermostats/?fields=id,current-temp&fan-mode=on')
+    assert [{'id': id, 'current-temp': 60 + id} for id in range(1, 12, 2)] \
+        == json.loads(response.data)['result']
+
+    etag = response.headers['ETag']
+    response = app.request('/thermostats/?fields=id&fan-mode=on',
+                           headers={'If-None-Match': etag})
+    assert '200 OK' == response.status
+
+    # Pages continue from the last id even when it is not returned
+    for query in ['', '&limit=2', '&limit=2&stream=1']:
+        response = app.request('/thermostats/?fields=name&fan-mode=on'
+                               + query)
+        assert '200 OK' == response.status
+        data = json.loads(response.data)
+        assert [{'name': 'Thermostat 1'}, {'name': 'Thermostat 3'}] == \
+            data['result'][:2]
+    assert '3' == data['next']
+
+    # Test errors
+    for query in ['operating-mode=warm', 'fan-mode=', 'cool-setpoint=a',
+                  'heat-setpoint-min=b', 'fields=id,size']:
+        response = app.request('/thermostats/?' + query)
+        assert '400 Bad Request' == response.status
+
+
+def test_get_metrics():
+    service = Service()
+    Server(service)
+    server = Server(service)
+    app = server.app
+    app.request('/thermostats/100/')
+    app.request('/thermostats/100/fan-mode/')
+    app.request('/thermostats/102/')
+    app.request('/thermostats/100/fan-mode/', method='PUT', data='"on"',
+                headers={'Content-Type': 'application/json'})
+    app.request('/thermostats/100/fan-mode/', method='PUT', data='"on"')
+    headers = {'Content-Type': 'application/json'}
+    app.request('/thermostats/100/', method='PATCH', data='{"name": "Attic"}',
+                headers=headers)
+    app.request('/thermostats/', method='PATCH',
+                data='{"101": {"name": "Den"}}', headers=headers)
+
+    response = app.request('/metrics/')
+    assert '200 OK' == response.status
+    assert response.headers['Content-Type'].startswith('text/plain')
+    lines = response.data.splitlines()
+    assert 'vivint_responses_total{route="thermostat",status="200"} 2' in lines
+    assert 'vivint_responses_total{route="thermostat",status="404"} 1' in lines
+    assert 'vivint_responses_total{route="attribute",status="204"} 1' in lines
+    assert 'vivint_responses_total{route="none",status="400"} 1' in lines
+    assert 'vivint_request_duration_seconds_count' \
+        '{route="attribute",method="PUT"} 1' in lines
+    assert 'vivint_service_duration_seconds_count' \
+        '{operation="get_attribute"} 1' in lines
+    assert 'vivint_service_duration_seconds_count' \
+        '{operation="set_attribute"} 1' in lines
+    assert 'vivint_service_duration_seconds_count' \
+        '{operation="thermostat"} 1' in lines
+    assert 'vivint_service_duration_seconds_count' \
+        '{operation="update"} 1' in lines
+    assert 'vivint_service_duration_seconds_count' \
+        '{operation="update_many"} 1' in lines
+
+
+def test_msgpack():
+    msgpack = pytest.importorskip('msgpack')
+    app = Server(Service()).app
+    accept = {'Accept': 'application/msgpack'}
+
+    def decode(response):
+        assert 'application/msgpack' == response.headers['Content-Type']
+        return msgpack.unpackb(response.data, raw=False,
+                               strict_map_key=False)
+
+    response = app.request('/thermostats/', headers=accept)
+    assert '200 OK' == response.status
+    assert 'Accept' == response.headers['Vary']
+    assert json.loads(app.request('/thermostats/').data) == decode(response)
+    assert len(response.data) < len(app.request('/thermostats/').data)
+    response = app.request('/thermostats/?limit=1&fields=id,fan-mode',
+                           headers=accept)
+    assert {'result': [{'id': 100, 'fan-mode': 'auto'}], 'next': '100'} == \
+        decode(response)
+    response = app.request('/thermostats/100/', headers=accept)
+    assert 'Upstairs Thermostat' == decode(response)['result']['name']
+    etag = response.headers['ETag']
+    assert etag != app.request('/thermostats/100/').headers['ETag']
+    response = app.request('/thermostats/100/',
+                           headers=dict(accept, **{'If-None-Match': etag}))
+    assert '304 Not Modified' == response.status
+
+    response = app.request('/thermostats/100/cool-setpoint/', method='PUT',
+                           data=msgpack.packb(80),
+                           headers={'Content-Type': 'application/msgpack'})
+    assert '204 No Content' == response.status
+    response = app.request('/thermostats/100/cool-setpoint/', headers=accept)
+    assert {'result': 80} == decode(response)
+
+    headers = {'Content-Type': 'application/x-msgpack'}
+    response = app.request('/thermostats/100/', method='PATCH',
+                           data=msgpack.packb({'fan-mode': 'on', 'id': 5}),
+                           headers=headers)
+    assert {'result': {'fan-mode': 'ok', 'id': 'value is readonly'}} == \
+        decode(response)
+    response = app.request('/thermostats/', method='PATCH', headers=headers,
+                           data=msgpack.packb({101: {'fan-mode': 'on'}}))
+    assert {'result': {101: {'fan-mode': 'ok'}}} == decode(response)
+    assert 'on' == decode(app.request('/thermostats/101/', headers=accept))[
+        'result']['fan-mode']
+
+    for data in ['\xc1', msgpack.packb([1]), msgpack.packb(1) + '\x01']:
+        response = app.request('/thermostats/100/', method='PATCH',
+                               headers=headers, data=data)
+        assert '400 Bad Request' == response.status
+
+
+def test_accept():
+    app = Server(Service()).app
+    for accept, media_type in [
+            ('application/json', 'application/json'),
+            ('text/html', 'application/json'),
+            ('*/*', 'application/json'),
+            ('application/msgpack;q=0.5, application/json;q=0.9',
+             'application/json'),
+            ('application/msgpack, */*;q=0.1', 'application/msgpack'),
+            ('application/msgpack;q=0', 'application/json')]:
+        if 'msgpack' in media_type:
+            pytest.importorskip('msgpack')
+        response = app.request('/thermostats/100/fan-mode/',
+                               headers={'Accept': accept})
+        assert media_type == response.headers['Content-Type']
+
+
+def test_get_temperature_history():
+    service = Service()
+    app = Server(service).app
+    for minute in range(180):
+        service.record_temperature(100, 60 + minute % 20, at=minute * 60)
+
+    url = '/thermostats/100/current-temp/history/?from=0&to=10800&step=3600'
+    response = app.request(url)
+    assert '200 OK' == response.status
+    assert 'application/json' == response.headers['Content-Type']
+    result = json.loads(response.data)['result']
+    assert [0, 3600, 7200] == [point['time'] for point in result]
+    assert {'time': 0, 'min': 60.0, 'max': 79.0, 'avg': 69.5,
+            'count': 60} == result[0]
+
+    # Only the last two hours are kept by the minute
+    url = '/thermostats/100/current-temp/history/?from=600&to=720'
+    assert [] == json.loads(app.request(url).data)['result']
+    url = '/thermostats/100/current-temp/history/?from=10200&to=10320'
+    result = json.loads(app.request(url).data)['result']
+    assert [(10200, 70.0), (10260, 71.0)] == \
+        [(point['time'], point['avg']) for point in result]
+
+    url = '/thermostats/101/current-temp/history/?from=0&to=10800'
+    assert {'result': []} == json.loads(app.request(url).data)
+    response = app.request('/thermostats/100/current-temp/')
+    assert '{"result": 79}' == response.data
+
+    for query in ['step=90', 'step=0', 'from=100&to=0', 'from=x',
+                  'from=0&to=100000000']:
+        url = '/thermostats/100/current-temp/history/?' + query
+        assert '400 Bad Request' == app.request(url).status
+    url = '/thermostats/102/current-temp/history/'
+    assert '404 Not Found' == app.request(url).status
+
+
+def test_get_stats():
+    service = Service()
+    app = Server(service).app
+    response = app.request('/thermostats/stats/')
+    assert '200 OK' == response.status
+    assert {'result': {
+        'count': 2,
+        'operating-mode': {'cool': 0, 'heat': 2, 'off': 0},
+        'fan-mode': {'auto': 2, 'on': 0},
+        'average': {'current-temp': 70.0, 'cool-setpoint': 75.0,
+                    'heat-setpoint': 65.0},
+    }} == json.loads(response.data)
+    tag = response.headers['ETag']
+    summaries = []
+    service.stats = lambda *args: summaries.append(args)
+    response = app.request('/thermostats/stats/',
+                           headers={'If-None-Match': tag})
+    assert '304 Not Modified' == response.status
+    assert [] == summaries
+    del service.stats
+
+    service.update(101, {'operating-mode': 'cool', 'cool-setpoint': 71})
+    service.record_temperature(100, 75)
+    response = app.request('/thermostats/stats/?group-by=operating-mode',
+                           headers={'If-None-Match': tag})
+    result = json.loads(response.data)['result']
+    assert ['cool', 'heat', 'off'] == sorted(result)
+    assert 1 == result['cool']['count']
+    assert {'current-temp': 69.0, 'cool-setpoint': 71.0,
+            'heat-setpoint': 65.0} == result['cool']['average']
+    assert 75.0 == result['heat']['average']['current-temp']
+    assert {'count': 0, 'operating-mode': {'cool': 0, 'heat': 0, 'off': 0},
+            'fan-mode': {'auto': 0, 'on': 0},
+            'average': {'current-temp': None, 'cool-setpoint': None,
+                        'heat-setpoint': None}} == result['off']
+
+    result = json.loads(app.request(
+        '/thermostats/stats/?group-by=fan-mode').data)['result']
+    assert 2 == result['auto']['count']
+    response = app.request('/thermostats/stats/?group-by=name')
+    assert '400 Bad Request' == response.status
+
+
+def test_device_changes():
+    simulator = DeviceSimulator()
+    simulator.start()
+    try:
+        transport = Transport.discover([simulator.server_address])
+        app = Server(DeviceService(transport)).app
+        for url in ['/thermostats/', '/thermostats/stats/']:
+            response = app.request(url)
+            assert '200 OK' == response.status
+            assert 'ETag' not in response.headers
+        assert 71 == json.loads(
+            app.request('/thermostats/').data)['result'][0]['current-temp']
+
+        # Changes made on the devices show up in every response
+        simulator.tick()
+        response = app.request('/thermostats/100/')
+        assert 70 == json.loads(response.data)['result']['current-temp']
+        response = app.request('/thermostats/')
+        assert 70 == json.loads(response.data)['result'][0]['current-temp']
+        response = app.request('/thermostats/stats/')
+        assert 69.0 == json.loads(
+            response.data)['result']['average']['current-temp']
+        transport.close()
+    finally:
+        simulator.stop()
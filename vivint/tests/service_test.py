@@ -1,6 +1,12 @@
+import itertools
 import pytest
+import random
+import sys
+import threading
 
+from vivint import service as service_module
 from vivint.errors import *
+from vivint.fleet import thermostats
 from vivint.service import Service
 
 
@@ -96,3 +102,219 @@ def setpoint_validation(name):
     for value in range(30, 101):
         service.set_attribute(100, name, value)
         assert value == service.get_attribute(100, name)
+
+
+def test_versions():
+    service = Service()
+    assert (0, 0, 0) == (service.version(), service.version(100),
+                         service.version(101))
+
+    service.set_attribute(100, 'cool-setpoint', 80)
+    service.set_attribute('100', 'heat-setpoint', 60)
+    assert (2, 2, 0) == (service.version(), service.version(100),
+                         service.version(101))
+
+    with pytest.raises(ValidationError):
+        service.set_attribute(101, 'cool-setpoint', 101)
+    assert (2, 0) == (service.version(), service.version(101))
+
+    with pytest.raises(UnknownThermostatError):
+        service.version(102)
+
+    assert Service().epoch != Service().epoch
+
+
+def test_custom_thermostats():
+    thermostat = {
+        'id': 7,
+        'name': 'Garage',
+        'current-temp': 50,
+        'operating-mode': 'off',
+        'cool-setpoint': 90,
+        'heat-setpoint': 40,
+        'fan-mode': 'on'
+    }
+    service = Service([thermostat])
+    assert [thermostat] == list(service.thermostats())
+    assert thermostat == service.thermostat(7)
+
+    service.set_attribute(7, 'heat-setpoint', '45')
+    assert 45 == service.get_attribute(7, 'heat-setpoint')
+    assert 40 == thermostat['heat-setpoint']
+
+    with pytest.raises(UnknownThermostatError):
+        service.thermostat(100)
+
+
+def test_find():
+    service = Service()
+    assert [100, 101] == service.find({})
+    assert [100, 101] == service.find({'operating-mode': 'heat'})
+    assert [] == service.find({'operating-mode': 'cool'})
+
+    service.update(101, {'operating-mode': 'cool', 'cool-setpoint': 70})
+    assert [100] == service.find({'operating-mode': 'heat'})
+    assert [101] == service.find({'operating-mode': u'cool'})
+    assert [101] == service.find({'cool-setpoint': (None, 72)})
+    assert [100] == service.find({'cool-setpoint': 75, 'fan-mode': 'auto'})
+    assert [101] == service.find({'current-temp': (60, 70)})
+    assert [] == service.find({'operating-mode': 'cool', 'cool-setpoint': 75})
+
+    with pytest.raises(UnknownAttributeError):
+        service.find({'size': 5})
+
+
+def matches(value, condition):
+    if isinstance(condition, tuple):
+        low, high = condition
+        return (low is None or value >= low) and \
+            (high is None or value <= high)
+    return value == condition
+
+
+def test_filtered_pages(monkeypatch):
+    service = Service(thermostats(5000))
+    rng = random.Random(3)
+    for id in range(5000):
+        service.update(id, {
+            'operating-mode': rng.choice(['cool', 'heat', 'off']),
+            'fan-mode': rng.choice(['auto', 'on']),
+            'cool-setpoint': rng.randint(70, 90),
+        })
+    records = [service.thermostat(id) for id in range(5000)]
+    for criteria in [{'fan-mode': 'on'},
+                     {'operating-mode': 'off', 'cool-setpoint': (75, 80)},
+                     {'operating-mode': 'cool', 'fan-mode': 'auto',
+                      'cool-setpoint': 88, 'current-temp': (None, 70)}]:
+        expected = [t['id'] for t in records
+                    if all(matches(t[name], condition)
+                           for name, condition in criteria.items())]
+        assert expected == service.find(criteria)
+        assert expected[10:20] == list(itertools.islice(
+            service.ids(after=expected[9], criteria=criteria), 10))
+
+    # A page only searches as far as the ids it produces
+    searches = []
+    seek = service_module._seek
+    monkeypatch.setattr(service_module, '_seek',
+                        lambda *args: searches.append(1) or seek(*args))
+    criteria = {'operating-mode': 'off', 'fan-mode': 'on'}
+    page = list(itertools.islice(service.ids(2500, criteria), 10))
+    assert 10 == len(page)
+    assert len(searches) < 100
+
+
+VALUES = [None, '', True, 29, 30, 75, 100, 101, 2 ** 70, 75.5, '75', u'75',
+          ' 75', '075', '20', 'abc', [], {}, 'auto', u'on', 'high', 'cool',
+          'heat', u'off', 'Attic']
+
+
+def expected(service, name, value):
+    try:
+        service._validate(name, value)
+    except ServiceError as e:
+        return e.message
+    return 'ok'
+
+
+def test_validate_many():
+    service = Service()
+    names = ['name', 'operating-mode', 'cool-setpoint', 'heat-setpoint',
+             'fan-mode', 'id', 'size']
+    changes = dict((id, dict((name, value) for name in names))
+                   for id, value in enumerate(VALUES))
+    result = service.validate_many(changes)
+    for id, value in enumerate(VALUES):
+        for name in names:
+            assert expected(service, name, value) == result[id][name]
+
+    setpoints = [29, 30, 75, 100, 101, -5]
+    result = service.validate_many(dict(
+        (id, {'cool-setpoint': value}) for id, value in enumerate(setpoints)))
+    for id, value in enumerate(setpoints):
+        assert expected(service, 'cool-setpoint', value) == \
+            result[id]['cool-setpoint']
+    assert 0 == service.version()
+
+
+def test_update_many():
+    service = Service()
+    result = service.update_many({
+        100: {'cool-setpoint': '80', 'fan-mode': 'high'},
+        101: {'heat-setpoint': 20, 'name': 'Attic'},
+        102: {'name': 'Attic'},
+    })
+    assert {'cool-setpoint': 'ok', 'fan-mode': expected(
+        service, 'fan-mode', 'high')} == result[100]
+    assert 'ok' == result[101]['name']
+    assert 'unknown thermostat 102' == result[102]['name']
+    assert 80 == service.get_attribute(100, 'cool-setpoint')
+    assert 'auto' == service.get_attribute(100, 'fan-mode')
+    assert 'Attic' == service.get_attribute(101, 'name')
+    assert 65 == service.get_attribute(101, 'heat-setpoint')
+
+
+def test_concurrent_updates():
+    service = Service([{
+        'id': id,
+        'name': 'Thermostat {}'.format(id),
+        'current-temp': 70,
+        'operating-mode': 'heat',
+        'cool-setpoint': 75,
+        'heat-setpoint': 65,
+        'fan-mode': 'auto'
+    } for id in range(8)])
+    changes = {}
+    service.subscribe(
+        lambda id, name, value: changes.setdefault(id, []).append(value)
+        if name == 'cool-setpoint' else None)
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    def write(seed):
+        rand = random.Random(seed)
+        for _ in range(500):
+            setpoint = rand.randint(40, 100)
+            service.update(rand.randrange(8), {
+                'cool-setpoint': setpoint,
+                'heat-setpoint': setpoint - 10,
+                'fan-mode': rand.choice(['auto', 'on']),
+            })
+
+    def read():
+        while writing.is_set():
+            for thermostat in service.thermostats():
+                if thermostat['cool-setpoint'] - \
+                        thermostat['heat-setpoint'] != 10 and \
+                        thermostat['cool-setpoint'] != 75:
+                    errors.append(thermostat)
+            service.find({'fan-mode': 'on', 'name': 'Thermostat 1'})
+
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        writers = [threading.Thread(target=write, args=(seed,))
+                   for seed in range(4)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        writing.clear()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setcheckinterval(interval)
+
+    assert [] == errors
+    assert 2000 == service.version()
+    assert 2000 == sum(service.version(id) for id in range(8))
+    for thermostat in service.thermostats():
+        id = thermostat['id']
+        assert changes[id][-1] == thermostat['cool-setpoint']
+        assert id in service.find({
+            'cool-setpoint': thermostat['cool-setpoint'],
+            'heat-setpoint': thermostat['heat-setpoint'],
+            'fan-mode': thermostat['fan-mode'],
+        })
@@ -0,0 +1,142 @@
+import itertools
+import json
+import pytest
+import socket
+import subprocess
+import sys
+import time
+
+from vivint.errors import (GatewayError, UnknownAttributeError,
+                           UnknownThermostatError)
+from vivint.fleet import thermostats
+from vivint.server import Server
+from vivint.service import Service
+from vivint.shards import HashRing, ShardedService
+from vivint.simulator import DeviceSimulator
+from vivint.transport import Pool
+
+
+@pytest.fixture(scope='module')
+def shards():
+    ports = []
+    for _ in range(3):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        ports.append(sock.getsockname()[1])
+        sock.close()
+    addresses = [('127.0.0.1', port) for port in ports]
+    text = ','.join('127.0.0.1:{}'.format(port) for port in ports)
+    processes = [subprocess.Popen(
+        [sys.executable, '-m', 'vivint', 'shard', '--thermostats', '60',
+         text, str(index)]) for index in range(3)]
+    try:
+        for address in addresses:
+            for attempt in itertools.count():
+                try:
+                    socket.create_connection(address, 1).close()
+                    break
+                except socket.error:
+                    if attempt == 100:
+                        raise
+                    time.sleep(0.05)
+        yield addresses
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def test_ring_balance():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    counts = {}
+    for id in range(20000):
+        node = ring.node(id)
+        counts[node] = counts.get(node, 0) + 1
+    assert all(3500 < count < 6500 for count in counts.values())
+
+
+def test_ring_rebalance():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    before = dict((id, ring.node(id)) for id in range(20000))
+    ring.remove('c')
+    moved = [id for id in before if ring.node(id) != before[id]]
+    assert set(before[id] for id in moved) == {'c'}
+    assert len(moved) == before.values().count('c')
+
+    ring.add('c')
+    assert before == dict((id, ring.node(id)) for id in range(20000))
+    ring = HashRing(['d', 'c', 'b', 'a'])
+    assert before == dict((id, ring.node(id)) for id in range(20000))
+
+    with pytest.raises(ValueError):
+        ring.add('a')
+    with pytest.raises(LookupError):
+        HashRing().node(1)
+
+
+def test_routing(shards):
+    service = ShardedService(shards)
+    fleet = Service(thermostats(60))
+    assert range(60) == service._ids
+    assert fleet.thermostat(7) == service.thermostat(7)
+
+    service.set_attribute(7, 'fan-mode', 'on')
+    service.update(8, {'cool-setpoint': 80, 'heat-setpoint': 60})
+    assert 'on' == service.get_attribute(7, 'fan-mode')
+    assert 80 == service.thermostat(8)['cool-setpoint']
+    assert (2, 1, 1) == (service.version(), service.version(7),
+                         service.version(8))
+    with pytest.raises(UnknownThermostatError):
+        service.thermostat(60)
+    service.close()
+
+
+def test_scatter_gather(shards):
+    service = ShardedService(shards, batch=7)
+    fleet = Service(thermostats(60))
+    fleet.set_attribute(7, 'fan-mode', 'on')
+    fleet.update(8, {'cool-setpoint': 80, 'heat-setpoint': 60})
+    assert list(fleet.thermostats()) == list(service.thermostats())
+    assert list(fleet.thermostats(after=41)) == \
+        list(service.thermostats(after=41))
+
+    criteria = {'operating-mode': 'off', 'cool-setpoint': (76, None)}
+    assert [8] == service.find(criteria)
+    criteria = {'fan-mode': 'on', 'current-temp': (62, 70)}
+    assert fleet.find(criteria) == service.find(criteria)
+    assert list(fleet.thermostats(after=20, criteria=criteria)) == \
+        list(service.thermostats(after=20, criteria=criteria))
+    with pytest.raises(UnknownAttributeError):
+        service.find({'size': 5})
+
+    app = Server(service).app
+    response = app.request('/thermostats/?limit=5&cursor=10')
+    assert '200 OK' == response.status
+    result = json.loads(response.data)['result']
+    assert range(11, 16) == [thermostat['id'] for thermostat in result]
+    service.close()
+
+
+def test_misplaced_thermostats():
+    # Both shards are in the ring but one holds the whole fleet
+    simulators = [DeviceSimulator(thermostats(20)), DeviceSimulator([])]
+    for simulator in simulators:
+        simulator.start()
+    try:
+        with pytest.raises(ValueError):
+            ShardedService([s.server_address for s in simulators])
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+def test_unavailable_shard(shards):
+    service = ShardedService(shards)
+    simulator = DeviceSimulator()
+    simulator.start()
+    simulator.stop()
+    address = simulator.server_address
+    service.transport._pools[address] = Pool(address, timeout=0.5)
+    with pytest.raises(GatewayError):
+        list(service.thermostats())
+    service.close()
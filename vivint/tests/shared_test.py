@@ -0,0 +1,95 @@
+import httplib
+import json
+import os
+import pytest
+import signal
+import socket
+
+from vivint.errors import *
+from vivint.eventloop import serve_workers
+from vivint.server import Server
+from vivint.service import Service
+from vivint.shared import SharedService
+
+
+def test_matches_service():
+    shared = SharedService()
+    service = Service()
+    assert json.dumps(list(service.thermostats())) == \
+        json.dumps(list(shared.thermostats()))
+
+    for name, value in [('name', u'Attic'), ('operating-mode', 'cool'),
+                        ('cool-setpoint', 80), ('heat-setpoint', 60),
+                        ('fan-mode', u'on')]:
+        service.set_attribute(100, name, value)
+        shared.set_attribute(100, name, value)
+        assert json.dumps(service.thermostat(100)) == \
+            json.dumps(shared.thermostat(100))
+
+    for name in ['name', 'operating-mode', 'cool-setpoint', 'fan-mode']:
+        with pytest.raises(ValidationError):
+            shared.set_attribute(100, name, None)
+    with pytest.raises(ValidationError):
+        shared.set_attribute(100, 'name', 'x' * 64)
+    with pytest.raises(ReadonlyError):
+        shared.set_attribute(100, 'current-temp', 80)
+    with pytest.raises(UnknownAttributeError):
+        shared.set_attribute(100, 'size', 80)
+    with pytest.raises(UnknownThermostatError):
+        shared.set_attribute(102, 'name', 'Attic')
+    with pytest.raises(UnknownAttributeError):
+        shared.get_attribute(100, 'size')
+    assert (5, 5, 0) == (shared.version(), shared.version(100),
+                         shared.version(101))
+
+
+def test_writes_visible_across_processes():
+    service = SharedService()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            service.set_attribute(101, 'operating-mode', 'cool')
+            service.set_attribute(101, 'name', 'Basement')
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert 'cool' == service.get_attribute(101, 'operating-mode')
+    assert 'Basement' == service.get_attribute(101, 'name')
+    assert (2, 0, 2) == (service.version(), service.version(100),
+                         service.version(101))
+
+
+def test_serve_workers():
+    service = SharedService()
+    app = Server(service).app.wsgifunc()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    port = sock.getsockname()[1]
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve_workers(app, workers=3, sock=sock)
+        finally:
+            os._exit(0)
+    sock.close()
+
+    try:
+        for value in range(60, 80):
+            conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+            headers = {'Content-Type': 'application/json'}
+            conn.request('PUT', '/thermostats/100/cool-setpoint/',
+                         json.dumps(value), headers)
+            assert 204 == conn.getresponse().status
+            conn.close()
+
+            conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/thermostats/100/')
+            response = json.loads(conn.getresponse().read())
+            assert value == response['result']['cool-setpoint']
+            conn.close()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
@@ -0,0 +1,39 @@
+import random
+
+from vivint.fleet import thermostats
+from vivint.service import Service
+from vivint.stats import FleetStats
+
+
+def scanned(service, group_by=None):
+    stats = FleetStats(service._data.values())
+    return stats.summary(group_by)
+
+
+def test_incremental_matches_scan():
+    service = Service(thermostats(500))
+    rand = random.Random(7)
+    for _ in range(2000):
+        id = rand.randrange(500)
+        change = rand.choice([
+            {'operating-mode': rand.choice(['cool', 'heat', 'off'])},
+            {'fan-mode': rand.choice(['auto', 'on'])},
+            {'cool-setpoint': rand.randint(60, 90),
+             'heat-setpoint': rand.randint(50, 70)},
+        ])
+        if rand.random() < 0.2:
+            service.record_temperature(id, rand.randint(55, 85))
+        else:
+            service.update(id, change)
+    for group_by in [None, 'operating-mode', 'fan-mode']:
+        assert scanned(service, group_by) == service.stats(group_by)
+    summary = service.stats()
+    assert 500 == summary['count']
+    assert 500 == sum(summary['operating-mode'].values())
+
+
+def test_services_without_totals():
+    service = Service(thermostats(30))
+    service._stats = None
+    expected = Service(thermostats(30)).stats('fan-mode')
+    assert expected == service.stats('fan-mode')
@@ -0,0 +1,211 @@
+import json
+import pytest
+import socket
+import threading
+import time
+
+from vivint.devices import CachedDeviceService, DeviceService
+from vivint.errors import DeviceError, UnknownThermostatError
+from vivint.server import Server
+from vivint.simulator import DeviceSimulator
+from vivint.transport import Transport
+
+
+@pytest.fixture
+def simulator():
+    simulator = DeviceSimulator()
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+def test_connection_reuse(simulator):
+    transport = Transport.discover([simulator.server_address])
+    for _ in range(20):
+        assert 100 == transport.fetch(100)['id']
+        transport.apply(101, {'fan-mode': 'on'})
+    assert 'on' == transport.fetch(101)['fan-mode']
+    assert 20 == transport.fetch(101)['version']
+    # One connection to discover the devices and one for the requests
+    assert 2 == simulator.connections
+    transport.close()
+
+
+def test_coalesced_fetches(simulator):
+    simulator.latency = 0.2
+    transport = Transport.discover([simulator.server_address])
+    simulator.requests = 0
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        transport.fetch(100))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 8 == len(results)
+    assert 1 == simulator.requests
+
+    transport.fetch(100)
+    assert 2 == simulator.requests
+    transport.close()
+
+
+def test_pipelined_requests(simulator):
+    simulator.latency = 0.05
+    transport = Transport.discover([simulator.server_address], size=1)
+    threads = [threading.Thread(target=transport.fetch, args=(id,))
+               for id in [100, 101] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 2 == simulator.connections
+    transport.close()
+
+
+def test_failures(simulator):
+    transport = Transport.discover([simulator.server_address], timeout=0.1)
+    with pytest.raises(UnknownThermostatError):
+        transport.fetch(102)
+    with pytest.raises(DeviceError):
+        transport.apply(100, {'fan-mode': 'high'})
+
+    simulator.latency = 0.3
+    with pytest.raises(DeviceError):
+        transport.fetch(100)
+    transport.close()
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    address = sock.getsockname()
+    sock.close()
+    transport = Transport({100: address})
+    with pytest.raises(DeviceError):
+        transport.fetch(100)
+
+
+def test_server(simulator):
+    transport = Transport.discover([simulator.server_address], timeout=0.2)
+    app = Server(DeviceService(transport)).app
+
+    response = app.request('/thermostats/')
+    assert [100, 101] == [t['id'] for t in json.loads(response.data)['result']]
+
+    response = app.request('/thermostats/100/cool-setpoint/', method='PUT',
+                           data='80',
+                           headers={'Content-Type': 'application/json'})
+    assert '204 No Content' == response.status
+    assert 80 == simulator.service.get_attribute(100, 'cool-setpoint')
+    response = app.request('/thermostats/100/cool-setpoint/')
+    assert '{"result": 80}' == response.data
+
+    simulator.latency = 0.4
+    response = app.request('/thermostats/101/')
+    assert '504 Gateway Timeout' == response.status
+    transport.close()
+
+
+def test_cached_service(simulator):
+    now = [0]
+    transport = Transport.discover([simulator.server_address])
+    service = CachedDeviceService(transport, stale=10, clock=lambda: now[0])
+    simulator.requests = 0
+    assert 71 == service.get_attribute(100, 'current-temp')
+    assert 'Upstairs Thermostat' == service.get_attribute(100, 'name')
+    assert 1 == simulator.requests
+
+    # Expired but usable while it is refetched in the background
+    now[0] = 6
+    simulator.service._data[100].current_temp = 75
+    assert 'Upstairs Thermostat' == service.get_attribute(100, 'name')
+    assert 71 == service.get_attribute(100, 'current-temp')
+    for _ in range(100):
+        if service.get_attribute(100, 'current-temp') == 75:
+            break
+        time.sleep(0.01)
+    assert 75 == service.get_attribute(100, 'current-temp')
+    assert 2 == simulator.requests
+
+    # Too old to use
+    now[0] = 30
+    simulator.service._data[100].current_temp = 72
+    assert 72 == service.thermostat(100)['current-temp']
+    assert 3 == simulator.requests
+
+    service.set_attribute(100, 'fan-mode', 'on')
+    assert 4 == simulator.requests
+    assert 'on' == service.get_attribute(100, 'fan-mode')
+    assert 'on' == service.thermostat(100)['fan-mode']
+    assert 4 == simulator.requests
+    transport.close()
+
+
+def test_write_window(simulator):
+    transport = Transport.discover([simulator.server_address])
+    service = CachedDeviceService(transport, window=60)
+    app = Server(service).app
+    service.thermostat(100)
+    simulator.requests = 0
+
+    versions = []
+    for value in range(70, 80):
+        response = app.request('/thermostats/100/cool-setpoint/',
+                               method='PUT', data=str(value),
+                               headers={'Content-Type': 'application/json'})
+        assert '204 No Content' == response.status
+        versions.append(service.version(100))
+    response = app.request('/thermostats/100/cool-setpoint/', method='PUT',
+                           data='200',
+                           headers={'Content-Type': 'application/json'})
+    assert '400 Bad Request' == response.status
+    assert 0 == simulator.requests
+    assert 79 == service.get_attribute(100, 'cool-setpoint')
+    assert 79 == service.thermostat(100)['cool-setpoint']
+    assert range(1, 11) == versions
+
+    service.writes.flush()
+    assert 1 == simulator.requests
+    assert 79 == simulator.service.get_attribute(100, 'cool-setpoint')
+    assert 1 == simulator.service.version(100)
+    assert 10 == service.version(100)
+
+    service.set_attribute(100, 'fan-mode', 'on')
+    assert 11 == service.version(100)
+    service.close()
+    assert 'on' == simulator.service.get_attribute(100, 'fan-mode')
+    assert 11 == service.version(100)
+    transport.close()
+
+
+def test_temperature_history():
+    simulator = DeviceSimulator(interval=0.01)
+    simulator.start()
+    try:
+        transport = Transport.discover([simulator.server_address])
+        service = CachedDeviceService(transport, ttls={'current-temp': 0})
+        app = Server(service).app
+        temperatures = set()
+        for _ in range(100):
+            temperatures.add(service.get_attribute(101, 'current-temp'))
+            if len(temperatures) > 2:
+                break
+            time.sleep(0.01)
+        assert len(temperatures) > 2
+
+        # Samples are taken from the states fetched from the device
+        response = app.request('/thermostats/101/current-temp/history/')
+        assert '200 OK' == response.status
+        points = json.loads(response.data)['result']
+        assert min(temperatures) <= points[-1]['min']
+        assert sum(point['count'] for point in points) >= 3
+
+        # A reported temperature is only added to the history
+        service.record_temperature(101, 90)
+        assert 90 == service.temperature_history(
+            101, 0, time.time() + 60, 60)[-1]['max']
+        assert 90 != simulator.service.get_attribute(101, 'current-temp')
+        with pytest.raises(UnknownThermostatError):
+            service.record_temperature(102, 90)
+        transport.close()
+    finally:
+        simulator.stop()
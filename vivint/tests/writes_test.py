@@ -0,0 +1,70 @@
+import threading
+import time
+
+from vivint.writes import WriteQueue
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_window():
+    commits = []
+    queue = WriteQueue(lambda id, values: commits.append((id, values)),
+                       window=0.1)
+    for value in range(70, 80):
+        queue.submit(100, {'cool-setpoint': value})
+    queue.submit(101, {'fan-mode': 'on'})
+    assert [] == commits
+    assert wait_for(lambda: len(commits) == 2)
+    assert [(100, {'cool-setpoint': 79}), (101, {'fan-mode': 'on'})] == \
+        sorted(commits)
+    assert (11, 2) == (queue.submitted, queue.batches)
+    assert {} == queue.pending(100)
+
+    queue.submit(100, {'cool-setpoint': 70})
+    queue.close()
+    assert (100, {'cool-setpoint': 70}) == commits[-1]
+
+
+def test_failed_commit():
+    commits = []
+    attempts = []
+
+    def commit(id, values):
+        attempts.append(values)
+        if len(attempts) == 1:
+            raise IOError('unreachable')
+        commits.append(values)
+
+    queue = WriteQueue(commit, window=0.05)
+    queue.submit(100, {'cool-setpoint': 78, 'fan-mode': 'on'})
+    assert wait_for(lambda: attempts)
+    queue.submit(100, {'cool-setpoint': 80})
+    assert wait_for(lambda: commits)
+    assert [{'cool-setpoint': 80, 'fan-mode': 'on'}] == commits
+    assert 1 == queue.batches
+    queue.close()
+
+
+def test_pending_while_committing():
+    started = threading.Event()
+    release = threading.Event()
+
+    def commit(id, values):
+        started.set()
+        release.wait()
+
+    queue = WriteQueue(commit, window=0)
+    queue.submit(100, {'cool-setpoint': 78, 'fan-mode': 'on'})
+    assert started.wait(1)
+    queue.submit(100, {'cool-setpoint': 80})
+    assert {'cool-setpoint': 80, 'fan-mode': 'on'} == queue.pending(100)
+    release.set()
+    queue.close()
+    assert {} == queue.pending(100)
+    assert 2 == queue.batches
@@ -0,0 +1,363 @@
+import itertools
+import json
+import logging
+import socket
+import threading
+
+from errors import DeviceError, GatewayError, UnknownThermostatError
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """The eventual response to a request made to a device"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._response = None
+        self._error = None
+
+    def set(self, response):
+        self._response = response
+        self._event.set()
+
+    def fail(self, error):
+        self._error = error
+        self._event.set()
+
+    def wait(self, timeout):
+        """Return the response, raising the error if the call failed
+
+        None is returned if no response arrived within the timeout.
+        """
+        self._event.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+
+class Connection:
+    """A pipelined connection to a device or gateway
+
+    Requests are JSON objects sent one per line, each tagged with a
+    sequence number that the device echoes in its response. Any number
+    of requests may be outstanding at once and a reader thread hands
+    each response to the call waiting for it.
+    """
+
+    def __init__(self, address, timeout):
+        """Connect to the device at a (host, port) address"""
+        self.address = address
+        self._sock = socket.create_connection(address, timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._sequence = itertools.count(1)
+        self.closed = False
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+
+    @property
+    def pending(self):
+        """The number of requests awaiting a response"""
+        return len(self._pending)
+
+    def request(self, message):
+        """Send a request, returning the call that will receive the response
+
+        A socket.error is raised if the connection is closed.
+        """
+        call = _Call()
+        with self._lock:
+            if self.closed:
+                raise socket.error('connection to {}:{} is closed'.format(
+                    *self.address))
+            sequence = next(self._sequence)
+            self._pending[sequence] = call
+            message = dict(message, seq=sequence)
+            try:
+                self._sock.sendall(json.dumps(message) + '\n')
+            except socket.error:
+                del self._pending[sequence]
+                raise
+        call.sequence = sequence
+        return call
+
+    def cancel(self, call):
+        """Stop waiting for the response to a call"""
+        with self._lock:
+            self._pending.pop(call.sequence, None)
+
+    def close(self, error=None):
+        """Close the connection, failing every outstanding call"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+        error = error or socket.error('connection closed')
+        for call in pending.values():
+            call.fail(error)
+
+    def _read(self):
+        error = None
+        try:
+            reader = self._sock.makefile('rb')
+            for line in iter(reader.readline, ''):
+                response = json.loads(line)
+                with self._lock:
+                    call = self._pending.pop(response.get('seq'), None)
+                if call is not None:
+                    call.set(response)
+        except (socket.error, ValueError) as e:
+            error = e
+        finally:
+            self.close(error)
+
+
+class Pool:
+    """A bounded pool of connections to one device or gateway
+
+    Connections are opened as they are needed, up to size of them, and
+    requests are sent over the connection with the fewest outstanding.
+    At most limit requests may be outstanding through the pool at once,
+    further requests wait for one of those to complete.
+    """
+
+    def __init__(self, address, size=2, limit=32, timeout=1.0):
+        """Create a pool of connections to a (host, port) address"""
+        self.address = address
+        self.size = size
+        self.limit = limit
+        self.timeout = timeout
+        self._connections = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._connecting = threading.Lock()
+        self._outstanding = 0
+
+    def request(self, message):
+        """Send a request and wait for the response
+
+        A socket.error is raised if the device cannot be reached or
+        does not respond within the timeout.
+        """
+        with self._available:
+            while self._outstanding >= self.limit:
+                self._available.wait()
+            self._outstanding += 1
+        try:
+            for attempt in range(2):
+                connection = self._connection()
+                try:
+                    call = connection.request(message)
+                except socket.error:
+                    # The connection may have gone stale while idle, the
+                    # request was not sent so it is safe to send it again
+                    if attempt:
+                        raise
+                    continue
+                response = call.wait(self.timeout)
+                if response is None:
+                    connection.cancel(call)
+                    raise socket.timeout('timed out')
+                return response
+        finally:
+            with self._available:
+                self._outstanding -= 1
+                self._available.notify()
+
+    def close(self):
+        """Close every connection in the pool"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def _connection(self):
+        connection = self._choose()
+        if connection is None:
+            # Connections are opened one at a time so that concurrent
+            # requests do not open more than the pool allows
+            with self._connecting:
+                connection = self._choose()
+                if connection is None:
+                    connection = Connection(self.address, self.timeout)
+                    with self._lock:
+                        self._connections.append(connection)
+        return connection
+
+    def _choose(self):
+        with self._lock:
+            self._connections = [c for c in self._connections
+                                 if not c.closed]
+            if not self._connections:
+                return None
+            idle = min(self._connections, key=lambda c: c.pending)
+            if idle.pending == 0 or len(self._connections) >= self.size:
+                return idle
+            return None
+
+
+class Transport:
+    """Requests to thermostats over pooled device connections
+
+    Each thermostat is reached at the address of its device, or of a
+    gateway serving several devices, and one pool of connections is kept
+    per address. Concurrent fetches of the same thermostat share a
+    single round trip, while a change to a thermostat ensures fetches
+    started after it see its effect.
+    """
+
+    def __init__(self, devices, size=2, limit=32, timeout=1.0):
+        """Create a transport to the devices at the given addresses
+
+        The devices map thermostat ids to (host, port) addresses. Each
+        address may have at most size connections and limit outstanding
+        requests, and requests fail after timeout seconds.
+        """
+        self.devices = dict(devices)
+        self._pools = {}
+        for address in set(self.devices.values()):
+            self._pools[address] = Pool(address, size, limit, timeout)
+        self._lock = threading.Lock()
+        self._fetches = {}
+
+    @classmethod
+    def discover(cls, addresses, **options):
+        """Create a transport to every thermostat served at the addresses
+
+        Each address is asked for the ids of the thermostats it serves.
+        """
+        devices = {}
+        for address in addresses:
+            pool = Pool(address, size=1, timeout=options.get('timeout', 1.0))
+            try:
+                for id in pool.request({'op': 'list'})['ids']:
+                    devices[id] = address
+            finally:
+                pool.close()
+        return cls(devices, **options)
+
+    def fetch(self, id):
+        """Return the state of a thermostat, including its version
+
+        An UnknownThermostatError is raised for ids without a device and
+        a DeviceError if the device cannot be reached.
+        """
+        with self._lock:
+            call = self._fetches.get(id)
+            leader = call is None
+            if leader:
+                call = self._fetches[id] = _Call()
+        if not leader:
+            return call.wait(None)
+
+        try:
+            state = self._request(id, {'op': 'get', 'id': id})['state']
+            call.set(state)
+            return state
+        except Exception as e:
+            call.fail(e)
+            raise
+        finally:
+            with self._lock:
+                if self._fetches.get(id) is call:
+                    del self._fetches[id]
+
+    def apply(self, id, values):
+        """Set attributes on a thermostat, returning its new state"""
+        with self._lock:
+            # Later fetches must not join one started before the change
+            self._fetches.pop(id, None)
+        response = self._request(id, {'op': 'set', 'id': id,
+                                      'values': values})
+        for name, result in response['results'].items():
+            if result != 'ok':
+                raise DeviceError(id, '{} rejected: {}'.format(name, result))
+        return response['state']
+
+    def request(self, address, message):
+        """Send a request to an address and return the response
+
+        A GatewayError is raised if the address cannot be reached or
+        responds with an error.
+        """
+        try:
+            response = self._pools[address].request(message)
+        except socket.error as e:
+            logger.warn('request to %s:%s failed: %s', address[0],
+                        address[1], e)
+            raise GatewayError(address, str(e) or e.__class__.__name__)
+        if 'error' in response:
+            raise GatewayError(address, response['error'])
+        return response
+
+    def broadcast(self, message):
+        """Send a request to every address at once
+
+        The responses are returned in a dict by address once they have
+        all arrived, or the first GatewayError raised.
+        """
+        responses = {}
+
+        def send(address):
+            try:
+                responses[address] = self.request(address, message)
+            except GatewayError as e:
+                responses[address] = e
+
+        threads = [threading.Thread(target=send, args=(address,))
+                   for address in self._pools]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for response in responses.values():
+            if isinstance(response, GatewayError):
+                raise response
+        return responses
+
+    def close(self):
+        """Close every connection"""
+        for pool in self._pools.values():
+            pool.close()
+
+    def _request(self, id, message):
+        try:
+            address = self.devices[id]
+        except KeyError:
+            raise UnknownThermostatError(id)
+        try:
+            response = self._pools[address].request(message)
+        except socket.error as e:
+            logger.warn('request to thermostat %s failed: %s', id, e)
+            raise DeviceError(id, str(e) or e.__class__.__name__)
+        if 'error' in response:
+            if response['error'] == 'unknown thermostat':
+                raise UnknownThermostatError(id)
+            raise DeviceError(id, response['error'])
+        return response
+
+
+def parse_addresses(text):
+    """Parse a comma separated list of HOST:PORT addresses
+
+    The host defaults to localhost.
+
+    >>> parse_addresses('gateway:9090,:9091')
+    [('gateway', 9090), ('localhost', 9091)]
+    """
+    addresses = []
+    for address in text.split(','):
+        host, _, port = address.rpartition(':')
+        addresses.append((host or 'localhost', int(port)))
+    return addresses
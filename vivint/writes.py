@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    """A write-behind queue coalescing changes to each thermostat
+
+    Changes submitted for a thermostat are held for window seconds from
+    the first of them, during which later values for the same attribute
+    replace earlier ones, and are then committed together in one batch
+    by a background thread. A burst of changes, such as from a setpoint
+    being dragged across a range, therefore costs one commit per window
+    rather than one per change.
+
+    A batch that fails to commit is queued again, behind any values
+    submitted since, and retried after another window. The submitted
+    and batches attributes count the changes accepted and the batches
+    committed.
+
+    >>> commits = []
+    >>> queue = WriteQueue(lambda id, values: commits.append((id, values)),
+    ...                    window=60)
+    >>> for value in range(70, 80):
+    ...     queue.submit(100, {'cool-setpoint': value})
+    >>> queue.submit(100, {'fan-mode': 'on'})
+    >>> queue.pending(100) == {'cool-setpoint': 79, 'fan-mode': 'on'}
+    True
+    >>> queue.flush()
+    >>> commits == [(100, {'cool-setpoint': 79, 'fan-mode': 'on'})]
+    True
+    >>> queue.close()
+    """
+
+    def __init__(self, commit, window=0.25, clock=time.time):
+        """Create a queue committing batches with commit(id, values)"""
+        self.commit = commit
+        self.window = window
+        self.clock = clock
+        self.submitted = 0
+        self.batches = 0
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._due = {}
+        self._committing = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, id, values):
+        """Queue changes to the attributes of a thermostat"""
+        with self._condition:
+            self._pending.setdefault(id, {}).update(values)
+            self.submitted += 1
+            if id not in self._due:
+                self._due[id] = self.clock() + self.window
+                self._condition.notify()
+
+    def pending(self, id):
+        """Return the changes to a thermostat not yet committed
+
+        Changes being committed are included, with queued changes taking
+        precedence over them, so that reads can reflect every change
+        that has been submitted.
+        """
+        with self._condition:
+            values = dict(self._committing.get(id, ()))
+            values.update(self._pending.get(id, ()))
+        return values
+
+    def flush(self):
+        """Commit every queued change now
+
+        Returns once every batch, including any already being committed
+        by the background thread, has been committed or has failed.
+        """
+        with self._condition:
+            ids = list(self._due)
+        for id in ids:
+            self._commit(id)
+        with self._condition:
+            while self._committing:
+                self._condition.wait()
+
+    def close(self):
+        """Commit every queued change and stop the background thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                now = self.clock()
+                due = [id for id, at in self._due.items() if at <= now]
+                if not due:
+                    delay = min(self._due.values()) - now \
+                        if self._due else None
+                    self._condition.wait(delay)
+                    continue
+            for id in due:
+                self._commit(id)
+
+    def _commit(self, id):
+        with self._condition:
+            while id in self._committing:
+                self._condition.wait()
+            values = self._pending.pop(id, None)
+            self._due.pop(id, None)
+            if values is None:
+                return
+            self._committing[id] = values
+        try:
+            self.commit(id, values)
+        except Exception as e:
+            logger.warning('committing %s to thermostat %s failed: %s',
+                           values, id, e)
+            with self._condition:
+                del self._committing[id]
+                values.update(self._pending.get(id, {}))
+                self._pending[id] = values
+                self._due[id] = self.clock() + self.window
+                self._condition.notify_all()
+            return
+        with self._condition:
+            del self._committing[id]
+            self.batches += 1
+            self._condition.notify_all()